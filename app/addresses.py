@@ -0,0 +1,157 @@
+"""
+Canonical address store.
+
+Billing and shipping addresses are shared between orders and items: every
+write resolves an address to the existing row with the same normalized
+content, identified by its `address_key` (a hash of the normalized fields,
+unique-indexed), and only genuinely new addresses are inserted. Addresses
+owned by a customer (home, office) stay outside the store.
+
+Key, merge and re-point addresses written outside the store (e.g. by older
+code or raw SQL) with:
+
+    python -m app.addresses
+"""
+
+import hashlib
+import sys
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from app import models
+
+# Address fields that make up its identity; `type` is kept so billing and shipping rows stay distinct
+KEY_FIELDS = ("type", "street", "city", "state", "zip_code", "country")
+# Keys per IN (...) lookup, well under SQLite's bound parameter limit
+LOOKUP_BATCH = 5000
+
+UNIQUE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS ux_addresses_address_key ON addresses (address_key)"
+
+
+def normalize(value) -> str:
+    """Case-, punctuation- and whitespace-insensitive form of one address field."""
+    if value is None:
+        return ""
+    return " ".join(str(value).replace(".", " ").replace(",", " ").split()).lower()
+
+
+def address_key(type, street, city, state, zip_code, country="USA") -> str:
+    """
+    Hash of an address's normalized fields.
+
+    Returns:
+        str: 24 hex characters (96 bits); equal for addresses that differ only
+        in case, punctuation or spacing.
+    """
+    normalized = "\x1f".join(normalize(value) for value in (type, street, city, state, zip_code, country or "USA"))
+    return hashlib.sha1(normalized.encode()).hexdigest()[:24]
+
+
+def _lookup(db: Session, keys) -> dict:
+    """Map each existing key in `keys` to its address id."""
+    table = models.Address.__table__
+    keys = list(keys)
+    ids = {}
+    for start in range(0, len(keys), LOOKUP_BATCH):
+        batch = keys[start:start + LOOKUP_BATCH]
+        ids.update(db.execute(
+            select(table.c.address_key, table.c.id).where(table.c.address_key.in_(batch))
+        ).all())
+    return ids
+
+
+def resolve(db: Session, rows) -> list:
+    """
+    Return the canonical address id of each row, inserting new addresses.
+
+    Args:
+        db (Session): SQLAlchemy DB session; the caller commits.
+        rows (list[dict]): Address values keyed by `KEY_FIELDS`.
+
+    Returns:
+        list[int]: Address id for each row, in order.
+    """
+    keys = [address_key(**{field: row.get(field) for field in KEY_FIELDS}) for row in rows]
+    ids = _lookup(db, set(keys))
+
+    new = {}
+    for key, row in zip(keys, rows):
+        if key not in ids and key not in new:
+            new[key] = {**{field: row.get(field) for field in KEY_FIELDS}, "address_key": key}
+    if new:
+        db.execute(
+            sqlite_insert(models.Address.__table__).on_conflict_do_nothing(index_elements=["address_key"]),
+            list(new.values()),
+        )
+        ids.update(_lookup(db, new))
+    return [ids[key] for key in keys]
+
+
+def compact(conn: Connection) -> int:
+    """
+    Bring every shared address into the store.
+
+    Unkeyed addresses are keyed; those matching an existing key, or each
+    other, are merged into the keyed (else lowest) id, with
+    `orders.billing_address_id` and `order_items.shipping_address_id`
+    re-pointed before the duplicates are deleted. Zip rollups stay correct
+    through their triggers, since merged rows share a zip code.
+
+    Args:
+        conn (Connection): Connection inside a transaction on the write engine.
+
+    Returns:
+        int: Number of duplicate addresses removed.
+    """
+    conn.connection.driver_connection.create_function(
+        "pier2_address_key", len(KEY_FIELDS), address_key, deterministic=True
+    )
+    conn.exec_driver_sql("DROP TABLE IF EXISTS temp.address_merges")
+    conn.exec_driver_sql(f"""
+        CREATE TEMP TABLE address_merges AS
+        SELECT id, address_key, canonical_id FROM (
+            SELECT id, address_key, existing,
+                   FIRST_VALUE(id) OVER (PARTITION BY address_key ORDER BY existing DESC, id) AS canonical_id
+            FROM (
+                SELECT id, address_key, 1 AS existing FROM addresses WHERE address_key IS NOT NULL
+                UNION ALL
+                SELECT id, pier2_address_key({", ".join(KEY_FIELDS)}), 0 FROM addresses
+                WHERE address_key IS NULL AND customer_id IS NULL
+            )
+        )
+        WHERE NOT existing""")
+    conn.exec_driver_sql("CREATE INDEX temp.ix_address_merges_id ON address_merges (id)")
+
+    for table, column in (("orders", "billing_address_id"), ("order_items", "shipping_address_id")):
+        conn.exec_driver_sql(f"""
+            UPDATE {table} SET {column} = address_merges.canonical_id
+            FROM address_merges
+            WHERE address_merges.id = {table}.{column} AND address_merges.canonical_id != address_merges.id""")
+    removed = conn.exec_driver_sql(
+        "DELETE FROM addresses WHERE id IN (SELECT id FROM address_merges WHERE canonical_id != id)"
+    ).rowcount
+    conn.exec_driver_sql("""
+        UPDATE addresses SET address_key = address_merges.address_key
+        FROM address_merges
+        WHERE address_merges.id = addresses.id AND address_merges.canonical_id = address_merges.id""")
+    conn.exec_driver_sql("DROP TABLE temp.address_merges")
+    return removed
+
+
+def main(engine: Engine):
+    """Compact the addresses of a database in a single transaction."""
+    with engine.begin() as conn:
+        before = conn.exec_driver_sql("SELECT COUNT(*) FROM addresses").scalar()
+        removed = compact(conn)
+    print(f"Merged {removed} duplicate addresses ({before} -> {before - removed} rows).")
+    return 0
+
+
+if __name__ == "__main__":
+    from app import database, migrations
+
+    migrations.upgrade(database.engine)
+    sys.exit(main(database.engine))
@@ -0,0 +1,109 @@
+"""
+Async versions of the functions in app/crud.py.
+
+Each function runs the corresponding crud query on an AsyncSession through
+`AsyncSession.run_sync`, so both paths share the exact same SQL and result
+shaping while the async path awaits the aiosqlite driver instead of tying up
+a worker thread.
+"""
+
+import itertools
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud
+
+
+async def find_customer_id(email_or_phone: str, db: AsyncSession):
+    """Async version of `crud.find_customer_id`."""
+    return await db.run_sync(lambda session: crud.find_customer_id(email_or_phone, session))
+
+
+async def get_order_history(email_or_phone: str, db: AsyncSession, **filters):
+    """Async version of `crud.get_order_history`; accepts the same filters."""
+    return await db.run_sync(lambda session: crud.get_order_history(email_or_phone, session, **filters))
+
+
+async def find_customer_ids(identifiers, db: AsyncSession):
+    """Async version of `crud.find_customer_ids`."""
+    return await db.run_sync(lambda session: crud.find_customer_ids(identifiers, session))
+
+
+async def search_customers(query: str, db: AsyncSession, **options):
+    """Async version of `crud.search_customers`; accepts the same paging options."""
+    return await db.run_sync(lambda session: crud.search_customers(query, session, **options))
+
+
+async def get_order_histories(identifiers, db: AsyncSession, **filters):
+    """Async version of `crud.get_order_histories`; accepts the same date filters."""
+    return await db.run_sync(lambda session: crud.get_order_histories(identifiers, session, **filters))
+
+
+async def iter_order_history(customer_id: int, db: AsyncSession, batch_size: int = 500, **filters):
+    """
+    Async version of `crud.iter_order_history`.
+
+    Filters are validated when awaited; the returned async generator then
+    loads one batch of `batch_size` orders per round trip.
+
+    Raises:
+        ValueError: If a cursor or date is malformed.
+    """
+    orders = await db.run_sync(
+        lambda session: crud.iter_order_history(customer_id, session, batch_size=batch_size, **filters)
+    )
+
+    async def batches():
+        while True:
+            batch = await db.run_sync(lambda session: list(itertools.islice(orders, batch_size)))
+            for order in batch:
+                yield order
+            if len(batch) < batch_size:
+                return
+
+    return batches()
+
+
+async def get_data_version(db: AsyncSession):
+    """Async version of `crud.get_data_version`."""
+    return await db.run_sync(crud.get_data_version)
+
+
+async def get_orders_grouped_by_billing_zip(db: AsyncSession, order: str = "desc"):
+    """Async version of `crud.get_orders_grouped_by_billing_zip`."""
+    return await db.run_sync(crud.get_orders_grouped_by_billing_zip, order=order)
+
+
+async def get_orders_grouped_by_shipping_zip(db: AsyncSession, order: str = "desc"):
+    """Async version of `crud.get_orders_grouped_by_shipping_zip`."""
+    return await db.run_sync(crud.get_orders_grouped_by_shipping_zip, order=order)
+
+
+async def get_peak_instore_purchase_hour(db: AsyncSession, **filters):
+    """Async version of `crud.get_peak_instore_purchase_hour`; accepts the same filters."""
+    return await db.run_sync(crud.get_peak_instore_purchase_hour, **filters)
+
+
+async def get_top_instore_customer(db: AsyncSession, start_date: str = None, end_date: str = None, k: int = 5):
+    """Async version of `crud.get_top_instore_customer`."""
+    return await db.run_sync(crud.get_top_instore_customer, start_date=start_date, end_date=end_date, k=k)
+
+
+async def get_top_items(db: AsyncSession, **filters):
+    """Async version of `crud.get_top_items`; accepts the same filters."""
+    return await db.run_sync(crud.get_top_items, **filters)
+
+
+async def get_distinct_customers_by_billing_zip(db: AsyncSession, **filters):
+    """Async version of `crud.get_distinct_customers_by_billing_zip`; accepts the same filters."""
+    return await db.run_sync(crud.get_distinct_customers_by_billing_zip, **filters)
+
+
+async def get_geo_counts(db: AsyncSession, **filters):
+    """Async version of `crud.get_geo_counts`; accepts the same filters."""
+    return await db.run_sync(crud.get_geo_counts, **filters)
+
+
+async def ingest_orders(records, db: AsyncSession, chunk_size: int = 1000):
+    """Async version of `crud.ingest_orders`."""
+    return await db.run_sync(lambda session: crud.ingest_orders(records, session, chunk_size=chunk_size))
@@ -0,0 +1,235 @@
+"""
+Query time budgets and admission control for expensive routes.
+
+A time budget arms SQLite's progress handler on the request's connection:
+every `PROGRESS_STEPS` virtual machine instructions SQLite asks whether the
+deadline has passed, and once it has, the running statement is interrupted
+and `BudgetExceeded` is raised (503 with Retry-After), so one runaway query
+cannot hold a connection and a worker thread indefinitely. The handler is
+removed again before the connection goes back to the pool.
+
+`Limiter` caps how many heavy analytics queries run at once. Requests over
+the cap wait on the event loop (not in a worker thread) for up to the queue
+timeout, then get `Saturated` (503 with Retry-After), which keeps the
+threadpool and connections free for interactive routes such as order
+history. Cancellations, rejections, queueing time and slot usage are
+exported on /metrics.
+"""
+
+import asyncio
+import math
+import sqlite3
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from sqlalchemy.engine.interfaces import AdaptedConnection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app import metrics
+from app.config import settings
+
+# SQLite VM instructions between deadline checks: a few microseconds of work, so the overshoot is negligible
+PROGRESS_STEPS = 1000
+
+CANCELLED = metrics.Counter(
+    "pier2_query_cancelled_total", "Requests whose SQL was interrupted for exceeding the time budget.", ("route",)
+)
+QUEUE_SECONDS = metrics.Histogram(
+    "pier2_query_queue_seconds", "Time spent waiting for a query slot.", ("pool",)
+)
+REJECTED = metrics.Counter(
+    "pier2_query_queue_rejected_total", "Requests rejected after waiting the whole queue timeout.", ("pool",)
+)
+IN_USE = metrics.Gauge("pier2_query_slots_in_use", "Query slots held by running requests.", ("pool",))
+WAITING = metrics.Gauge("pier2_query_slots_waiting", "Requests waiting for a query slot.", ("pool",))
+
+
+class BudgetExceeded(Exception):
+    """A query ran past its time budget and was interrupted."""
+
+    def __init__(self, budget_ms: int):
+        super().__init__(f"Query exceeded its {budget_ms} ms time budget")
+        self.retry_after = max(1, math.ceil(budget_ms / 1000))
+
+
+class Saturated(Exception):
+    """Every query slot stayed busy for the whole queue timeout."""
+
+    def __init__(self, pool: str, timeout_ms: int):
+        super().__init__(f"Too many concurrent {pool} queries; retry later")
+        self.retry_after = max(1, math.ceil(timeout_ms / 1000))
+
+
+def _set_progress_handler(dbapi_connection, handler, steps: int):
+    """Set the handler on a pysqlite connection, or on the sqlite3 connection behind aiosqlite."""
+    if isinstance(dbapi_connection, AdaptedConnection):
+        # Runs in a greenlet under AsyncSession.run_sync; aiosqlite sets it on its own thread
+        dbapi_connection.await_(dbapi_connection.driver_connection.set_progress_handler(handler, steps))
+    else:
+        dbapi_connection.set_progress_handler(handler, steps)
+
+
+def _arm(db: Session, budget_ms: int):
+    """Arm the deadline on the session's connection; returns (DB-API connection, deadline)."""
+    deadline = time.monotonic() + budget_ms / 1000
+    dbapi_connection = db.connection().connection.dbapi_connection
+    _set_progress_handler(dbapi_connection, lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+    return dbapi_connection, deadline
+
+
+def _interrupted(error: Exception, deadline: float) -> bool:
+    """Whether `error` is SQLite reporting the interruption of an expired budget."""
+    original = getattr(error, "orig", error)
+    return "interrupted" in str(original) and time.monotonic() > deadline
+
+
+def _cancelled(budget_ms: int, error: Exception):
+    stats = metrics.current_request.get()
+    CANCELLED.inc(route=stats.route if stats is not None else metrics.NO_ROUTE)
+    raise BudgetExceeded(budget_ms) from error
+
+
+@contextmanager
+def time_budget(db: Session, budget_ms: int):
+    """
+    Interrupt the SQL run inside the block once `budget_ms` have passed.
+
+    Works on a sync Session, including the one `AsyncSession.run_sync`
+    passes in.
+
+    Args:
+        db (Session): Session whose connection runs the queries.
+        budget_ms (int): Budget in milliseconds; 0 disables it.
+
+    Raises:
+        BudgetExceeded: If a statement was interrupted after the deadline.
+    """
+    if not budget_ms:
+        yield
+        return
+    dbapi_connection, deadline = _arm(db, budget_ms)
+    try:
+        yield
+    except (OperationalError, sqlite3.OperationalError) as e:
+        if not _interrupted(e, deadline):
+            raise
+        _cancelled(budget_ms, e)
+    finally:
+        _set_progress_handler(dbapi_connection, None, 0)
+
+
+@asynccontextmanager
+async def async_time_budget(db, budget_ms: int):
+    """
+    Async counterpart of `time_budget` for an AsyncSession.
+
+    Raises:
+        BudgetExceeded: If a statement was interrupted after the deadline.
+    """
+    if not budget_ms:
+        yield
+        return
+    dbapi_connection, deadline = await db.run_sync(lambda session: _arm(session, budget_ms))
+    try:
+        yield
+    except (OperationalError, sqlite3.OperationalError) as e:
+        if not _interrupted(e, deadline):
+            raise
+        _cancelled(budget_ms, e)
+    finally:
+        await db.run_sync(lambda session: _set_progress_handler(dbapi_connection, None, 0))
+
+
+def bounded(function, budget_ms: int):
+    """
+    Wrap a function taking a `db` keyword argument so it runs under `time_budget`.
+
+    Returns `function` itself when there is no budget.
+    """
+    if not budget_ms:
+        return function
+
+    def run(*args, db, **kwargs):
+        with time_budget(db, budget_ms):
+            return function(*args, db=db, **kwargs)
+
+    return run
+
+
+class Limiter:
+    """
+    At most `limit` holders at once; others wait in FIFO order for up to `queue_timeout_ms`.
+
+    Waiting happens on the event loop, so queued requests hold neither a
+    worker thread nor a connection.
+
+    Args:
+        pool (str): Name used in errors and metric labels.
+        limit (int): Concurrent holders; 0 means unlimited.
+        queue_timeout_ms (int): How long a request waits for a slot before `Saturated`.
+    """
+
+    def __init__(self, pool: str, limit: int, queue_timeout_ms: int):
+        self.pool = pool
+        self.limit = limit
+        self.queue_timeout_ms = queue_timeout_ms
+        self.active = 0
+        self._waiters = deque()
+
+    async def _acquire(self):
+        queued = time.perf_counter()
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            WAITING.inc(pool=self.pool)
+            try:
+                # A released slot is handed straight to the waiter, so `active` already counts it
+                await asyncio.wait_for(waiter, self.queue_timeout_ms / 1000)
+            except BaseException as e:
+                if waiter.done() and not waiter.cancelled():
+                    # The request was cancelled just as it was handed a slot: pass the slot on
+                    self._release()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    REJECTED.inc(pool=self.pool)
+                    raise Saturated(self.pool, self.queue_timeout_ms) from None
+                raise
+            finally:
+                WAITING.dec(pool=self.pool)
+        QUEUE_SECONDS.observe(time.perf_counter() - queued, pool=self.pool)
+        IN_USE.set(self.active, pool=self.pool)
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+        IN_USE.set(self.active, pool=self.pool)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold a slot for the block.
+
+        Raises:
+            Saturated: If no slot freed up within the queue timeout.
+        """
+        if not self.limit:
+            yield
+            return
+        await self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+
+# Heavy analytics queries (cache misses) share these slots; interactive routes never wait on them
+analytics_slots = Limiter("analytics", settings.analytics_max_concurrency, settings.analytics_queue_timeout_ms)
@@ -0,0 +1,129 @@
+"""
+In-process cache for analytics responses.
+
+Entries are keyed by endpoint, query parameters and the database's data
+version (see `models.DataVersion`), which triggers bump on every write to the
+tables analytics read. A write therefore makes every cached result unreachable
+without any explicit invalidation, across all workers sharing the database.
+Entries are also bounded by LRU eviction and a TTL.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy.engine import Connection
+
+from app import metrics
+from app.config import settings
+
+# Tables whose writes can change an analytics result
+VERSIONED_TABLES = ("customers", "addresses", "orders", "order_items")
+
+
+def install_data_version(conn: Connection):
+    """
+    Seed the data version row and create the triggers that bump it.
+
+    Args:
+        conn (Connection): Connection inside the migration transaction.
+    """
+    conn.exec_driver_sql("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    for table in VERSIONED_TABLES:
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            conn.exec_driver_sql(f"""
+                CREATE TRIGGER IF NOT EXISTS data_version_{table}_{operation.lower()}
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END""")
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    """A rendered JSON response body and its ETag."""
+    body: bytes
+    etag: str
+    expires_at: float
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache of rendered responses with a per-entry TTL.
+
+    Args:
+        max_entries (int): Entries kept before the least recently used is evicted; 0 disables caching.
+        ttl_seconds (float): Lifetime of an entry.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the live entry for `key`, or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, body: bytes) -> CacheEntry:
+        """Store a rendered body under `key` and return its entry."""
+        entry = CacheEntry(
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        if self.max_entries <= 0:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """Counters for monitoring."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+analytics_cache = ResponseCache(settings.analytics_cache_max_entries, settings.analytics_cache_ttl_s)
+
+metrics.CallbackGauge("pier2_analytics_cache_hits_total", "Analytics cache hits.",
+                      lambda: analytics_cache.hits, type="counter")
+metrics.CallbackGauge("pier2_analytics_cache_misses_total", "Analytics cache misses.",
+                      lambda: analytics_cache.misses, type="counter")
+metrics.CallbackGauge("pier2_analytics_cache_evictions_total", "Analytics cache LRU evictions.",
+                      lambda: analytics_cache.evictions, type="counter")
+metrics.CallbackGauge("pier2_analytics_cache_entries", "Entries in the analytics cache.",
+                      lambda: len(analytics_cache._entries))
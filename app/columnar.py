@@ -0,0 +1,341 @@
+"""
+In-memory columnar snapshot of the order facts, for vectorized analytics.
+
+With `PIER2_ANALYTICS_ENGINE=columnar`, `/analytics/*` endpoints are answered
+from NumPy column arrays instead of SQL: per order an int32 id and customer
+id, an int64 epoch-seconds timestamp, a bool in-store flag and a
+dictionary-encoded billing zip code; per item an int32 order id and an
+encoded shipping zip code. Zip group-bys, hourly histograms and top-k
+customer counts are single `bincount` passes over those arrays.
+
+The snapshot refreshes from the highest order, item, customer and address
+ids it has seen. Each refresh checks that the database's data version (see
+app/cache.py) moved by exactly the number of rows appended; anything else
+(an update, a delete, a row committed below the last id seen) makes it
+reload from scratch, so results always match the SQL path. The snapshot
+suits append-mostly data; every non-append write costs a full reload on
+the next analytics request. Full loads also read the archived years (see
+app/partitions.py), which never change.
+
+The query functions take an already refreshed generation as `columns`, so
+the API can refresh outside the analytics time budget (a full reload takes
+seconds on a large database) and budget only the query over the arrays.
+
+NumPy is optional and only imported when this engine is used.
+"""
+
+import calendar
+import itertools
+import threading
+from dataclasses import dataclass, fields
+from datetime import timedelta
+
+from sqlalchemy.orm import Session
+
+from app import crud, partitions
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without NumPy
+    np = None
+
+# Rows fetched per round trip while loading
+LOAD_CHUNK = 100_000
+# Timestamp of orders without one; they are never in a date range or an hour
+NO_TIMESTAMP = -(2 ** 63)
+# Zip code of rows without an address or zip code; codes of real zip codes start at 1
+NO_ZIP = 0
+
+# Formatted with the schema of a partition: "main", or an attached archive (see app/partitions.py)
+_ORDERS = """
+    SELECT id, COALESCE(customer_id, 0), COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), ?),
+           COALESCE(in_store, 0), COALESCE(billing_address_id, 0)
+    FROM {schema}.orders WHERE id > ? AND id <= ? ORDER BY id"""
+_ITEMS = """
+    SELECT COALESCE(order_id, 0), COALESCE(shipping_address_id, 0)
+    FROM {schema}.order_items WHERE id > ? AND id <= ? ORDER BY id"""
+_ADDRESSES = "SELECT id, zip_code FROM {schema}.addresses WHERE id > ? AND id <= ?"
+# Id bounds covering every row of an archive
+_ALL_IDS = (0, 2 ** 63 - 1)
+# One statement, so the version and the id bounds are read from the same database state
+_STATE = """
+    SELECT (SELECT version FROM data_version WHERE id = 1),
+           (SELECT MAX(id) FROM orders), (SELECT MAX(id) FROM order_items),
+           (SELECT MAX(id) FROM customers), (SELECT MAX(id) FROM addresses)"""
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("PIER2_ANALYTICS_ENGINE=columnar needs NumPy: pip install numpy")
+
+
+@dataclass(frozen=True)
+class Columns:
+    """
+    One immutable generation of the snapshot; a refresh swaps in a new one,
+    so concurrent queries never see arrays of different lengths.
+    """
+    order_ids: "np.ndarray"
+    customer_ids: "np.ndarray"
+    timestamps: "np.ndarray"
+    in_store: "np.ndarray"
+    billing_zips: "np.ndarray"
+    item_order_ids: "np.ndarray"
+    shipping_zips: "np.ndarray"
+    address_zips: "np.ndarray"  # zip code per address id (index 0: no address)
+    zip_codes: tuple  # zip code string per code; None for NO_ZIP
+    version: int = 0
+    max_ids: tuple = (0, 0, 0, 0)  # orders, order items, customers, addresses
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the column arrays."""
+        return sum(
+            value.nbytes for value in (getattr(self, f.name) for f in fields(self)) if isinstance(value, np.ndarray)
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            order_ids=np.empty(0, np.int32), customer_ids=np.empty(0, np.int32),
+            timestamps=np.empty(0, np.int64), in_store=np.empty(0, bool), billing_zips=np.empty(0, np.int32),
+            item_order_ids=np.empty(0, np.int32), shipping_zips=np.empty(0, np.int32),
+            address_zips=np.full(1, NO_ZIP, np.int32), zip_codes=(None,), version=None,
+        )
+
+
+def _fetch(conn, statement: str, parameters: tuple, dtype) -> "np.ndarray":
+    """
+    Run `statement` and return its rows as a structured array.
+
+    Rows are read from the DB-API cursor as plain tuples; wrapping millions
+    of them in SQLAlchemy `Row` objects would dominate the load time.
+    """
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(statement, parameters)
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(LOAD_CHUNK)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=dtype))
+    finally:
+        cursor.close()
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+
+def _zips_of(address_zips: "np.ndarray", address_ids: "np.ndarray") -> "np.ndarray":
+    """Zip code of each address id; ids of missing addresses get NO_ZIP, like an inner join drops them."""
+    known = address_ids < len(address_zips)
+    return np.where(known, address_zips[np.where(known, address_ids, 0)], NO_ZIP).astype(np.int32)
+
+
+class Snapshot:
+    """Column arrays of the order facts, refreshed incrementally on demand."""
+
+    def __init__(self):
+        _require_numpy()
+        self.columns = Columns.empty()
+        self.reloads = 0
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session) -> "Columns":
+        """
+        Bring the snapshot up to date with the database and return it.
+
+        Args:
+            db (Session): SQLAlchemy session on the database to read.
+
+        Returns:
+            Columns: The current generation.
+        """
+        conn = db.connection()
+        with self._lock:
+            current = self.columns
+            version, *max_ids = conn.exec_driver_sql(_STATE).one()
+            max_ids = tuple(value or 0 for value in max_ids)
+            if version == current.version and max_ids == current.max_ids:
+                return current
+            columns = None
+            if current.version is not None:
+                columns = self._append(conn, current, version, max_ids)
+            if columns is None:
+                self.reloads += 1
+                columns = self._append(conn, Columns.empty(), version, max_ids)
+            self.columns = columns
+            return columns
+
+    def _append(self, conn, base: "Columns", version: int, max_ids: tuple):
+        """
+        Load the rows between `base`'s ids and `max_ids` on top of `base`.
+
+        Returns:
+            Columns: The new generation, or None when the data version shows
+            writes other than those appends (only when `base` is not empty).
+        """
+        (old_orders, old_items, old_customers, old_addresses), (new_orders, new_items, new_customers, new_addresses) = (
+            base.max_ids, max_ids
+        )
+        if any(new < old for new, old in zip(max_ids, base.max_ids)):
+            return None
+
+        # Archived years are immutable, so they are read on full loads only
+        sources = [("main", (old_addresses, new_addresses), (old_orders, new_orders), (old_items, new_items))]
+        if base.version is None:
+            sources = itertools.chain(sources, (
+                (schema, _ALL_IDS, _ALL_IDS, _ALL_IDS) for schema, year in partitions.partitions(conn) if year
+            ))
+        addresses, orders, items = [], [], []
+        for schema, address_ids, order_ids, item_ids in sources:
+            addresses.append(_fetch(conn, _ADDRESSES.format(schema=schema), address_ids, [
+                ("id", "i8"), ("zip", object),
+            ]))
+            orders.append(_fetch(conn, _ORDERS.format(schema=schema), (NO_TIMESTAMP, *order_ids), [
+                ("id", "i4"), ("customer_id", "i4"), ("timestamp", "i8"), ("in_store", "?"), ("address_id", "i8"),
+            ]))
+            items.append(_fetch(conn, _ITEMS.format(schema=schema), item_ids, [
+                ("order_id", "i4"), ("address_id", "i8"),
+            ]))
+        # Archives keep copies of the addresses they reference; the hot rows (last) take precedence
+        addresses = np.concatenate(addresses[1:] + addresses[:1])
+        orders, items = np.concatenate(orders), np.concatenate(items)
+
+        if base.version is not None:
+            customers = conn.exec_driver_sql(
+                "SELECT COUNT(*) FROM customers WHERE id > ? AND id <= ?", (old_customers, new_customers)
+            ).scalar()
+            if version - base.version != len(addresses) + len(orders) + len(items) + customers:
+                return None
+
+        # Dictionary-encode new zip codes, then map every address id to its code
+        zip_codes = list(base.zip_codes)
+        codes = {zip_code: code for code, zip_code in enumerate(zip_codes)}
+        address_codes = np.fromiter(
+            (NO_ZIP if zip_code is None else codes.setdefault(zip_code, len(codes)) for zip_code in addresses["zip"]),
+            dtype=np.int32, count=len(addresses),
+        )
+        zip_codes.extend(list(codes)[len(zip_codes):])
+        size = max(new_addresses + 1, len(base.address_zips), addresses["id"].max(initial=0) + 1)
+        address_zips = np.full(size, NO_ZIP, np.int32)
+        address_zips[:len(base.address_zips)] = base.address_zips
+        address_zips[addresses["id"]] = address_codes
+
+        columns = Columns(
+            order_ids=np.concatenate([base.order_ids, orders["id"]]),
+            customer_ids=np.concatenate([base.customer_ids, orders["customer_id"]]),
+            timestamps=np.concatenate([base.timestamps, orders["timestamp"]]),
+            in_store=np.concatenate([base.in_store, orders["in_store"]]),
+            billing_zips=np.concatenate([base.billing_zips, _zips_of(address_zips, orders["address_id"])]),
+            item_order_ids=np.concatenate([base.item_order_ids, items["order_id"]]),
+            shipping_zips=np.concatenate([base.shipping_zips, _zips_of(address_zips, items["address_id"])]),
+            address_zips=address_zips,
+            zip_codes=tuple(zip_codes),
+            version=version,
+            max_ids=max_ids,
+        )
+        return columns
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def snapshot() -> Snapshot:
+    """The process-wide snapshot, created on first use."""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = Snapshot()
+        return _snapshot
+
+
+def reset():
+    """Drop the process-wide snapshot, e.g. before pointing the process at another database."""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
+
+
+def _current(db: Session, columns: "Columns" = None) -> "Columns":
+    """`columns` when the caller already refreshed the snapshot, otherwise the refreshed current generation."""
+    return snapshot().refresh(db) if columns is None else columns
+
+
+def _epoch_range(start_date: str = None, end_date: str = None):
+    """Epoch-second bounds [start, end) of a mm-dd-yyyy date range; `end_date` is inclusive."""
+    start = calendar.timegm(crud.parse_date(start_date).timetuple()) if start_date else None
+    end = calendar.timegm((crud.parse_date(end_date) + timedelta(days=1)).timetuple()) if end_date else None
+    return start, end
+
+
+def _instore_mask(columns: "Columns", start_date: str = None, end_date: str = None):
+    """In-store orders with a timestamp inside the date range, like the in-store rollups count them."""
+    start, end = _epoch_range(start_date, end_date)
+    mask = columns.in_store & (columns.timestamps != NO_TIMESTAMP)
+    if start is not None:
+        mask &= columns.timestamps >= start
+    if end is not None:
+        mask &= columns.timestamps < end
+    return mask
+
+
+def _zip_counts(columns: "Columns", zips, order: str):
+    """Count rows per zip code, ordered like `crud._zip_counts`."""
+    counts = np.bincount(zips, minlength=len(columns.zip_codes))
+    counts[NO_ZIP] = 0
+    rows = [(columns.zip_codes[code], int(counts[code])) for code in np.flatnonzero(counts)]
+    rows.sort(key=lambda row: (row[1] if order == "asc" else -row[1], row[0]))
+    return [{"zip_code": zip_code, "order_count": count} for zip_code, count in rows]
+
+
+def get_orders_grouped_by_billing_zip(db: Session, order: str = "desc", columns: "Columns" = None):
+    """Columnar version of `crud.get_orders_grouped_by_billing_zip`."""
+    columns = _current(db, columns)
+    return _zip_counts(columns, columns.billing_zips, order)
+
+
+def get_orders_grouped_by_shipping_zip(db: Session, order: str = "desc", columns: "Columns" = None):
+    """Columnar version of `crud.get_orders_grouped_by_shipping_zip`."""
+    columns = _current(db, columns)
+    return _zip_counts(columns, columns.shipping_zips, order)
+
+
+def get_peak_instore_purchase_hour(
+    db: Session, start_date: str = None, end_date: str = None, top_n: int = 1, columns: "Columns" = None
+):
+    """
+    Columnar version of `crud.get_peak_instore_purchase_hour`.
+
+    Raises:
+        ValueError: If a date is malformed.
+    """
+    columns = _current(db, columns)
+    timestamps = columns.timestamps[_instore_mask(columns, start_date, end_date)]
+    counts = np.bincount(timestamps // 3600 % 24, minlength=24)
+    # Busiest first, ties to the earlier hour
+    hours = [hour for hour in np.argsort(-counts, kind="stable")[:top_n] if counts[hour] > 0]
+    return {f"{(hour % 12 or 12)}{'am' if hour < 12 else 'pm'}": int(counts[hour]) for hour in hours}
+
+
+def get_top_instore_customer(
+    db: Session, start_date: str = None, end_date: str = None, k: int = 5, columns: "Columns" = None
+):
+    """
+    Columnar version of `crud.get_top_instore_customer`.
+
+    Raises:
+        ValueError: If a date is malformed.
+    """
+    columns = _current(db, columns)
+    mask = _instore_mask(columns, start_date, end_date)
+    customer_ids = columns.customer_ids[mask]
+    counts = np.bincount(customer_ids[customer_ids > 0])
+    counted = np.flatnonzero(counts)
+    if len(counted) > k:
+        # Everyone above the k-th count, then the lowest ids among those tied with it
+        kth = np.partition(counts[counted], len(counted) - k)[len(counted) - k]
+        above = counted[counts[counted] > kth]
+        counted = np.concatenate([above, counted[counts[counted] == kth][:k - len(above)]])
+    ranked = counted[np.lexsort((counted, -counts[counted]))]
+    return crud.customer_order_counts(db, [(int(customer_id), int(counts[customer_id])) for customer_id in ranked])
@@ -0,0 +1,103 @@
+"""
+Application settings.
+Every setting can be overridden with a PIER2_* environment variable named
+after the field, e.g. PIER2_DB_MODE=async or PIER2_SQLITE_BUSY_TIMEOUT_MS=10000.
+"""
+
+import os
+from dataclasses import dataclass, fields
+
+DB_MODES = ("sync", "async")
+ANALYTICS_ENGINES = ("sql", "columnar")
+
+
+def _parse(value: str, default):
+    """Convert an environment string to the type of the field's default."""
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Runtime configuration for the API and database layer.
+    """
+    database_url: str = "sqlite:///./pier2.db"
+    db_mode: str = "sync"  # "sync": threadpool + pysqlite, "async": event loop + aiosqlite
+    auto_setup: bool = True  # migrate (and seed an empty database) on startup; off for multi-worker deployments
+
+    # SQLite connection profile, applied to every pooled connection
+    sqlite_journal_mode: str = "wal"  # readers no longer block the writer (and vice versa)
+    sqlite_synchronous: str = "normal"  # fsync at checkpoints only; safe with WAL
+    sqlite_cache_size_kib: int = 65536  # page cache per connection
+    sqlite_mmap_size: int = 268435456  # bytes of the file read through mmap
+    sqlite_busy_timeout_ms: int = 5000  # wait for locks instead of "database is locked"
+
+    # Connection pools: one write engine, one read-only engine
+    db_pool_size: int = 4
+    db_max_overflow: int = 4
+    db_read_pool_size: int = 16
+    db_read_max_overflow: int = 16
+    db_pool_timeout_s: int = 30
+
+    # Analytics response cache (0 entries disables it)
+    analytics_cache_max_entries: int = 256
+    analytics_cache_ttl_s: int = 300
+    analytics_engine: str = "sql"  # "sql": rollups and queries, "columnar": in-memory NumPy snapshot (app/columnar.py)
+
+    # Query time budgets per route group (0 disables): SQL still running is interrupted with a 503 (app/budgets.py)
+    analytics_time_budget_ms: int = 5000
+    history_time_budget_ms: int = 2000  # GET /customer/{email_or_phone}/orders (not the NDJSON stream)
+    batch_time_budget_ms: int = 10000  # POST /customers/orders:batch
+    search_time_budget_ms: int = 2000  # GET /customers/search
+    # Heavy analytics queries (cache misses) running at once; more wait up to the queue timeout, then get a 503
+    analytics_max_concurrency: int = 2
+    analytics_queue_timeout_ms: int = 2000
+
+    # Bulk order ingestion: records per transaction and per request
+    bulk_chunk_size: int = 1000
+    bulk_max_records: int = 100000
+    batch_max_identifiers: int = 5000  # per POST /customers/orders:batch
+
+    # Group-commit writer behind POST /orders (app/writer.py)
+    write_batch_max_records: int = 500  # orders per transaction
+    write_batch_max_delay_ms: float = 2.0  # wait for more orders after the first of a batch
+    write_queue_max_pending: int = 10000  # admitted, unwritten orders before new ones get a 503
+    write_synchronous: str = "full"  # PRAGMA synchronous of the writer's connection: commits reach disk first
+
+    # Request profiling (X-Profile header or sampling) and the slow query log (0 ms disables it)
+    profile_sample_rate: float = 0.0  # fraction of requests profiled without the header
+    profile_token: str = ""  # X-Profile and X-Admin-Token must carry it; unset, /admin/* and X-Profile are off
+    profile_buffer_size: int = 50
+    slow_query_ms: int = 250
+    slow_query_log_size: int = 100
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """Build settings from PIER2_* environment variables, falling back to defaults."""
+        values = {}
+        for field in fields(cls):
+            value = environ.get(f"PIER2_{field.name.upper()}")
+            if value is not None:
+                values[field.name] = _parse(value, field.default)
+        settings = cls(**values)
+        if settings.db_mode.lower() not in DB_MODES:
+            raise ValueError(f"PIER2_DB_MODE must be one of {DB_MODES}, got '{settings.db_mode}'")
+        if settings.analytics_engine.lower() not in ANALYTICS_ENGINES:
+            raise ValueError(
+                f"PIER2_ANALYTICS_ENGINE must be one of {ANALYTICS_ENGINES}, got '{settings.analytics_engine}'"
+            )
+        return settings
+
+    @property
+    def async_database_url(self) -> str:
+        """The database URL with the async SQLite driver."""
+        return self.database_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+
+settings = Settings.from_env()
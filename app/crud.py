@@ -1,64 +1,628 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text, desc, asc
-from datetime import datetime
-from app import models
+from sqlalchemy import column, func, and_, or_, select, insert, literal_column, table
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import date, datetime, timedelta, timezone
+import base64
+from app import addresses, models, partitions, rollups, search
+from app.identifiers import lookup_key, normalize_email, normalize_phone
 
+DATE_FORMAT = "%m-%d-%Y"
+MONTH_FORMAT = "%m-%Y"
+# Top in-store customers: candidates ranked per batch, and the cost of ranking one candidate
+# in rows of a date range scan (measured at 1M orders), which bounds the candidates examined
+TOP_CUSTOMERS_BATCH = 500
+TOP_CUSTOMERS_ROWS_PER_CANDIDATE = 16
 
-def get_order_history(email_or_phone: str, db: Session):
+
+def _address_columns():
+    """Columns selected whenever an address is joined onto an order or item row."""
+    return (
+        models.Address.id.label("address_id"),
+        models.Address.street,
+        models.Address.city,
+        models.Address.state,
+        models.Address.zip_code,
+        models.Address.country,
+    )
+
+
+def _address_from_row(row):
+    """Build the address payload from a row carrying `_address_columns()`."""
+    if row.address_id is None:
+        return None
+    return {
+        "street": row.street,
+        "city": row.city,
+        "state": row.state,
+        "zip_code": row.zip_code,
+        "country": row.country
+    }
+
+
+def _fetch_partition(db: Session, order_filter, schema: str = None):
+    """
+    Load orders with their billing address, items and shipping addresses
+    from one partition (see app/partitions.py): the hot tables, or the
+    archive attached as `schema`.
+
+    Uses one query for the orders and one for all of their items, so the number
+    of round trips does not grow with the size of the history.
+
+    Returns:
+        list[tuple[int, dict]]: (customer id, order) pairs ordered by
+        (timestamp, id), each order with its items.
+    """
+    translate = {"schema_translate_map": {None: schema}} if schema else {}
+    orders = db.query(
+        models.Order.id,
+        models.Order.customer_id,
+        models.Order.timestamp,
+        models.Order.in_store,
+        *_address_columns()
+    ).outerjoin(
+        models.Address, models.Order.billing_address_id == models.Address.id
+    ).filter(order_filter).order_by(models.Order.timestamp, models.Order.id).execution_options(**translate).all()
+    if not orders:
+        # Most archived years hold none of a customer's orders; skip their items query
+        return []
+
+    items = db.query(
+        models.OrderItem.order_id,
+        models.OrderItem.item_name,
+        *_address_columns()
+    ).join(
+        models.Order, models.OrderItem.order_id == models.Order.id
+    ).outerjoin(
+        models.Address, models.OrderItem.shipping_address_id == models.Address.id
+    ).filter(order_filter).order_by(models.OrderItem.order_id, models.OrderItem.id).execution_options(**translate)
+
+    items_by_order = {}
+    for item in items:
+        items_by_order.setdefault(item.order_id, []).append({
+            "item_name": item.item_name,
+            "shipping_address": _address_from_row(item)
+        })
+
+    return [
+        (order.customer_id, {
+            "order_id": order.id,
+            "timestamp": order.timestamp.isoformat(),
+            "in_store": order.in_store,
+            "billing_address": _address_from_row(order),
+            "items": items_by_order.get(order.id, [])
+        })
+        for order in orders
+    ]
+
+
+def _merge_partitions(parts):
+    """
+    Merge per-partition results into one (timestamp, id) ordered list.
+
+    An order found in two partitions (while an archive is being published)
+    is kept once.
+    """
+    if len(parts) == 1:
+        return parts[0]
+    merged = {}
+    for part in parts:
+        for customer_id, order in part:
+            merged.setdefault(order["order_id"], (customer_id, order))
+    return sorted(
+        merged.values(), key=lambda pair: (datetime.fromisoformat(pair[1]["timestamp"]), pair[1]["order_id"])
+    )
+
+
+def _fetch_orders(db: Session, order_filter, start: datetime = None, end: datetime = None):
+    """
+    Load orders with their billing address, items and shipping addresses.
+
+    Reads the hot partition and every archived year overlapping [start, end),
+    the timestamp range `order_filter` is known to be limited to.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        order_filter: SQL expression selecting the orders to load.
+        start (datetime): Optional lower bound of the matching timestamps, for partition pruning.
+        end (datetime): Optional exclusive upper bound.
+
+    Returns:
+        list[tuple[int, dict]]: (customer id, order) pairs ordered by
+        (timestamp, id), each order with its items.
+    """
+    return _merge_partitions([
+        _fetch_partition(db, order_filter, schema) for schema, _ in partitions.partitions(db, start, end)
+    ])
+
+
+def _load_orders(db: Session, order_filter, start: datetime = None, end: datetime = None):
+    """
+    Load the orders matching `order_filter`, ordered by (timestamp, id).
+
+    See `_fetch_orders`.
+    """
+    return [order for _, order in _fetch_orders(db, order_filter, start, end)]
+
+
+def parse_date(value: str) -> datetime:
     """
-    Retrieve the full order history for a customer based on email or phone number.
+    Parse a date query parameter.
+
+    Args:
+        value (str): Date in mm-dd-yyyy format.
+
+    Returns:
+        datetime: Midnight at the start of that day.
+
+    Raises:
+        ValueError: If the value is not in mm-dd-yyyy format.
+    """
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date '{value}', expected MM-DD-YYYY")
+
+
+def parse_month(value: str) -> str:
+    """
+    Parse a month query parameter.
+
+    Args:
+        value (str): Month in mm-yyyy format.
+
+    Returns:
+        str: The month as "YYYY-MM", the name of its sketch bucket.
+
+    Raises:
+        ValueError: If the value is not in mm-yyyy format.
+    """
+    try:
+        return datetime.strptime(value, MONTH_FORMAT).strftime("%Y-%m")
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid month '{value}', expected MM-YYYY")
+
+
+def encode_cursor(order: dict) -> str:
+    """
+    Build an opaque pagination cursor pointing at an order.
+
+    Args:
+        order (dict): Order as returned by `get_order_history`.
+
+    Returns:
+        str: URL-safe cursor encoding the order's (timestamp, id) key.
+    """
+    key = f"{order['timestamp']}|{order['order_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """
+    Decode a cursor produced by `encode_cursor`.
+
+    Returns:
+        tuple: (timestamp, order_id) keyset position.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        timestamp, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(order_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+def find_customer_id(email_or_phone: str, db: Session):
+    """
+    Resolve a customer identifier to the customer's id.
+
+    The identifier is normalized (see app/identifiers.py), so any formatting
+    of a phone number and any casing of an email resolve with one indexed
+    equality probe.
 
     Args:
         email_or_phone (str): Customer identifier (email or phone).
         db (Session): SQLAlchemy database session.
 
     Returns:
-        list or dict: List of orders or error message.
+        int or None: Customer id, or None if no customer matches.
     """
-    query = db.query(models.Customer)
-    if "@" in email_or_phone:
-        customer = query.filter(models.Customer.email == email_or_phone).first()
-    else:
-        customer = query.filter(models.Customer.phone == email_or_phone).first()
+    column, key = lookup_key(email_or_phone)
+    if key is None:
+        return None
+    customers = models.Customer.__table__
+    return db.execute(select(customers.c.id).where(customers.c[column] == key)).scalar()
+
+
+def find_customer_ids(identifiers, db: Session):
+    """
+    Resolve many customer identifiers with one set-based query per kind,
+    normalizing each identifier once like `find_customer_id`.
+
+    Args:
+        identifiers (list[str]): Emails and/or phone numbers, in any mix.
+        db (Session): SQLAlchemy database session.
+
+    Returns:
+        dict: Customer id per identifier that matched a customer.
+    """
+    keys = {identifier: lookup_key(identifier) for identifier in identifiers}
+    customers = models.Customer.__table__
+    ids = {}
+    for column in ("email_key", "phone_key"):
+        wanted = {key for kind, key in keys.values() if kind == column and key is not None}
+        if wanted:
+            ids.update(
+                ((column, key), customer_id) for key, customer_id in db.execute(
+                    select(customers.c[column], customers.c.id).where(customers.c[column].in_(wanted))
+                )
+            )
+    return {identifier: ids[key] for identifier, key in keys.items() if key in ids}
+
+
+def _customer_row(row) -> dict:
+    return {
+        "id": row.id,
+        "first_name": row.first_name,
+        "last_name": row.last_name,
+        "email": row.email,
+        "phone": row.phone,
+    }
+
+
+def search_customers(query: str, db: Session, limit: int = 20, offset: int = 0, fuzzy: bool = True):
+    """
+    Find customers by a fragment of their name, email or phone number.
+
+    Text queries match every term (of three or more characters) anywhere in
+    the first name, last name or email through the FTS5 trigram index (see
+    app/search.py); shorter terms must appear in one of those values too.
+    Matches are ranked by bm25, then id. When nothing matches and `fuzzy`
+    is set, terms are matched again allowing one missing, extra or
+    transposed letter. Queries of phone characters only match phone numbers
+    starting with those digits, in phone number order.
+
+    Ranking covers the first `search.MAX_CANDIDATES` matches by id, since
+    bm25 costs a pass over every match; a query matching more customers (a
+    common last name) says so under "truncated", and a more specific query
+    ranks them all.
+
+    Args:
+        query (str): Search text.
+        db (Session): SQLAlchemy database session.
+        limit (int): Page size.
+        offset (int): Matches to skip, for the following pages.
+        fuzzy (bool): Fall back to typo-tolerant matching when nothing matches.
+
+    Returns:
+        dict: The page of customers under "results", the offset of the next
+        page (None on the last one) under "next_offset", whether the
+        typo-tolerant fallback produced them under "fuzzy", and whether
+        matches were left unranked under "truncated".
+
+    Raises:
+        ValueError: If the query has no term of at least three characters.
+    """
+    query = (query or "").strip()
+    customers = models.Customer.__table__
+    fields = (customers.c.id, customers.c.first_name, customers.c.last_name, customers.c.email, customers.c.phone)
+
+    bounds = search.phone_prefix(query)
+    if bounds is not None:
+        rows = db.execute(
+            select(*fields).where(customers.c.phone_key >= bounds[0], customers.c.phone_key < bounds[1])
+            .order_by(customers.c.phone_key, customers.c.id).limit(limit + 1).offset(offset)
+        ).all()
+        return _search_page(rows, limit, offset, False, False)
+
+    query_terms = search.terms(query)
+    rows, truncated = _search_index(db, fields, query_terms, False, limit, offset)
+    # A page past the last exact match stays exact, so every page of a query takes the same path
+    if (not rows and fuzzy and search.match_expression(query_terms, True) != search.match_expression(query_terms)
+            and not (offset and db.execute(_search_matches(query_terms, False).limit(1)).first())):
+        rows, truncated = _search_index(db, fields, query_terms, True, limit, offset)
+        return _search_page(rows, limit, offset, True, truncated)
+    return _search_page(rows, limit, offset, False, truncated)
+
+
+def _search_matches(query_terms, typo_tolerant: bool, *columns):
+    """Ids (and `columns`) of the customers matching every term, in id order."""
+    customers = models.Customer.__table__
+    index = table("customer_search", column("rowid"))
+    # Terms too short for the index are matched against the customers' values, before any limit
+    short = [
+        or_(*(customers.c[name].contains(term, autoescape=True) for name in search.COLUMNS))
+        for term in search.short_terms(query_terms)
+    ]
+    matches = select(index.c.rowid.label("id"), *columns).where(
+        literal_column("customer_search").op("MATCH")(search.match_expression(query_terms, typo_tolerant))
+    )
+    if short:
+        matches = matches.join_from(index, customers, customers.c.id == index.c.rowid).where(*short)
+    return matches
+
+
+def _search_index(db: Session, fields, query_terms, typo_tolerant: bool, limit: int, offset: int):
+    """
+    One page (plus one row) of ranked index matches for `search_customers`.
+
+    Returns:
+        tuple[list, bool]: The rows, best bm25 score first, and whether
+        matches past the first `search.MAX_CANDIDATES` were left unranked.
+    """
+    customers = models.Customer.__table__
+    # Rank and page the ids first, so only the page is joined to its customers
+    candidates = _search_matches(
+        query_terms, typo_tolerant, func.bm25(literal_column("customer_search")).label("score")
+    ).limit(search.MAX_CANDIDATES).subquery("candidates")
+    page = (
+        select(candidates).order_by(candidates.c.score, candidates.c.id).limit(limit + 1).offset(offset)
+        .subquery("page")
+    )
+    rows = db.execute(
+        select(*fields).join_from(page, customers, customers.c.id == page.c.id).order_by(page.c.score, page.c.id)
+    ).all()
+    truncated = db.execute(
+        _search_matches(query_terms, typo_tolerant).limit(1).offset(search.MAX_CANDIDATES)
+    ).first() is not None
+    return rows, truncated
+
+
+def _search_page(rows, limit: int, offset: int, fuzzy: bool, truncated: bool) -> dict:
+    return {
+        "results": [_customer_row(row) for row in rows[:limit]],
+        "next_offset": offset + limit if len(rows) > limit else None,
+        "fuzzy": fuzzy,
+        "truncated": truncated,
+    }
+
+
+def get_order_histories(identifiers, db: Session, start_date: str = None, end_date: str = None):
+    """
+    Retrieve the order histories of many customers at once.
+
+    Identifiers are resolved with set-based IN queries, then every matching
+    order and item is loaded together, so a batch costs at most four queries
+    however many identifiers and orders it has.
+
+    Args:
+        identifiers (list[str]): Customer emails and/or phone numbers.
+        db (Session): SQLAlchemy database session.
+        start_date (str): Optional filter in mm-dd-yyyy format.
+        end_date (str): Optional inclusive filter in mm-dd-yyyy format.
+
+    Returns:
+        dict: "results" maps each identifier to its orders (oldest first) or
+        to {"error": "Customer not found"}; "missing" lists the identifiers
+        that matched no customer.
+
+    Raises:
+        ValueError: If a date is malformed.
+    """
+    criteria = _date_criteria(start_date, end_date)
+    customer_ids = find_customer_ids(identifiers, db)
+
+    histories = {customer_id: [] for customer_id in customer_ids.values()}
+    if histories:
+        for customer_id, order in _fetch_orders(
+            db, and_(models.Order.customer_id.in_(histories), *criteria), *_date_bounds(start_date, end_date)
+        ):
+            histories[customer_id].append(order)
 
-    if not customer:
+    results, missing = {}, []
+    for identifier in identifiers:
+        if identifier in customer_ids:
+            results[identifier] = histories[customer_ids[identifier]]
+        else:
+            results[identifier] = {"error": "Customer not found"}
+            missing.append(identifier)
+    return {"results": results, "missing": missing}
+
+
+def _after_key(position):
+    """Condition selecting orders after a (timestamp, id) keyset position."""
+    timestamp, order_id = position
+    return or_(
+        models.Order.timestamp > timestamp,
+        and_(models.Order.timestamp == timestamp, models.Order.id > order_id)
+    )
+
+
+def _before_key(position):
+    """Condition selecting orders before a (timestamp, id) keyset position."""
+    timestamp, order_id = position
+    return or_(
+        models.Order.timestamp < timestamp,
+        and_(models.Order.timestamp == timestamp, models.Order.id < order_id)
+    )
+
+
+def _date_criteria(start_date: str = None, end_date: str = None):
+    """Conditions limiting orders to a date range; `end_date` is inclusive of the whole day."""
+    criteria = []
+    if start_date:
+        criteria.append(models.Order.timestamp >= parse_date(start_date))
+    if end_date:
+        criteria.append(models.Order.timestamp < parse_date(end_date) + timedelta(days=1))
+    return criteria
+
+
+def _date_bounds(start_date: str = None, end_date: str = None):
+    """The [start, end) timestamp range of `_date_criteria`, for partition pruning."""
+    return (
+        parse_date(start_date) if start_date else None,
+        parse_date(end_date) + timedelta(days=1) if end_date else None,
+    )
+
+
+def _history_bounds(before: str = None, after: str = None, start_date: str = None, end_date: str = None):
+    """The [start, end) timestamp range a history's dates and cursors allow, for partition pruning."""
+    start, end = _date_bounds(start_date, end_date)
+    if after:
+        after_timestamp = decode_cursor(after)[0]
+        start = max(start, after_timestamp) if start else after_timestamp
+    if before:
+        before_end = decode_cursor(before)[0] + timedelta(microseconds=1)
+        end = min(end, before_end) if end else before_end
+    return start, end
+
+
+def _history_criteria(customer_id: int, before: str = None, after: str = None,
+                      start_date: str = None, end_date: str = None):
+    """
+    Build the filter conditions for a customer's order history.
+
+    Cursors and dates are validated here so callers fail fast before any
+    rows are read. `end_date` is inclusive of the whole day.
+    """
+    criteria = [models.Order.customer_id == customer_id, *_date_criteria(start_date, end_date)]
+    if after:
+        criteria.append(_after_key(decode_cursor(after)))
+    if before:
+        criteria.append(_before_key(decode_cursor(before)))
+    return criteria
+
+
+def _load_page(db: Session, criteria, limit: int, backwards: bool = False,
+               start: datetime = None, end: datetime = None):
+    """
+    Load one keyset page of orders matching `criteria`.
+
+    The page is selected by a LIMIT subquery on (timestamp, id), so a page
+    still costs the same three statements as a full history. Archived years
+    in [start, end) are read in page order, hot partition first, and the
+    remaining ones are skipped once the page is full with orders they cannot
+    precede.
+    """
+    key_order = (models.Order.timestamp, models.Order.id)
+    if backwards:
+        key_order = tuple(column.desc() for column in key_order)
+    page_ids = select(models.Order.id).where(*criteria).order_by(*key_order).limit(limit)
+
+    page = []
+    for schema, year in partitions.partitions(db, start, end, descending=backwards):
+        if year is not None and len(page) >= limit:
+            edge = datetime.fromisoformat(page[0 if backwards else -1][1]["timestamp"])
+            if (edge >= datetime(year + 1, 1, 1)) if backwards else (edge < datetime(year, 1, 1)):
+                break
+        fetched = _fetch_partition(db, models.Order.id.in_(page_ids), schema)
+        page = _merge_partitions([page, fetched] if page else [fetched])
+        page = page[-limit:] if backwards else page[:limit]
+    return [order for _, order in page]
+
+
+def get_order_history(email_or_phone: str, db: Session, limit: int = None,
+                      before: str = None, after: str = None,
+                      start_date: str = None, end_date: str = None):
+    """
+    Retrieve the order history for a customer based on email or phone number.
+
+    Orders are returned oldest first. Without `limit` the whole (optionally
+    date-filtered) history is returned; with `limit` a keyset page is returned,
+    following `after` or preceding `before` when a cursor is given. The history
+    is loaded with a fixed number of queries (customer lookup, orders, items)
+    regardless of how many orders the customer has.
+
+    Args:
+        email_or_phone (str): Customer identifier (email or phone).
+        db (Session): SQLAlchemy database session.
+        limit (int): Optional page size.
+        before (str): Optional cursor; only orders before it are returned.
+        after (str): Optional cursor; only orders after it are returned.
+        start_date (str): Optional filter in mm-dd-yyyy format.
+        end_date (str): Optional inclusive filter in mm-dd-yyyy format.
+
+    Returns:
+        list or dict: List of orders or error message.
+
+    Raises:
+        ValueError: If a cursor or date is malformed.
+    """
+    customer_id = find_customer_id(email_or_phone, db)
+    if customer_id is None:
         return {"error": "Customer not found"}
 
-    history = []
-    for order in customer.orders:
-        order_data = {
-            "order_id": order.id,
-            "timestamp": order.timestamp.isoformat(),
-            "in_store": order.in_store,
-            "billing_address": {
-                "street": order.billing_address.street,
-                "city": order.billing_address.city,
-                "state": order.billing_address.state,
-                "zip_code": order.billing_address.zip_code,
-                "country": order.billing_address.country
-            },
-            "items": [
-                {
-                    "item_name": item.item_name,
-                    "shipping_address": {
-                        "street": item.shipping_address.street,
-                        "city": item.shipping_address.city,
-                        "state": item.shipping_address.state,
-                        "zip_code": item.shipping_address.zip_code,
-                        "country": item.shipping_address.country
-                    }
-                } for item in order.items
-            ]
-        }
-        history.append(order_data)
+    criteria = _history_criteria(customer_id, before, after, start_date, end_date)
+    bounds = _history_bounds(before, after, start_date, end_date)
+    if limit is None:
+        return _load_orders(db, and_(*criteria), *bounds)
+    return _load_page(db, criteria, limit, bool(before) and not after, *bounds)
+
+
+def iter_order_history(customer_id: int, db: Session, before: str = None, after: str = None,
+                       start_date: str = None, end_date: str = None, batch_size: int = 500):
+    """
+    Stream a customer's order history in keyset batches.
+
+    Arguments are validated immediately; the returned generator then reads
+    `batch_size` orders at a time, so memory use does not depend on the length
+    of the history.
+
+    Args:
+        customer_id (int): Customer id from `find_customer_id`.
+        db (Session): SQLAlchemy database session, kept open while iterating.
+        batch_size (int): Number of orders loaded per round trip.
+
+    Returns:
+        generator: Yields order dicts oldest first.
+
+    Raises:
+        ValueError: If a cursor or date is malformed.
+    """
+    criteria = _history_criteria(customer_id, before, None, start_date, end_date)
+    start, end = _history_bounds(before, None, start_date, end_date)
+    position = decode_cursor(after) if after else None
+
+    def batches(position):
+        while True:
+            page_criteria = list(criteria)
+            if position:
+                page_criteria.append(_after_key(position))
+            page_start = start
+            if position and (page_start is None or position[0] > page_start):
+                page_start = position[0]
+            page = _load_page(db, page_criteria, batch_size, False, page_start, end)
+            yield from page
+            if len(page) < batch_size:
+                return
+            last = page[-1]
+            position = (datetime.fromisoformat(last["timestamp"]), last["order_id"])
+
+    return batches(position)
+
+
+def get_data_version(db: Session) -> int:
+    """
+    Current data version, bumped by triggers on every write analytics depend on.
+
+    Args:
+        db (Session): SQLAlchemy DB session.
+
+    Returns:
+        int: Data version counter.
+    """
+    version = db.query(models.DataVersion.version).filter(models.DataVersion.id == 1).scalar()
+    return version or 0
 
-    return history
+
+def _zip_counts(db: Session, rollup, order: str):
+    """Read a zip code rollup table, ties broken by zip code."""
+    count = rollup.order_count
+    zip_counts = db.query(rollup.zip_code, count).order_by(
+        count.asc() if order == "asc" else count.desc(), rollup.zip_code
+    )
+    return [{"zip_code": row[0], "order_count": row[1]} for row in zip_counts.all()]
 
 
 def get_orders_grouped_by_billing_zip(db: Session, order: str = "desc"):
     """
     Returns total count of orders grouped by billing zip code.
 
+    Reads the `billing_zip_counts` rollup, so the cost grows with the number
+    of zip codes rather than the number of orders.
+
     Args:
         db (Session): SQLAlchemy DB session.
         order (str): "asc" or "desc" sort order.
@@ -66,25 +630,16 @@ def get_orders_grouped_by_billing_zip(db: Session, order: str = "desc"):
     Returns:
         list[dict]: List of zip codes and order counts.
     """
-    zip_counts = db.query(
-        models.Address.zip_code,
-        func.count(models.Order.id).label("order_count")
-    ).join(
-        models.Order, models.Order.billing_address_id == models.Address.id
-    ).group_by(models.Address.zip_code)
-
-    # Apply sort order
-    zip_counts = zip_counts.order_by(
-        text("order_count ASC") if order == "asc" else text("order_count DESC")
-    )
-
-    return [{"zip_code": row[0], "order_count": row[1]} for row in zip_counts.all()]
+    return _zip_counts(db, models.BillingZipCount, order)
 
 
 def get_orders_grouped_by_shipping_zip(db: Session, order: str = "desc"):
     """
     Returns total count of order items grouped by shipping zip code.
 
+    Reads the `shipping_zip_counts` rollup, so the cost grows with the number
+    of zip codes rather than the number of items.
+
     Args:
         db (Session): SQLAlchemy DB session.
         order (str): "asc" or "desc" sort order.
@@ -92,88 +647,595 @@ def get_orders_grouped_by_shipping_zip(db: Session, order: str = "desc"):
     Returns:
         list[dict]: List of zip codes and item shipment counts.
     """
-    zip_counts = db.query(
-        models.Address.zip_code,
-        func.count(models.OrderItem.id).label("order_count")
-    ).join(
-        models.OrderItem, models.OrderItem.shipping_address_id == models.Address.id
-    ).group_by(models.Address.zip_code)
-
-    zip_counts = zip_counts.order_by(
-        asc("order_count") if order == "asc" else desc("order_count")
-    )
-
-    return [{"zip_code": row[0], "order_count": row[1]} for row in zip_counts.all()]
+    return _zip_counts(db, models.ShippingZipCount, order)
 
 
-def get_peak_instore_purchase_hour(db: Session):
+def get_peak_instore_purchase_hour(db: Session, start_date: str = None, end_date: str = None,
+                                   top_n: int = 1):
     """
-    Identify the hour of the day with the most in-store purchases.
+    Identify the hours of the day with the most in-store purchases.
+
+    Reads the `instore_hourly_counts` rollup, so the cost depends on the number
+    of days in range rather than on the number of orders.
 
     Args:
         db (Session): SQLAlchemy DB session.
+        start_date (str): Optional filter in mm-dd-yyyy format.
+        end_date (str): Optional inclusive filter in mm-dd-yyyy format.
+        top_n (int): Number of hours to return.
 
     Returns:
-        dict: Peak hour (12-hour format) and count.
+        dict: Peak hours (12-hour format) mapped to counts, busiest first.
+
+    Raises:
+        ValueError: If a date is malformed.
     """
-    hourly_counts = {}
-    orders = db.query(models.Order).filter(models.Order.in_store == True).all()
+    order_count = func.sum(models.InstoreHourlyCount.order_count)
+    query = db.query(models.InstoreHourlyCount.hour, order_count.label("order_count"))
 
-    for order in orders:
-        hour = order.timestamp.hour
-        hourly_counts[hour] = hourly_counts.get(hour, 0) + 1
+    if start_date:
+        query = query.filter(models.InstoreHourlyCount.day >= parse_date(start_date).date())
 
-    if not hourly_counts:
-        return {}
+    if end_date:
+        query = query.filter(models.InstoreHourlyCount.day <= parse_date(end_date).date())
 
-    peak_hour = max(hourly_counts, key=hourly_counts.get)
-    count = hourly_counts[peak_hour]
-    label = f"{(peak_hour % 12 or 12)}{'am' if peak_hour < 12 else 'pm'}"
+    # Ties go to the earlier hour so the answer is deterministic
+    peak_hours = query.group_by(models.InstoreHourlyCount.hour).having(
+        order_count > 0
+    ).order_by(order_count.desc(), models.InstoreHourlyCount.hour).limit(top_n)
 
-    return {label: count}
+    return {
+        f"{(hour % 12 or 12)}{'am' if hour < 12 else 'pm'}": count
+        for hour, count in peak_hours
+    }
 
 
-def get_top_instore_customer(db: Session, start_date: str = None, end_date: str = None):
+def _estimated_daily_rows(db: Session, start: date = None, end: date = None) -> float:
+    """Rows of the daily customer rollup within a date range, assuming days are evenly filled."""
+    daily = models.InstoreCustomerDailyCount.__table__
+    rows, first, last = db.execute(select(
+        select(func.max(literal_column("rowid"))).select_from(daily).scalar_subquery(),
+        select(func.min(daily.c.day)).scalar_subquery(),
+        select(func.max(daily.c.day)).scalar_subquery(),
+    )).one()
+    if not rows:
+        return 0
+    span = (last - first).days + 1
+    covered = (min(end or last, last) - max(start or first, first)).days + 1
+    return rows * max(covered, 0) / span
+
+
+def _top_instore_customer_counts(db: Session, start: date = None, end: date = None, k: int = 5):
+    """
+    Rank customers by in-store orders from the per-customer rollups.
+
+    Without dates the all-time totals are read in rank order. With dates,
+    customers are taken in all-time rank order in batches and their in-range
+    counts summed from the daily rollup; a customer's all-time total bounds
+    its in-range count, so ranking stops once the k-th count beats every
+    remaining total. When that would examine more candidates than summing
+    the whole range costs (narrow ranges, large k), the range is summed
+    instead, so the slower strategy never runs for more than the faster
+    one's cost.
+
+    Returns:
+        list[tuple[int, int]]: (customer id, in-store order count), most
+        orders first and ties to the lower customer id.
+    """
+    totals = models.InstoreCustomerCount.__table__
+    daily = models.InstoreCustomerDailyCount.__table__
+    ranked = select(totals.c.customer_id, totals.c.order_count).order_by(
+        totals.c.order_count.desc(), totals.c.customer_id
+    )
+    if start is None and end is None:
+        return [tuple(row) for row in db.execute(ranked.limit(k))]
+
+    in_range = []
+    if start is not None:
+        in_range.append(daily.c.day >= start)
+    if end is not None:
+        in_range.append(daily.c.day <= end)
+    order_count = func.sum(daily.c.order_count)
+
+    budget = _estimated_daily_rows(db, start, end) / TOP_CUSTOMERS_ROWS_PER_CANDIDATE
+    best, position, examined = [], None, 0
+    while examined + TOP_CUSTOMERS_BATCH <= budget:
+        query = ranked
+        if position is not None:
+            total, customer_id = position
+            query = query.where(or_(
+                totals.c.order_count < total,
+                and_(totals.c.order_count == total, totals.c.customer_id > customer_id),
+            ))
+        candidates = db.execute(query.limit(TOP_CUSTOMERS_BATCH)).all()
+        if not candidates:
+            return best
+        counts = db.execute(
+            select(daily.c.customer_id, order_count)
+            .where(daily.c.customer_id.in_([customer_id for customer_id, _ in candidates]), *in_range)
+            .group_by(daily.c.customer_id)
+        ).all()
+        best = sorted([*best, *counts], key=lambda row: (-row[1], row[0]))[:k]
+        examined += len(candidates)
+        position = (candidates[-1].order_count, candidates[-1].customer_id)
+        if len(best) == k and best[-1][1] > position[0]:
+            return best
+
+    # Grouping on `customer_id + 0` stops the planner from skip-scanning the primary key to
+    # get groups in order, which reads every day; the day index reads only the range
+    return [tuple(row) for row in db.execute(
+        select(daily.c.customer_id, order_count).where(*in_range)
+        .group_by(daily.c.customer_id + 0).order_by(order_count.desc(), daily.c.customer_id).limit(k)
+    )]
+
+
+def get_top_instore_customer(db: Session, start_date: str = None, end_date: str = None, k: int = 5):
     """
-    Get top 5 customers with the most in-store orders, optionally within a date range.
+    Get the top `k` customers with the most in-store orders, optionally within a date range.
+
+    Reads the per-customer in-store rollups rather than the orders table
+    (see `_top_instore_customer_counts`).
 
     Args:
         db (Session): SQLAlchemy DB session.
         start_date (str): Optional filter in mm-dd-yyyy format.
-        end_date (str): Optional filter in mm-dd-yyyy format.
+        end_date (str): Optional inclusive filter in mm-dd-yyyy format.
+        k (int): Number of customers to return.
 
     Returns:
-        list[dict]: Top 5 customers with order counts.
+        list[dict]: Top customers with order counts, most orders first; ties
+        go to the customer created first.
+
+    Raises:
+        ValueError: If a date is malformed.
     """
-    query = db.query(
-        models.Customer.email,
-        models.Customer.first_name,
-        models.Customer.last_name,
-        models.Customer.phone,
-        func.count(models.Order.id).label("in_store_count")
-    ).join(models.Order).filter(
-        models.Order.in_store == True
-    )
+    start = parse_date(start_date).date() if start_date else None
+    end = parse_date(end_date).date() if end_date else None
+    return customer_order_counts(db, _top_instore_customer_counts(db, start, end, k))
 
-    if start_date:
-        start = datetime.strptime(start_date, "%m-%d-%Y")
-        query = query.filter(models.Order.timestamp >= start)
 
-    if end_date:
-        end = datetime.strptime(end_date, "%m-%d-%Y")
-        query = query.filter(models.Order.timestamp <= end)
+def customer_order_counts(db: Session, counts):
+    """
+    Attach contact details to ranked (customer id, in-store order count) pairs.
 
-    results = query.group_by(models.Customer.id).order_by(
-        func.count(models.Order.id).desc()
-    ).limit(5).all()
+    Args:
+        db (Session): SQLAlchemy DB session.
+        counts (list[tuple[int, int]]): Ranked customer ids and their counts.
+
+    Returns:
+        list[dict]: Customers in the same order, as returned by `get_top_instore_customer`.
+    """
+    customers = models.Customer.__table__
+    details = {
+        row.id: row for row in db.execute(
+            select(customers.c.id, customers.c.email, customers.c.first_name, customers.c.last_name,
+                   customers.c.phone).where(customers.c.id.in_([customer_id for customer_id, _ in counts]))
+        )
+    } if counts else {}
 
     return [
         {
-            "email": email,
-            "first_name": first_name,
-            "last_name": last_name,
-            "phone": phone,
+            "email": details[customer_id].email,
+            "first_name": details[customer_id].first_name,
+            "last_name": details[customer_id].last_name,
+            "phone": details[customer_id].phone,
             "in_store_order_count": in_store_count
         }
-        for email, first_name, last_name, phone, in_store_count in results
+        for customer_id, in_store_count in counts
+        if customer_id in details
     ]
+
+
+def _month_range(start_month: str = None, end_month: str = None):
+    """The ("YYYY-MM", "YYYY-MM") bounds of an inclusive month range; None when open."""
+    start = parse_month(start_month) if start_month else None
+    end = parse_month(end_month) if end_month else None
+    if start and end and start > end:
+        raise ValueError("start_month must not be after end_month")
+    return start, end
+
+
+def get_top_items(db: Session, start_month: str = None, end_month: str = None, zip_code: str = None, k: int = 10):
+    """
+    The best-selling items, overall or shipped to one zip code, optionally within a range of months.
+
+    Answered from the item sketches (see app/sketches.py): the heavy
+    hitters give the candidates, ranked overall by their Count-Min
+    estimate and per zip code by their heavy-hitter count. Ranges with at
+    most `sketches.EXACT_MAX_ROWS` items sold (over every zip code) are
+    counted exactly instead.
+
+    Args:
+        db (Session): SQLAlchemy DB session.
+        start_month (str): Optional first month in mm-yyyy format.
+        end_month (str): Optional last month (inclusive) in mm-yyyy format.
+        zip_code (str): Optional shipping zip code.
+        k (int): Number of items to return, at most `sketches.HEAVY_HITTERS`.
+
+    Returns:
+        dict: The items with their sales counts, most sold first and ties to
+        the smaller name, under "items"; whether the counts are estimates
+        under "approximate"; and under "max_error" the most an estimate is
+        off: an overcount with 98% probability overall, an undercount
+        always per zip code. Items selling less than 1/(HEAVY_HITTERS + 1)
+        of the range's items may be missing from an approximate answer.
+
+    Raises:
+        ValueError: If a month is malformed, the range is reversed or `k` is too large.
+    """
+    # Imported on first use, so NumPy never slows startup
+    from app import sketches
+
+    if k > sketches.HEAVY_HITTERS:
+        raise ValueError(f"k must be at most {sketches.HEAVY_HITTERS}")
+    start, end = _month_range(start_month, end_month)
+    conn = db.connection()
+    # An exact answer scans every item sold in the range, whatever the zip code
+    scanned = sketches.counted(conn, sketches.ITEMS, start, end) if sketches.np is not None else 0
+
+    if scanned <= sketches.EXACT_MAX_ROWS:
+        counts = {}
+        for _, item_zip, item_name, count in sketches.exact(conn, sketches.ITEMS, start, end):
+            if zip_code is None or item_zip == zip_code:
+                counts[item_name] = counts.get(item_name, 0) + count
+        approximate, max_error = False, 0
+    else:
+        key = sketches.ALL_ZIPS if zip_code is None else zip_code
+        # A zip code without sales in the range has no sketch
+        _, (heavy, cms) = sketches.merged(conn, sketches.ITEMS, start, end, key).get(
+            key, (0, (sketches.HeavyHitters(), None))
+        )
+        if cms is not None:
+            counts = {item_name: cms.estimate(item_name) for item_name in heavy.counts}
+            approximate, max_error = True, cms.error_bound()
+        else:
+            counts = heavy.counts
+            approximate, max_error = True, heavy.error
+
+    top = sorted(counts.items(), key=lambda pair: (-pair[1], pair[0]))[:k]
+    return {
+        "items": [{"item_name": item_name, "count": count} for item_name, count in top],
+        "approximate": approximate,
+        "max_error": max_error,
+    }
+
+
+def get_distinct_customers_by_billing_zip(db: Session, start_month: str = None, end_month: str = None,
+                                          order: str = "desc"):
+    """
+    Count the distinct customers ordering with each billing zip code, optionally within a range of months.
+
+    Answered from the per zip code HyperLogLog sketches (see
+    app/sketches.py). Ranges with at most `sketches.EXACT_MAX_ROWS` orders
+    are counted exactly instead.
+
+    Args:
+        db (Session): SQLAlchemy DB session.
+        start_month (str): Optional first month in mm-yyyy format.
+        end_month (str): Optional last month (inclusive) in mm-yyyy format.
+        order (str): "asc" or "desc" sort order of the counts.
+
+    Returns:
+        dict: Zip codes and distinct customer counts under "zip_codes", ties
+        broken by zip code; whether the counts are estimates under
+        "approximate"; and their relative standard error under
+        "standard_error" (about 95% of estimates are within twice that).
+
+    Raises:
+        ValueError: If a month is malformed or the range is reversed.
+    """
+    # Imported on first use, so NumPy never slows startup
+    from app import sketches
+
+    start, end = _month_range(start_month, end_month)
+    conn = db.connection()
+    merged = sketches.merged(conn, sketches.CUSTOMERS, start, end) if sketches.np is not None else {}
+
+    if sum(orders for orders, _ in merged.values()) <= sketches.EXACT_MAX_ROWS:
+        customers = {}
+        for _, billing_zip, customer_id, _ in sketches.exact(conn, sketches.CUSTOMERS, start, end):
+            customers.setdefault(billing_zip, set()).add(customer_id)
+        counts = {billing_zip: len(ids) for billing_zip, ids in customers.items()}
+        approximate, standard_error = False, 0
+    else:
+        counts = {billing_zip: sketch.estimate() for billing_zip, (_, sketch) in merged.items()}
+        approximate, standard_error = True, round(sketches.HyperLogLog.STANDARD_ERROR, 4)
+
+    ranked = sorted(counts.items(), key=lambda pair: (pair[1] if order == "asc" else -pair[1], pair[0]))
+    return {
+        "zip_codes": [{"zip_code": billing_zip, "distinct_customers": count} for billing_zip, count in ranked],
+        "approximate": approximate,
+        "standard_error": standard_error,
+    }
+
+
+# Geo rollup cube per address role: billing counts orders, shipping counts order items
+GEO_ROLLUPS = {"billing": models.BillingGeoCount, "shipping": models.ShippingGeoCount}
+
+
+def get_geo_counts(db: Session, level: str = "state", role: str = "billing", country: str = None,
+                   state: str = None, city: str = None, in_store: bool = None, start_month: str = None,
+                   end_month: str = None, sort: str = "count", order: str = "desc", top_n: int = None):
+    """
+    Roll orders (or shipped items) up to one level of the location hierarchy, optionally within a slice.
+
+    Reads the city (or, for zip codes, zip code) rows of the
+    `billing_geo_counts` or `shipping_geo_counts` cube (see app/rollups.py),
+    all time or the whole years and single months covering the range, so
+    the cost grows with the locations rather than with the orders. Drill
+    down by fixing the parent levels (`country`, `state`, `city`) and
+    asking for the next `level`; roll up by asking for a coarser one.
+
+    Args:
+        db (Session): SQLAlchemy DB session.
+        level (str): "country", "state", "city" or "zip_code".
+        role (str): "billing" to count orders by billing address, "shipping"
+            to count order items by shipping address.
+        country (str): Optional country filter.
+        state (str): Optional state filter.
+        city (str): Optional city filter.
+        in_store (bool): Only in-store (True) or online (False) orders; both by default.
+        start_month (str): Optional first month in mm-yyyy format.
+        end_month (str): Optional last month (inclusive) in mm-yyyy format.
+        sort (str): "count", or "name" to sort by location.
+        order (str): "asc" or "desc" sort order.
+        top_n (int): Optional number of groups to return.
+
+    Returns:
+        dict: The groups, each with its location down to `level` ("" where
+        the addresses lack it) and its "order_count", under "groups"; the
+        count of the whole slice, beyond the top n too, under "total".
+
+    Raises:
+        ValueError: If the level, role or sort is unknown, a month is
+        malformed or the range is reversed.
+    """
+    levels = rollups.GEO_LEVELS
+    if level not in levels:
+        raise ValueError(f"level must be one of {', '.join(levels)}")
+    if role not in GEO_ROLLUPS:
+        raise ValueError(f"role must be one of {', '.join(GEO_ROLLUPS)}")
+    if sort not in ("count", "name"):
+        raise ValueError("sort must be 'count' or 'name'")
+    start, end = _month_range(start_month, end_month)
+    cube = GEO_ROLLUPS[role]
+    path = [getattr(cube, name) for name in levels[:levels.index(level) + 1]]
+    filters = {name: value for name, value in (("country", country), ("state", state), ("city", city))
+               if value is not None}
+    # Rows of the first stored level at or below the level and the filtered ones, summed up to the level
+    depth = max([levels.index(level), *(levels.index(name) for name in filters)])
+    stored = next(name for name in rollups.GEO_STORED_LEVELS if levels.index(name) >= depth)
+    conditions = [cube.level == stored]
+    conditions += [getattr(cube, name) == value for name, value in filters.items()]
+    if in_store is not None:
+        conditions.append(cube.in_store == in_store)
+    periods = [""]
+    if start or end:
+        # The years with data, from the city rows
+        first, last = db.query(func.min(cube.period), func.max(cube.period)).filter(
+            cube.level == rollups.GEO_STORED_LEVELS[0], cube.period > ""
+        ).one()
+        periods = rollups.periods(int(first[:4]), int(last[:4]), start, end) if first else []
+    conditions.append(cube.period.in_(periods))
+
+    order_count = func.sum(cube.order_count)
+    # Sorted and cut in SQL: a level can have tens of thousands of groups; ties go to the location
+    if sort == "count":
+        ordering = [order_count.asc() if order == "asc" else order_count.desc(), *path]
+    else:
+        ordering = [column.asc() if order == "asc" else column.desc() for column in path]
+    groups = db.query(*path, order_count).filter(*conditions).group_by(*path).order_by(*ordering).limit(top_n).all()
+    return {
+        "groups": [
+            {**{column.key: value for column, value in zip(path, row)}, "order_count": row[-1]}
+            for row in groups
+        ],
+        "total": db.query(func.coalesce(order_count, 0)).filter(*conditions).scalar(),
+    }
+
+
+def _address_row(address):
+    """Column values for an `addresses` row from a `schemas.Address`."""
+    return {
+        "type": address.type,
+        "street": address.street,
+        "city": address.city,
+        "state": address.state,
+        "zip_code": address.zip_code,
+        "country": address.country
+    }
+
+
+def _naive_utc(timestamp: datetime) -> datetime:
+    """Timestamps are stored as naive UTC, like `Order.timestamp`'s default."""
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _resolve_customers(db: Session, identities):
+    """
+    Upsert customers by normalized email/phone and return their ids.
+
+    New identities are inserted in one multi-row statement; identities whose
+    email or phone key already exists are left as they are, so formatting
+    variants of one email or phone never create a second customer. Email
+    wins over phone when they point at different customers.
+
+    Returns:
+        list[int]: Customer id for each identity, in order.
+    """
+    customers = models.Customer.__table__
+    keys = [(normalize_email(identity.email), normalize_phone(identity.phone)) for identity in identities]
+    rows = {}
+    for identity, (email_key, phone_key) in zip(identities, keys):
+        rows.setdefault(email_key or phone_key, {
+            "first_name": identity.first_name,
+            "last_name": identity.last_name,
+            "email": identity.email,
+            "phone": identity.phone,
+            "email_key": email_key,
+            "phone_key": phone_key,
+        })
+    db.execute(sqlite_insert(customers).on_conflict_do_nothing(), list(rows.values()))
+
+    email_keys = {email_key for email_key, _ in keys if email_key}
+    phone_keys = {phone_key for _, phone_key in keys if phone_key}
+    by_email, by_phone = {}, {}
+    for customer_id, email_key, phone_key in db.execute(
+        select(customers.c.id, customers.c.email_key, customers.c.phone_key).where(
+            or_(customers.c.email_key.in_(email_keys), customers.c.phone_key.in_(phone_keys))
+        )
+    ):
+        # A customer without an email (or phone) must not match every identity without one
+        if email_key:
+            by_email[email_key] = customer_id
+        if phone_key:
+            by_phone[phone_key] = customer_id
+
+    return [(email_key and by_email.get(email_key)) or by_phone[phone_key] for email_key, phone_key in keys]
+
+
+def _reserve_ids(db: Session, table, count: int):
+    """
+    Allocate `count` consecutive primary keys for `table`.
+
+    Must run after the transaction's first write: SQLite then holds the write
+    lock, so no other connection can insert until this transaction ends.
+    """
+    first = db.execute(select(func.coalesce(func.max(table.c.id), 0) + 1)).scalar()
+    return range(first, first + count)
+
+
+def _insert_orders(db: Session, records):
+    """
+    Insert orders with one batched executemany per table.
+
+    Addresses resolve to the canonical address store; order and item primary
+    keys are assigned up front so they can be linked without a round trip
+    per row.
+
+    Args:
+        db (Session): SQLAlchemy DB session; the caller commits.
+        records (list[schemas.BulkOrder]): Validated orders.
+
+    Returns:
+        list[int]: The new order ids, in record order.
+    """
+    orders = models.Order.__table__
+    order_items = models.OrderItem.__table__
+
+    # The customer upsert is the first write, taking SQLite's write lock
+    customer_ids = _resolve_customers(db, [record.customer for record in records])
+
+    address_rows = []
+    for record in records:
+        address_rows.append(_address_row(record.billing_address))
+        address_rows.extend(_address_row(item.shipping_address) for item in record.items)
+    address_ids = iter(addresses.resolve(db, address_rows))
+    order_ids = _reserve_ids(db, orders, len(records))
+    item_ids = iter(_reserve_ids(db, order_items, sum(len(record.items) for record in records)))
+
+    order_rows, item_rows = [], []
+    for record, customer_id, order_id in zip(records, customer_ids, order_ids):
+        order_rows.append({
+            "id": order_id,
+            "customer_id": customer_id,
+            "billing_address_id": next(address_ids),
+            "timestamp": _naive_utc(record.timestamp),
+            "in_store": record.in_store
+        })
+        for item in record.items:
+            item_rows.append({
+                "id": next(item_ids),
+                "order_id": order_id,
+                "item_name": item.item_name,
+                "shipping_address_id": next(address_ids)
+            })
+
+    db.execute(insert(orders), order_rows)
+    if item_rows:
+        db.execute(insert(order_items), item_rows)
+    return list(order_ids)
+
+
+def _fold_sketches(db: Session):
+    """Fold the orders queued for the sketches, these included, into them within the transaction once enough are."""
+    # Imported on first write, so NumPy never slows startup
+    from app import sketches
+
+    sketches.fold(db.connection(), sketches.FOLD_BATCH)
+
+
+def create_orders(records, db: Session):
+    """
+    Insert orders in a single transaction, which also folds the orders
+    queued for the analytics sketches once there are enough of them (see
+    app/sketches.py).
+
+    If the transaction fails, the records are retried one at a time so only
+    the offending records fail.
+
+    Args:
+        records (list[schemas.BulkOrder]): Validated orders.
+        db (Session): SQLAlchemy DB session on the write engine.
+
+    Returns:
+        list: Per record, its new order id or the SQLAlchemyError that rejected it.
+    """
+    try:
+        order_ids = _insert_orders(db, records)
+        _fold_sketches(db)
+        db.commit()
+        return order_ids
+    except SQLAlchemyError:
+        db.rollback()
+
+    results = []
+    for record in records:
+        try:
+            [order_id] = _insert_orders(db, [record])
+            _fold_sketches(db)
+            db.commit()
+            results.append(order_id)
+        except SQLAlchemyError as e:
+            db.rollback()
+            results.append(e)
+    return results
+
+
+def error_message(error: SQLAlchemyError) -> str:
+    """The database's own message for a failed statement, without SQLAlchemy's SQL and parameters dump."""
+    return str(error.orig if hasattr(error, "orig") else error)
+
+
+def ingest_orders(records, db: Session, chunk_size: int = 1000):
+    """
+    Bulk insert orders, deduplicating their customers by email or phone and
+    their addresses through the canonical address store.
+
+    Each chunk of `chunk_size` records is written in one transaction with
+    batched multi-row statements. If a chunk fails, its records are retried one
+    at a time so only the offending records are reported.
+
+    Args:
+        records (list[tuple[int, schemas.BulkOrder]]): Validated orders with their
+            position in the upload.
+        db (Session): SQLAlchemy DB session on the write engine.
+        chunk_size (int): Records per transaction.
+
+    Returns:
+        dict: Number of inserted orders and per-record errors ({"index", "error"}).
+    """
+    inserted, errors = 0, []
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        results = create_orders([record for _, record in chunk], db)
+        for (index, _), result in zip(chunk, results):
+            if isinstance(result, SQLAlchemyError):
+                errors.append({"index": index, "error": error_message(result)})
+            else:
+                inserted += 1
+
+    return {"inserted": inserted, "errors": errors}
+
@@ -1,16 +1,109 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-# Define the path to the SQLite database file
-SQLALCHEMY_DATABASE_URL = "sqlite:///./pier2.db"
+from app.config import Settings, settings
 
-# Create a SQLAlchemy engine for SQLite
-# 'check_same_thread=False' allows the database connection to be shared across threads
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# Path to the SQLite database file (PIER2_DATABASE_URL, default ./pier2.db)
+SQLALCHEMY_DATABASE_URL = settings.database_url
+
+
+def _is_memory(url: str) -> bool:
+    """True for in-memory SQLite URLs, which have no file to tune or pool."""
+    database = make_url(url).database
+    return not database or database == ":memory:"
+
+
+def _set_pragmas(engine, config: Settings, read_only: bool):
+    """Apply the SQLite connection profile to every new DBAPI connection of `engine`."""
+    pragmas = [
+        f"busy_timeout = {config.sqlite_busy_timeout_ms}",
+        f"cache_size = -{config.sqlite_cache_size_kib}",
+        f"mmap_size = {config.sqlite_mmap_size}",
+        f"synchronous = {config.sqlite_synchronous}",
+    ]
+    if read_only:
+        pragmas.append("query_only = ON")
+    else:
+        # Persistent in the file; set by the writer so readers just inherit it
+        pragmas.insert(0, f"journal_mode = {config.sqlite_journal_mode}")
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+
+
+def _engine_options(url: str, config: Settings, read_only: bool, poolclass) -> dict:
+    """Pool sizing for file databases; in-memory databases keep SQLAlchemy's defaults."""
+    if _is_memory(url):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": config.db_read_pool_size if read_only else config.db_pool_size,
+        "max_overflow": config.db_read_max_overflow if read_only else config.db_max_overflow,
+        "pool_timeout": config.db_pool_timeout_s,
+    }
+
+
+def create_sqlite_engine(config: Settings = settings, read_only: bool = False):
+    """
+    Create a sync engine with the tuned SQLite profile.
+
+    Args:
+        config (Settings): Connection and pool settings.
+        read_only (bool): Reject writes on this engine's connections (PRAGMA query_only).
+
+    Returns:
+        Engine: Engine for `config.database_url`.
+    """
+    url = config.database_url
+    # 'check_same_thread=False' allows the database connection to be shared across threads
+    engine = create_engine(
+        url, connect_args={"check_same_thread": False}, **_engine_options(url, config, read_only, QueuePool)
+    )
+    if not _is_memory(url):
+        _set_pragmas(engine, config, read_only)
+    return engine
+
+
+def create_async_sqlite_engine(config: Settings = settings, read_only: bool = False):
+    """
+    Create an aiosqlite engine with the tuned SQLite profile.
+
+    Args:
+        config (Settings): Connection and pool settings.
+        read_only (bool): Reject writes on this engine's connections (PRAGMA query_only).
+
+    Returns:
+        AsyncEngine: Engine for `config.async_database_url`.
+    """
+    url = config.async_database_url
+    engine = create_async_engine(url, **_engine_options(url, config, read_only, AsyncAdaptedQueuePool))
+    if not _is_memory(url):
+        _set_pragmas(engine.sync_engine, config, read_only)
+    return engine
+
+
+# Write engine (migrations, data loading, write routes) and read-only engine (GET routes)
+engine = create_sqlite_engine()
+read_engine = create_sqlite_engine(read_only=True)
 
 # autocommit=False ensures changes must be explicitly committed
 # autoflush=False prevents automatic flushing before queries
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Async engines over the same file, driven by aiosqlite so queries are awaited
+# on the event loop instead of holding a threadpool worker per request
+async_engine = create_async_sqlite_engine()
+async_read_engine = create_async_sqlite_engine(read_only=True)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
 
 def get_db():
     
@@ -29,3 +122,46 @@ def get_db():
         yield db
     finally:
         db.close() # always close the session to avoid DB connection leaks
+
+
+def get_read_db():
+    """
+    Dependency that provides a session on the read-only engine.
+
+    Yields:
+        db (Session): A new SQLAlchemy session that cannot write.
+    """
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """
+    Dependency that provides an async SQLAlchemy database session.
+
+    Yields:
+        db (AsyncSession): A new async SQLAlchemy session.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db():
+    """
+    Dependency that provides an async session on the read-only engine.
+
+    Yields:
+        db (AsyncSession): A new async SQLAlchemy session that cannot write.
+    """
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+# Session dependencies used by the API routes, chosen by PIER2_DB_MODE:
+# read routes depend on get_read_session, write routes on get_session
+ASYNC_MODE = settings.db_mode.lower() == "async"
+get_session = get_async_db if ASYNC_MODE else get_db
+get_read_session = get_async_read_db if ASYNC_MODE else get_read_db
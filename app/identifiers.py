@@ -0,0 +1,180 @@
+"""
+Normalized customer lookup keys.
+
+Customers are found by email or phone, which clients send in many shapes:
+"415-555-1234", "(415) 555 1234" and "+14155551234" are one phone, and
+emails differ in case. Each customer therefore stores an `email_key`
+(trimmed, lowercased) and a `phone_key` (E.164-style "+<digits>", US numbers
+without a country code getting "+1", extensions kept as "x<digits>"), both
+unique-indexed. An incoming identifier is normalized once and resolved with
+a single indexed equality probe, and two customers can no longer differ only
+in formatting.
+
+Key, merge and re-point customers written outside SQLAlchemy (e.g. by raw
+SQL) with:
+
+    python -m app.identifiers
+"""
+
+import re
+import sys
+
+from sqlalchemy.engine import Connection, Engine
+
+# Country code assumed for national numbers (10 digits, no "+" or international prefix)
+DEFAULT_COUNTRY_CODE = "1"
+# Rows per UPDATE batch when backfilling keys
+BACKFILL_BATCH = 5000
+
+UNIQUE_INDEXES = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_customers_email_key ON customers (email_key)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_customers_phone_key ON customers (phone_key)",
+)
+
+_EXTENSION = re.compile(r"\s*(?:x|ext\.?|extension|#)\s*(\d+)\s*$", re.IGNORECASE)
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_email(email) -> str:
+    """Lookup key of an email: trimmed and lowercased, or None when empty."""
+    if email is None:
+        return None
+    return email.strip().lower() or None
+
+
+def normalize_phone(phone) -> str:
+    """
+    Lookup key of a phone number.
+
+    Returns:
+        str: "+<country code><number>", with "x<digits>" appended for an
+        extension; None when the value has no digits.
+    """
+    if phone is None:
+        return None
+    phone = phone.strip()
+    extension = _EXTENSION.search(phone)
+    if extension:
+        phone = phone[:extension.start()]
+    digits = _NON_DIGITS.sub("", phone)
+    if not digits:
+        return None
+    if not phone.startswith("+"):
+        if digits.startswith("00"):
+            digits = digits[2:]
+        elif len(digits) == 10:
+            digits = DEFAULT_COUNTRY_CODE + digits
+    return f"+{digits}" + (f"x{extension.group(1)}" if extension else "")
+
+
+def lookup_key(identifier: str):
+    """
+    Classify and normalize a customer identifier.
+
+    Returns:
+        tuple[str, str]: ("email_key" or "phone_key", normalized key); the key
+        is None when the identifier cannot match any customer.
+    """
+    if "@" in identifier:
+        return "email_key", normalize_email(identifier)
+    return "phone_key", normalize_phone(identifier)
+
+
+def email_key_default(context):
+    """Column default: `email_key` from the inserted `email`."""
+    return normalize_email(context.get_current_parameters().get("email"))
+
+
+def phone_key_default(context):
+    """Column default: `phone_key` from the inserted `phone`."""
+    return normalize_phone(context.get_current_parameters().get("phone"))
+
+
+def _find(parents, node):
+    while parents[node] != node:
+        parents[node] = parents[parents[node]]
+        node = parents[node]
+    return node
+
+
+def compact(conn: Connection) -> int:
+    """
+    Key every customer and merge customers whose keys collide.
+
+    Customers sharing an email or phone key (transitively) are merged into
+    the lowest id, which takes over a missing email or phone from the
+    merged rows; their orders and addresses are re-pointed before the
+    duplicates are deleted.
+
+    Args:
+        conn (Connection): Connection inside a transaction on the write engine.
+
+    Returns:
+        int: Number of duplicate customers removed.
+    """
+    rows = conn.exec_driver_sql("SELECT id, email, phone, email_key, phone_key FROM customers ORDER BY id").all()
+
+    parents = {row.id: row.id for row in rows}
+    owners = {}
+    for row in rows:
+        for kind, key in (("email", normalize_email(row.email)), ("phone", normalize_phone(row.phone))):
+            if key is None:
+                continue
+            owner = owners.setdefault((kind, key), row.id)
+            # Rows come in id order, so the root of each group stays its lowest id
+            first, second = sorted((_find(parents, owner), _find(parents, row.id)))
+            parents[second] = first
+
+    survivors = {}
+    merges = []
+    for row in rows:
+        canonical = _find(parents, row.id)
+        if canonical == row.id:
+            survivors[row.id] = row._asdict()
+        else:
+            merges.append((row.id, canonical))
+            survivor = survivors[canonical]
+            survivor["email"] = survivor["email"] or row.email
+            survivor["phone"] = survivor["phone"] or row.phone
+
+    if merges:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS temp.customer_merges")
+        conn.exec_driver_sql("CREATE TEMP TABLE customer_merges (id INTEGER PRIMARY KEY, canonical_id INTEGER)")
+        conn.exec_driver_sql("INSERT INTO temp.customer_merges VALUES (?, ?)", merges)
+        for table in ("orders", "addresses"):
+            conn.exec_driver_sql(f"""
+                UPDATE {table} SET customer_id = customer_merges.canonical_id
+                FROM customer_merges WHERE customer_merges.id = {table}.customer_id""")
+        conn.exec_driver_sql("DELETE FROM customers WHERE id IN (SELECT id FROM customer_merges)")
+        conn.exec_driver_sql("DROP TABLE temp.customer_merges")
+
+    # Only rows whose contact details or keys change are written
+    originals = {row.id: row for row in rows}
+    updates = []
+    for customer_id, survivor in survivors.items():
+        values = (survivor["email"], survivor["phone"],
+                  normalize_email(survivor["email"]), normalize_phone(survivor["phone"]))
+        if values != tuple(originals[customer_id][1:]):
+            updates.append((*values, customer_id))
+    for start in range(0, len(updates), BACKFILL_BATCH):
+        conn.exec_driver_sql(
+            "UPDATE customers SET email = ?, phone = ?, email_key = ?, phone_key = ? WHERE id = ?",
+            updates[start:start + BACKFILL_BATCH],
+        )
+    return len(merges)
+
+
+def main(engine: Engine):
+    """Key and deduplicate the customers of a database in a single transaction."""
+    with engine.begin() as conn:
+        before = conn.exec_driver_sql("SELECT COUNT(*) FROM customers").scalar()
+        removed = compact(conn)
+    print(f"Merged {removed} duplicate customers ({before} -> {before - removed} rows).")
+    return 0
+
+
+if __name__ == "__main__":
+    from app import database, migrations
+
+    migrations.upgrade(database.engine)
+    sys.exit(main(database.engine))
@@ -1,26 +1,67 @@
-from fastapi import FastAPI, HTTPException, Query, Depends
+from fastapi import FastAPI, HTTPException, Header, Query, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
+import json
+import secrets
+from contextlib import asynccontextmanager
 
-from app import models, crud, database, utils
-from app.database import get_db  # Dependency for DB session
+from app import (
+    schemas, crud, async_crud, budgets, cache, database, metrics, migrations, profiling, utils, writer
+)
+from app.config import settings
+from app.database import get_read_session  # Read-only DB session dependency (sync or async, per PIER2_DB_MODE)
+from app.database import get_session  # Read-write DB session dependency
 
-# Create all tables if they do not exist
-models.Base.metadata.create_all(bind=database.engine)
 
-# Auto-load sample data if DB is empty
-with Session(bind=database.engine) as session:
-    if not session.query(models.Customer).first():
-        try:
-            from load_sample_data import load_data
-            load_data()
-            print("✅ Sample data loaded on first run.")
-        except Exception as e:
-            print("❌ Error while auto-loading data:", e)
+# Database setup: runs from the lifespan hook (or `python -m app.migrations`), never at import
+def _prepare_database():
+    """Apply pending migrations and load sample data into an empty database."""
+    if migrations.pending(database.engine):
+        migrations.upgrade(database.engine)
+
+    # Plain SQL: an ORM query here would configure every mapper before the first request needs to
+    with database.engine.connect() as conn:
+        if conn.exec_driver_sql("SELECT 1 FROM customers LIMIT 1").first():
+            return
+    try:
+        from load_sample_data import load_data
+        load_data()
+        print("✅ Sample data loaded on first run.")
+    except Exception as e:
+        print("❌ Error while auto-loading data:", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Prepare the database before serving, unless PIER2_AUTO_SETUP is off.
+
+    Nothing touches the database at import time; on an up-to-date database
+    this is two cheap queries. Multi-worker deployments should run
+    `python -m app.migrations` once and set PIER2_AUTO_SETUP=0.
+    """
+    if settings.auto_setup:
+        # Called directly: nothing is being served yet, so blocking the loop costs nothing
+        _prepare_database()
+    if settings.analytics_engine.lower() == "columnar":
+        # Load the snapshot now rather than on the first analytics request
+        from app import columnar
+        with database.ReadSessionLocal() as db:
+            columnar.snapshot().refresh(db)
+    yield
+    # Orders already admitted to the group-commit writer are written before the process exits
+    writer.shutdown()
+
 
 # FastAPI App Initialization
-app = FastAPI(title="Pier 2 Imports Backend API")
+app = FastAPI(title="Pier 2 Imports Backend API", lifespan=lifespan)
 
 # Enable CORS (for local web frontend or third-party tools like Postman)
 app.add_middleware(
@@ -29,8 +70,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Prev-Cursor", "X-Next-Cursor", "X-Profile-Id"],
 )
 
+# On-demand cProfile of requests sent with X-Profile (or sampled), and the slow query log
+profiling.install_sql_hooks()
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# Per-route latency, in-flight and SQL statistics for /metrics and the Server-Timing header
+metrics.install_sql_hooks()
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Queries over their time budget, or queued too long for a slot, are answered 503 with Retry-After
+@app.exception_handler(budgets.BudgetExceeded)
+@app.exception_handler(budgets.Saturated)
+async def query_budget_exceeded(request: Request, error: Exception):
+    """Tell the client to retry later; the interrupted statement has already released its connection."""
+    return JSONResponse(
+        status_code=503, content={"detail": str(error)}, headers={"Retry-After": str(error.retry_after)}
+    )
+
+
 # Health Check Endpoint
 @app.get("/health")
 def health_check():
@@ -38,63 +98,502 @@ def health_check():
     return {"status": "Backend is running"}
 
 
-# Get complete order history for a customer
+async def _crud(name: str, db, *args, budget_ms: int = 0, **kwargs):
+    """
+    Run the crud function `name` on the request's session.
+
+    Async sessions await the version from `async_crud` on the event loop;
+    sync sessions run the `crud` version in the threadpool. With `budget_ms`,
+    its SQL is interrupted once the budget is spent (see app/budgets.py).
+
+    Raises:
+        budgets.BudgetExceeded: If the budget ran out.
+    """
+    if isinstance(db, AsyncSession):
+        async with budgets.async_time_budget(db, budget_ms):
+            return await getattr(async_crud, name)(*args, db=db, **kwargs)
+    function = budgets.bounded(getattr(crud, name), budget_ms)
+    return await run_in_threadpool(profiling.wrap(function), *args, db=db, **kwargs)
+
+
+async def _analytics(name: str, db, **params):
+    """
+    Run the analytics function `name` on the engine chosen by PIER2_ANALYTICS_ENGINE,
+    within PIER2_ANALYTICS_TIME_BUDGET_MS.
+
+    The columnar engine (imported on first use, so NumPy never slows startup)
+    reads through the session's sync connection in either DB mode. Its
+    snapshot refreshes before the budget starts, so the budget covers only
+    the query over the arrays. Analytics it does not implement (the
+    sketch-backed ones) always run through crud.
+    """
+    budget_ms = settings.analytics_time_budget_ms
+    if settings.analytics_engine.lower() != "columnar":
+        return await _crud(name, db, budget_ms=budget_ms, **params)
+    from app import columnar
+    if not hasattr(columnar, name):
+        return await _crud(name, db, budget_ms=budget_ms, **params)
+    function = budgets.bounded(getattr(columnar, name), budget_ms)
+
+    def run(session):
+        # A reload can outlast the budget; interrupting it would leave the snapshot stale for good
+        columns = columnar.snapshot().refresh(session)
+        return function(db=session, columns=columns, **params)
+
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(run)
+    return await run_in_threadpool(profiling.wrap(run), db)
+
+
+async def _cached_analytics(request: Request, db, name: str, **params):
+    """
+    Serve an analytics crud result through the response cache.
+
+    The cache key is the endpoint, its parameters and the current data
+    version. Responses carry an ETag; a matching If-None-Match gets a 304.
+    Cache misses wait for one of the PIER2_ANALYTICS_MAX_CONCURRENCY slots.
+
+    Raises:
+        ValueError: Propagated from the crud function on invalid parameters.
+        budgets.Saturated: If no slot freed up in time.
+        budgets.BudgetExceeded: If the query ran out of time.
+    """
+    version = await _crud("get_data_version", db)
+    key = (request.url.path, tuple(sorted(params.items())), version)
+
+    entry = cache.analytics_cache.get(key)
+    if entry is None:
+        async with budgets.analytics_slots.slot():
+            result = await _analytics(name, db, **params)
+        entry = cache.analytics_cache.put(key, JSONResponse(jsonable_encoder(result)).body)
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == entry.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def _ndjson(orders, db):
+    """Yield orders as NDJSON lines, closing the streaming session afterwards."""
+    try:
+        for order in orders:
+            yield json.dumps(order) + "\n"
+    finally:
+        db.close()
+
+
+async def _async_ndjson(orders, db):
+    """Async counterpart of `_ndjson`."""
+    try:
+        async for order in orders:
+            yield json.dumps(order) + "\n"
+    finally:
+        await db.close()
+
+
+async def _stream_order_history(customer_id: int, **filters):
+    """
+    Build the NDJSON response for a customer's order history.
+
+    Uses its own session because the request-scoped one from `get_read_session`
+    is closed before a streaming response body is sent. Filters are validated
+    before the response starts.
+    """
+    if database.ASYNC_MODE:
+        db = database.AsyncReadSessionLocal()
+        try:
+            orders = await async_crud.iter_order_history(customer_id, db, **filters)
+        except ValueError:
+            await db.close()
+            raise
+        return StreamingResponse(_async_ndjson(orders, db), media_type="application/x-ndjson")
+
+    db = database.ReadSessionLocal()
+    try:
+        orders = crud.iter_order_history(customer_id, db, **filters)
+    except ValueError:
+        db.close()
+        raise
+    return StreamingResponse(_ndjson(orders, db), media_type="application/x-ndjson")
+
+
+# Get order history for a customer (paginated or streamed)
 @app.get("/customer/{email_or_phone}/orders")
-def get_order_history(email_or_phone: str, db: Session = Depends(get_db)):
+async def get_order_history(
+    email_or_phone: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; omit for the full history"),
+    before: Optional[str] = Query(None, description="Cursor: return orders before this position"),
+    after: Optional[str] = Query(None, description="Cursor: return orders after this position"),
+    start_date: Optional[str] = Query(None, description="Start date in MM-DD-YYYY format"),
+    end_date: Optional[str] = Query(None, description="End date in MM-DD-YYYY format (inclusive)"),
+    format: str = Query("json", enum=["json", "ndjson"]),
+    db: Session = Depends(get_read_session)
+):
     """
-    Retrieve full order history for a customer by email or phone.
+    Retrieve order history for a customer by email or phone, oldest first.
+
+    With `limit`, returns one keyset page; the `X-Prev-Cursor` and
+    `X-Next-Cursor` headers hold cursors for the `before`/`after` parameters.
+    With `format=ndjson`, streams the (filtered) history one order per line.
     """
-    return crud.get_order_history(email_or_phone, db)
+    filters = dict(before=before, after=after, start_date=start_date, end_date=end_date)
+    try:
+        if format == "ndjson":
+            customer_id = await _crud("find_customer_id", db, email_or_phone)
+            if customer_id is None:
+                return {"error": "Customer not found"}
+            return await _stream_order_history(customer_id, **filters)
+
+        history = await _crud(
+            "get_order_history", db, email_or_phone, limit=limit, budget_ms=settings.history_time_budget_ms, **filters
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if limit is not None and isinstance(history, list) and history:
+        response.headers["X-Prev-Cursor"] = crud.encode_cursor(history[0])
+        response.headers["X-Next-Cursor"] = crud.encode_cursor(history[-1])
+    return history
+
+
+# Get order histories for many customers in one request
+@app.post("/customers/orders:batch")
+async def get_order_histories(batch: schemas.OrderHistoryBatch, db: Session = Depends(get_read_session)):
+    """
+    Retrieve the order histories of up to PIER2_BATCH_MAX_IDENTIFIERS customers,
+    given as a mix of emails and phone numbers, with optional date filters.
+    Results are keyed by identifier; unknown identifiers map to an error and
+    are listed under `missing`.
+    """
+    if len(batch.identifiers) > settings.batch_max_identifiers:
+        raise HTTPException(status_code=413, detail=f"At most {settings.batch_max_identifiers} identifiers per request")
+    try:
+        return await _crud(
+            "get_order_histories", db, batch.identifiers, start_date=batch.start_date, end_date=batch.end_date,
+            budget_ms=settings.batch_time_budget_ms,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+# Search customers by name, email or phone fragment
+@app.get("/customers/search")
+async def search_customers(
+    q: str = Query(..., min_length=1, max_length=200, description="Name, email or phone fragment"),
+    limit: int = Query(20, ge=1, le=100, description="Page size"),
+    offset: int = Query(0, ge=0, description="`next_offset` of the previous page"),
+    fuzzy: bool = Query(True, description="Allow one typo when nothing matches exactly"),
+    db: Session = Depends(get_read_session)
+):
+    """
+    Find customers whose first name, last name or email contains every term
+    of `q` (three characters or more), closest matches first, or whose phone
+    number starts with `q` when it is made of phone characters only.
+    """
+    try:
+        return await _crud(
+            "search_customers", db, q, limit=limit, offset=offset, fuzzy=fuzzy,
+            budget_ms=settings.search_time_budget_ms,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 
 # Analytics: Count of orders by billing zip code
 @app.get("/analytics/orders_by_billing_zip")
-def orders_by_billing_zip(
+async def orders_by_billing_zip(
+    request: Request,
     order: str = Query("desc", enum=["asc", "desc"]),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_session)
 ):
     """
     Show total count of orders grouped by billing zip code.
     Supports ascending or descending sort order.
     """
-    return crud.get_orders_grouped_by_billing_zip(db, order=order)
+    return await _cached_analytics(request, db, "get_orders_grouped_by_billing_zip", order=order)
 
 
 # Analytics: Count of orders by shipping zip code
 @app.get("/analytics/orders_by_shipping_zip")
-def orders_by_shipping_zip(
+async def orders_by_shipping_zip(
+    request: Request,
     order: str = Query("desc", enum=["asc", "desc"]),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_session)
 ):
     """
     Show total count of orders grouped by shipping zip code.
     Supports ascending or descending sort order.
     """
-    return crud.get_orders_grouped_by_shipping_zip(db, order=order)
+    return await _cached_analytics(request, db, "get_orders_grouped_by_shipping_zip", order=order)
 
 
-#  Analytics: Most common hour for in-store purchases
+#  Analytics: Most common hours for in-store purchases
 @app.get("/analytics/in_store_peak_hour")
-def in_store_peak_hour(db: Session = Depends(get_db)):
+async def in_store_peak_hour(
+    request: Request,
+    start_date: Optional[str] = Query(None, description="Start date in MM-DD-YYYY format"),
+    end_date: Optional[str] = Query(None, description="End date in MM-DD-YYYY format (inclusive)"),
+    top_n: int = Query(1, ge=1, le=24, description="Number of busiest hours to return"),
+    db: Session = Depends(get_read_session)
+):
     """
-    Identify the hour of day with the highest number of in-store purchases.
-    Returns hour in 12-hour format (e.g., '3pm').
+    Identify the hours of day with the highest number of in-store purchases.
+    Returns hours in 12-hour format (e.g., '3pm'), busiest first.
     """
-    return crud.get_peak_instore_purchase_hour(db)
+    try:
+        return await _cached_analytics(
+            request, db, "get_peak_instore_purchase_hour", start_date=start_date, end_date=end_date, top_n=top_n
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 
-# Analytics: Top 5 customers with in-store purchases
+# Analytics: Top customers with in-store purchases
 @app.get("/analytics/top_instore_customers")
-def top_instore_customer(
+async def top_instore_customer(
+    request: Request,
     start_date: Optional[str] = Query(None, description="Start date in MM-DD-YYYY format"),
-    end_date: Optional[str] = Query(None, description="End date in MM-DD-YYYY format"),
-    db: Session = Depends(get_db)
+    end_date: Optional[str] = Query(None, description="End date in MM-DD-YYYY format (inclusive)"),
+    k: int = Query(5, ge=1, le=100, description="Number of customers to return"),
+    db: Session = Depends(get_read_session)
+):
+    """
+    List the top k customers (by number of in-store orders), 5 by default.
+    Supports optional filtering by date range; ties go to the earlier customer.
+    """
+    try:
+        return await _cached_analytics(
+            request, db, "get_top_instore_customer", start_date=start_date, end_date=end_date, k=k
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+# Analytics: Best-selling items, overall or per shipping zip code (sketch-backed)
+@app.get("/analytics/top_items")
+async def top_items(
+    request: Request,
+    start_month: Optional[str] = Query(None, description="First month in MM-YYYY format"),
+    end_month: Optional[str] = Query(None, description="Last month in MM-YYYY format (inclusive)"),
+    zip_code: Optional[str] = Query(None, min_length=1, description="Only items shipped to this zip code"),
+    k: int = Query(10, ge=1, le=100, description="Number of items to return (at most 64)"),
+    db: Session = Depends(get_read_session)
+):
+    """
+    List the k most sold items with their counts, overall or for one
+    shipping zip code. Large ranges are estimated from sketches
+    (`approximate` is true and `max_error` bounds each count); small ones
+    are counted exactly.
+    """
+    try:
+        return await _cached_analytics(
+            request, db, "get_top_items", start_month=start_month, end_month=end_month, zip_code=zip_code, k=k
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+# Analytics: Distinct customers per billing zip code (sketch-backed)
+@app.get("/analytics/distinct_customers_by_zip")
+async def distinct_customers_by_zip(
+    request: Request,
+    start_month: Optional[str] = Query(None, description="First month in MM-YYYY format"),
+    end_month: Optional[str] = Query(None, description="Last month in MM-YYYY format (inclusive)"),
+    order: str = Query("desc", enum=["asc", "desc"]),
+    db: Session = Depends(get_read_session)
+):
+    """
+    Count the distinct customers ordering with each billing zip code.
+    Large ranges are HyperLogLog estimates (`approximate` is true, with a
+    relative `standard_error`); small ones are counted exactly.
+    """
+    try:
+        return await _cached_analytics(
+            request, db, "get_distinct_customers_by_billing_zip", start_month=start_month, end_month=end_month,
+            order=order,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+# Analytics: Orders or shipped items rolled up by location, channel and month
+@app.get("/analytics/geo")
+async def geo(
+    request: Request,
+    level: str = Query("state", enum=["country", "state", "city", "zip_code"], description="Level to group by"),
+    role: str = Query("billing", enum=["billing", "shipping"],
+                      description="Orders by billing address, or items by shipping address"),
+    country: Optional[str] = Query(None, description="Only this country"),
+    state: Optional[str] = Query(None, description="Only this state"),
+    city: Optional[str] = Query(None, description="Only this city"),
+    in_store: Optional[bool] = Query(None, description="Only in-store (true) or online (false) orders"),
+    start_month: Optional[str] = Query(None, description="First month in MM-YYYY format"),
+    end_month: Optional[str] = Query(None, description="Last month in MM-YYYY format (inclusive)"),
+    sort: str = Query("count", enum=["count", "name"]),
+    order: str = Query("desc", enum=["asc", "desc"]),
+    top_n: Optional[int] = Query(None, ge=1, description="Number of groups to return (all by default)"),
+    db: Session = Depends(get_read_session)
 ):
     """
-    List top 5 customers (by number of in-store orders).
-    Supports optional filtering by date range.
+    Count orders (billing) or shipped items (shipping) per location at one
+    level of country > state > city > zip code. Drill down by filtering on
+    the parent levels and grouping by the next one, or roll up to a coarser
+    level; slice by channel and month range.
+    """
+    try:
+        return await _cached_analytics(
+            request, db, "get_geo_counts", level=level, role=role, country=country, state=state, city=city,
+            in_store=in_store, start_month=start_month, end_month=end_month, sort=sort, order=order, top_n=top_n,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _parse_bulk_orders(body: bytes, ndjson: bool):
+    """
+    Parse and validate a bulk upload body.
+
+    Args:
+        body (bytes): JSON array, or one JSON object per line when `ndjson`.
+        ndjson (bool): Whether the body is newline-delimited JSON.
+
+    Returns:
+        tuple: Number of records received, valid (index, BulkOrder) pairs and
+        per-record errors.
+
+    Raises:
+        ValueError: If a JSON array body cannot be parsed.
+    """
+    if ndjson:
+        records = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                records.append(e)
+    else:
+        records = json.loads(body)
+        if not isinstance(records, list):
+            raise ValueError("Expected a JSON array of orders")
+
+    valid, errors = [], []
+    for index, record in enumerate(records):
+        if isinstance(record, ValueError):
+            errors.append({"index": index, "error": f"Invalid JSON: {record}"})
+            continue
+        try:
+            valid.append((index, schemas.BulkOrder.model_validate(record)))
+        except ValidationError as e:
+            errors.append({"index": index, "error": "; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            )})
+    return len(records), valid, errors
+
+
+# Ingestion: bulk order upload
+@app.post("/orders/bulk")
+async def bulk_create_orders(request: Request, db: Session = Depends(get_session)):
+    """
+    Insert many orders at once from a JSON array or NDJSON body
+    (Content-Type: application/x-ndjson). Each record is an order plus a
+    `customer` with email and/or phone; customers are deduplicated by them.
+    Invalid records are reported by index and do not stop the others.
+    """
+    body = await request.body()
+    ndjson = "ndjson" in request.headers.get("content-type", "")
+    try:
+        received, valid, errors = await run_in_threadpool(profiling.wrap(_parse_bulk_orders), body, ndjson)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if received > settings.bulk_max_records:
+        raise HTTPException(status_code=413, detail=f"At most {settings.bulk_max_records} records per request")
+
+    result = await _crud("ingest_orders", db, valid, chunk_size=settings.bulk_chunk_size)
+    errors = sorted(errors + result["errors"], key=lambda error: error["index"])
+    return {"received": received, "inserted": result["inserted"], "failed": len(errors), "errors": errors}
+
+
+# Ingestion: one order, group-committed with concurrent ones
+@app.post("/orders", status_code=201)
+async def create_order(order: schemas.BulkOrder):
+    """
+    Insert one order plus its `customer` (email and/or phone, deduplicated
+    by them). Concurrent requests share a transaction through the
+    group-commit writer; the response is sent once the order is committed
+    to disk. A full write queue answers 503 with Retry-After.
+    """
+    try:
+        order_id = await writer.order_writer().write(order)
+    except writer.Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=409, detail=crud.error_message(e))
+    return {"order_id": order_id}
+
+
+# Monitoring: analytics cache counters
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Hit/miss/eviction counters and size of the analytics response cache.
+    """
+    return cache.analytics_cache.stats()
+
+
+# Monitoring: Prometheus metrics
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Request, SQL and cache metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject admin requests without the configured PIER2_PROFILE_TOKEN; without one the admin routes are off."""
+    if not settings.profile_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest((x_admin_token or "").encode(), settings.profile_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Admin-Token")
+
+
+# Admin: captured request profiles
+@app.get("/admin/profiles", dependencies=[Depends(_require_admin)])
+def list_profiles():
+    """
+    Summaries of the most recent request profiles, newest first.
+    Send `X-Profile` with the profile token with any request to profile it.
+    """
+    return [record.summary() for record in profiling.profiles.items()]
+
+
+# Admin: one request profile
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(_require_admin)])
+def get_profile(
+    profile_id: int,
+    sort: str = Query("cumulative", enum=["cumulative", "tottime", "ncalls"]),
+    limit: int = Query(40, ge=1, le=1000, description="Number of functions to list"),
+):
+    """
+    A captured profile as cProfile/pstats text, with the request summary.
+    """
+    record = profiling.profiles.get(profile_id)
+    if record is None or record.stats is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {**record.summary(), "report": record.report(sort, limit)}
+
+
+# Admin: slow SQL statements
+@app.get("/admin/slow_queries", dependencies=[Depends(_require_admin)])
+def list_slow_queries():
+    """
+    Recent SQL statements slower than PIER2_SLOW_QUERY_MS, newest first,
+    with the count and types of their bound parameters and EXPLAIN QUERY PLAN output.
     """
-    return crud.get_top_instore_customer(db, start_date=start_date, end_date=end_date)
+    return [vars(query) for query in profiling.slow_queries.items()]
 
 
 # Development: Load and return sample data (for testing/demo)
@@ -0,0 +1,264 @@
+"""
+Request and SQL instrumentation, exposed in Prometheus text format.
+
+`MetricsMiddleware` times every HTTP request per route template and keeps
+in-flight gauges. SQLAlchemy cursor events count statements and DB time
+against the request running them (tracked in a context variable, which
+follows requests into the threadpool and into async sessions), and the
+totals are returned in a `Server-Timing` header. Metrics are plain
+lock-protected counters so the layer is cheap enough to leave on.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+
+# Latency buckets in seconds, and statements-per-request buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+# Route label for SQL run outside a request (migrations, CLI tools, background work)
+NO_ROUTE = "-"
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """
+    A monotonically increasing value per label combination.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): HELP text.
+        labels (tuple): Label names; values are passed as keyword arguments.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for exposition."""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", key, (), value
+
+
+class Gauge(Counter):
+    """A value that goes up and down per label combination."""
+
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class CallbackGauge:
+    """A gauge or counter whose unlabelled value is read from `function` at scrape time."""
+
+    def __init__(self, name: str, documentation: str, function, type: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labels = ()
+        self.type = type
+        self.function = function
+        REGISTRY.append(self)
+
+    def samples(self):
+        yield "", (), (), self.function()
+
+
+class Histogram(Counter):
+    """
+    Observations counted into cumulative buckets per label combination.
+
+    Args:
+        buckets (tuple): Ascending upper bounds; +Inf is implied.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def value(self, **labels):
+        """Return (count, sum) of the observations for the labels."""
+        series = self._values.get(self._key(labels))
+        return (sum(series[:-1]), series[-1]) if series else (0, 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                yield "_bucket", key, (("le", bound if bound == "+Inf" else _format_value(bound)),), cumulative
+            yield "_sum", key, (), series[-1]
+            yield "_count", key, (), cumulative
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, key, extra, value in metric.samples():
+            lines.append(f"{metric.name}{suffix}{_format_labels(metric.labels, key, extra)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter("pier2_http_requests_total", "HTTP requests completed.", ("method", "route", "status"))
+REQUEST_SECONDS = Histogram(
+    "pier2_http_request_duration_seconds", "HTTP request latency, including streamed bodies.", ("method", "route")
+)
+IN_FLIGHT = Gauge("pier2_http_requests_in_flight", "HTTP requests being served.", ("method", "route"))
+DB_STATEMENTS = Counter("pier2_db_statements_total", "SQL statements executed.", ("route",))
+DB_SECONDS = Counter("pier2_db_seconds_total", "Time spent executing SQL statements.", ("route",))
+STATEMENTS_PER_REQUEST = Histogram(
+    "pier2_db_statements_per_request", "SQL statements executed per HTTP request.", ("route",), STATEMENT_BUCKETS
+)
+
+
+class RequestStats:
+    """SQL statistics of the request being served."""
+
+    __slots__ = ("route", "statements", "db_seconds")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.statements = 0
+        self.db_seconds = 0.0
+
+
+current_request: ContextVar = ContextVar("pier2_request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._pier2_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._pier2_started
+    stats = current_request.get()
+    route = NO_ROUTE
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+        route = stats.route
+    DB_STATEMENTS.inc(route=route)
+    DB_SECONDS.inc(elapsed, route=route)
+
+
+def install_sql_hooks():
+    """Count statements and DB time on every SQLAlchemy engine, sync or async. Idempotent."""
+    if not event.contains(Engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def route_template(scope) -> str:
+    """Return the path template of the route matching `scope`, to keep label cardinality bounded."""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+
+def server_timing(stats: RequestStats, elapsed: float) -> str:
+    """Format a Server-Timing header value: DB time and statement count, and time to first byte."""
+    return f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.statements} queries", app;dur={elapsed * 1000:.2f}'
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency, in-flight requests and SQL
+    statistics per route, and adding a `Server-Timing` response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        stats = RequestStats(route)
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+        IN_FLIGHT.inc(method=method, route=route)
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(stats, time.perf_counter() - started)
+                message["headers"] = [*message.get("headers", []), (b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            IN_FLIGHT.dec(method=method, route=route)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, route=route)
+            REQUESTS.inc(method=method, route=route, status=status)
+            STATEMENTS_PER_REQUEST.observe(stats.statements, route=route)
+            current_request.reset(token)
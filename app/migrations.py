@@ -0,0 +1,139 @@
+"""
+Schema setup and in-place migrations for SQLite databases.
+
+`create_all` only creates missing tables, so anything it cannot express
+(triggers, backfills, changes to existing tables) is applied here as an
+ordered list of migrations. The number of applied migrations is stored in
+SQLite's `PRAGMA user_version`, so each one runs once per database file.
+New tables therefore ship with a migration, even an empty one, so that
+`pending` sees them.
+
+Bring a database up to date (once per deployment) with:
+
+    python -m app.migrations
+"""
+
+from sqlalchemy.engine import Connection, Engine
+
+from app import addresses, cache, identifiers, models, rollups, search
+
+
+def _instore_hourly_counts(conn: Connection):
+    """Maintain the in-store (day, hour) rollup for peak-hour analytics."""
+    rollups.install(conn, "instore_hourly_counts")
+
+
+def _zip_code_counts(conn: Connection):
+    """Maintain the billing and shipping zip code rollups."""
+    rollups.install(conn, "billing_zip_counts")
+    rollups.install(conn, "shipping_zip_counts")
+
+
+def _query_indexes(conn: Connection):
+    """Create the foreign key and analytics indexes declared on the models."""
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _data_version(conn: Connection):
+    """Count writes so cached analytics can tell when they are stale."""
+    cache.install_data_version(conn)
+
+
+def _canonical_addresses(conn: Connection):
+    """Deduplicate billing/shipping addresses into the canonical address store."""
+    columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(addresses)")]
+    if "address_key" not in columns:
+        conn.exec_driver_sql("ALTER TABLE addresses ADD COLUMN address_key VARCHAR")
+    addresses.compact(conn)
+    conn.exec_driver_sql(addresses.UNIQUE_INDEX)
+
+
+def _customer_lookup_keys(conn: Connection):
+    """Backfill normalized email/phone keys, merging customers that differ only in formatting."""
+    columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(customers)")]
+    for column in ("email_key", "phone_key"):
+        if column not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE customers ADD COLUMN {column} VARCHAR")
+    identifiers.compact(conn)
+    for statement in identifiers.UNIQUE_INDEXES:
+        conn.exec_driver_sql(statement)
+
+
+def _instore_customer_counts(conn: Connection):
+    """Maintain the per-customer in-store rollups for top-customer analytics."""
+    rollups.install(conn, "instore_customer_daily_counts")
+    rollups.install(conn, "instore_customer_counts")
+
+
+def _customer_search(conn: Connection):
+    """Index customer names and emails for full-text search, kept in sync by triggers."""
+    search.install(conn)
+
+
+def _sketches(conn: Connection):
+    """Build the item and distinct customer sketches, and queue new orders for them."""
+    # Imported here: NumPy is loaded on first use, never at startup
+    from app import sketches
+
+    sketches.install(conn)
+
+
+def _geo_counts(conn: Connection):
+    """Maintain the billing and shipping geo rollup cubes (location hierarchy x channel x period)."""
+    rollups.install(conn, "billing_geo_counts")
+    rollups.install(conn, "shipping_geo_counts")
+
+
+# Append only: a migration's position is its version number
+MIGRATIONS = [
+    _instore_hourly_counts,
+    _zip_code_counts,
+    _query_indexes,
+    _data_version,
+    _canonical_addresses,
+    _customer_lookup_keys,
+    _instore_customer_counts,
+    _customer_search,
+    _sketches,
+    _geo_counts,
+]
+
+
+def pending(engine: Engine) -> int:
+    """
+    Count the migrations not yet applied to a database.
+
+    Args:
+        engine (Engine): Engine for the database to check.
+
+    Returns:
+        int: Number of pending migrations; 0 when the database is current.
+    """
+    with engine.connect() as conn:
+        return len(MIGRATIONS) - conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def upgrade(engine: Engine):
+    """
+    Create missing tables and apply any pending migrations.
+
+    Args:
+        engine (Engine): Engine for the database to upgrade.
+    """
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+
+
+if __name__ == "__main__":
+    from app import database
+
+    count = pending(database.engine)
+    upgrade(database.engine)
+    print(f"Applied {count} migration(s); schema version {len(MIGRATIONS)}.")
@@ -3,10 +3,12 @@ SQLAlchemy ORM models for Pier 2 backend system.
 Defines database schema and relationships using declarative_base.
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Index, LargeBinary
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 
+from app import identifiers
+
 Base = declarative_base()
 
 class Customer(Base):
@@ -20,6 +22,9 @@ class Customer(Base):
     last_name = Column(String)
     email = Column(String, unique=True, index=True)
     phone = Column(String, unique=True, index=True)
+    # Normalized lookup keys, set from email/phone on insert and unique-indexed (see app/identifiers.py)
+    email_key = Column(String, default=identifiers.email_key_default)
+    phone_key = Column(String, default=identifiers.phone_key_default)
 
     orders = relationship("Order", back_populates="customer")
     addresses = relationship("Address", back_populates="customer")  
@@ -36,8 +41,10 @@ class Address(Base):
     street = Column(String)
     city = Column(String)
     state = Column(String)
-    zip_code = Column(String)
+    zip_code = Column(String, index=True)
     country = Column(String, default="USA")
+    # Normalized content hash of shared billing/shipping addresses, unique-indexed (see app/addresses.py)
+    address_key = Column(String)
 
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=True)  # New FK to customer
     customer = relationship("Customer", back_populates="addresses")
@@ -51,10 +58,17 @@ class Order(Base):
     __tablename__ = 'orders'
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
-    billing_address_id = Column(Integer, ForeignKey("addresses.id"))
+    billing_address_id = Column(Integer, ForeignKey("addresses.id"), index=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
     in_store = Column(Boolean)
 
+    __table_args__ = (
+        # Order history: one customer's orders in keyset (timestamp, id) order
+        Index("ix_orders_customer_id_timestamp", "customer_id", "timestamp"),
+        # In-store analytics: covers the date-ranged top-customers GROUP BY
+        Index("ix_orders_in_store_timestamp_customer_id", "in_store", "timestamp", "customer_id"),
+    )
+
     customer = relationship("Customer", back_populates="orders")
     billing_address = relationship("Address")
     items = relationship("OrderItem", back_populates="order")
@@ -67,9 +81,155 @@ class OrderItem(Base):
     """
     __tablename__ = 'order_items'
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     item_name = Column(String)
-    shipping_address_id = Column(Integer, ForeignKey("addresses.id"))
+    shipping_address_id = Column(Integer, ForeignKey("addresses.id"), index=True)
 
     order = relationship("Order", back_populates="items")
     shipping_address = relationship("Address")
+
+
+class InstoreHourlyCount(Base):
+    """
+    Rollup of in-store orders per calendar day and hour of day.
+    Kept up to date by triggers on `orders` (see app/rollups.py), so hourly
+    analytics never have to scan the orders table.
+    """
+    __tablename__ = 'instore_hourly_counts'
+    day = Column(Date, primary_key=True)
+    hour = Column(Integer, primary_key=True)  # 0-23
+    order_count = Column(Integer, nullable=False, default=0)
+
+
+class InstoreCustomerDailyCount(Base):
+    """
+    Rollup of in-store orders per customer and calendar day.
+    Kept up to date by triggers on `orders` (see app/rollups.py); date-ranged
+    top-customer queries sum it instead of the orders table.
+    """
+    __tablename__ = 'instore_customer_daily_counts'
+    customer_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Whole date ranges, summed per customer without touching the table
+        Index("ix_instore_customer_daily_counts_day", "day", "customer_id", "order_count"),
+    )
+
+
+class InstoreCustomerCount(Base):
+    """
+    Rollup of all-time in-store orders per customer.
+    Kept up to date by triggers on `orders` (see app/rollups.py). Read in rank
+    order it answers the unfiltered top customers directly, and bounds what
+    any customer can reach within a date range.
+    """
+    __tablename__ = 'instore_customer_counts'
+    customer_id = Column(Integer, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+
+
+# Rank order: most in-store orders first, ties to the lower customer id
+Index("ix_instore_customer_counts_rank", InstoreCustomerCount.order_count.desc(), InstoreCustomerCount.customer_id)
+
+
+class BillingZipCount(Base):
+    """
+    Rollup of orders per billing address zip code.
+    Kept up to date by triggers on `orders` and `addresses` (see app/rollups.py).
+    """
+    __tablename__ = 'billing_zip_counts'
+    zip_code = Column(String, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+
+
+class ShippingZipCount(Base):
+    """
+    Rollup of order items per shipping address zip code.
+    Kept up to date by triggers on `order_items` and `addresses` (see app/rollups.py).
+    """
+    __tablename__ = 'shipping_zip_counts'
+    zip_code = Column(String, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)  # number of items shipped
+
+
+class BillingGeoCount(Base):
+    """
+    Rollup of orders per billing location, channel and period (calendar
+    month, year and all time), at the city and the zip code level of the
+    location hierarchy (country, state, city, zip code). Kept up to date
+    by triggers on `orders` and `addresses` (see app/rollups.py).
+    """
+    __tablename__ = 'billing_geo_counts'
+    # Level and period lead the key so a query reads only its level's rows of its periods
+    level = Column(String, primary_key=True)  # "city" or "zip_code"; coarser levels are summed from the cities
+    period = Column(String, primary_key=True)  # "YYYY-MM" for a month, "YYYY" for a year, "" for all time
+    country = Column(String, primary_key=True)  # "" when the address lacks it, as for the other parts
+    state = Column(String, primary_key=True)
+    city = Column(String, primary_key=True)
+    zip_code = Column(String, primary_key=True)
+    in_store = Column(Boolean, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # The rows a decrement emptied, deleted by the triggers without a scan
+        Index("ix_billing_geo_counts_empty", "order_count", sqlite_where=order_count <= 0),
+        # Rows stored in key order: a level's counts are read without a lookup per row
+        {"sqlite_with_rowid": False},
+    )
+
+
+class ShippingGeoCount(Base):
+    """
+    Rollup of order items per shipping location, their order's channel and
+    period, at the city and the zip code level. Kept up to date by triggers
+    on `order_items`, `orders` and `addresses` (see app/rollups.py).
+    """
+    __tablename__ = 'shipping_geo_counts'
+    level = Column(String, primary_key=True)
+    period = Column(String, primary_key=True)
+    country = Column(String, primary_key=True)
+    state = Column(String, primary_key=True)
+    city = Column(String, primary_key=True)
+    zip_code = Column(String, primary_key=True)
+    in_store = Column(Boolean, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)  # number of items shipped
+
+    __table_args__ = (
+        Index("ix_shipping_geo_counts_empty", "order_count", sqlite_where=order_count <= 0),
+        {"sqlite_with_rowid": False},
+    )
+
+
+class Sketch(Base):
+    """
+    A serialized sketch of one calendar month or year and zip code, for the
+    approximate item and distinct customer analytics (see app/sketches.py).
+    """
+    __tablename__ = 'sketches'
+    name = Column(String, primary_key=True)  # "items" or "customers"
+    bucket = Column(String, primary_key=True)  # "YYYY-MM" or "YYYY"
+    zip_code = Column(String, primary_key=True)  # "" for the item sketches over every zip code
+    count = Column(Integer, nullable=False, default=0)  # items sold or orders folded in
+    data = Column(LargeBinary, nullable=False)
+
+
+class SketchPending(Base):
+    """
+    Orders inserted but not yet folded into the sketches.
+    Filled by a trigger on `orders` and emptied by `sketches.fold`.
+    """
+    __tablename__ = 'sketch_pending'
+    order_id = Column(Integer, primary_key=True)
+
+
+class DataVersion(Base):
+    """
+    Single-row counter bumped by triggers on every write to customers,
+    addresses, orders and order items (see app/cache.py). Cached analytics
+    are keyed by it, so any data change invalidates them in every worker.
+    """
+    __tablename__ = 'data_version'
+    id = Column(Integer, primary_key=True)  # always 1
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,335 @@
+"""
+Year-partitioned order storage.
+
+The main database file is the hot partition: every write lands there, and it
+keeps customers, the canonical address store, the rollups and recent orders.
+Closed years can be moved out to one file per year next to it,
+`<database>.orders-<year>.db`, holding that year's orders and items, copies
+of the addresses they reference and the year's own rollup rows:
+
+    python -m app.partitions archive 2019 2020
+    python -m app.partitions archive --before 2023 --compact
+    python -m app.partitions list
+
+Archives are VACUUMed, made read-only and attached read-only and immutable,
+so SQLite reads them without locking. Order history reads fan out only to the
+archives whose year overlaps the requested dates or cursor (plus the hot
+partition, which may also hold late writes for archived years), attaching
+them on demand; with no archive files nothing changes and no extra statement
+runs. Rollups keep counting archived orders, so analytics results do not
+change either.
+
+The existing files are the catalog. An archive is published (renamed into
+place) just before its rows are deleted from the hot partition, and history
+reads drop duplicate order ids, so a concurrent reader never misses an order.
+
+Archived orders are immutable: later customer merges (`python -m
+app.identifiers`) do not re-point them, so deduplicate customers before
+archiving a year.
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from urllib.request import pathname2url
+
+from sqlalchemy.engine import Connection, Engine
+
+from app import rollups
+
+# Fact tables moved into an archive; the addresses they reference are copied, since hot rows share them
+ARCHIVED_TABLES = ("orders", "order_items")
+# Archives attached per connection at once (SQLite allows 10); the least recently used is detached first
+MAX_ATTACHED = 8
+
+_ARCHIVE_NAME = re.compile(r"\.orders-(\d{4})\.db$")
+_listings = {}
+_listings_lock = threading.Lock()
+
+
+def database_path(bind) -> str:
+    """File of a sync or async engine's database, or None for an in-memory database."""
+    database = getattr(bind, "url", None) and bind.url.database
+    if not database or database == ":memory:" or database.startswith("file::memory:"):
+        return None
+    return os.path.abspath(database)
+
+
+def archive_path(path: str, year: int) -> str:
+    """Archive file of `year` for the database at `path`."""
+    return f"{os.path.splitext(path)[0]}.orders-{year}.db"
+
+
+def archives(path: str) -> dict:
+    """
+    Archive files of the database at `path`.
+
+    The directory listing is cached until the directory changes, so with no
+    archives this costs one `stat` per call.
+
+    Returns:
+        dict: Archive file per year, ordered by year.
+    """
+    if path is None:
+        return {}
+    directory = os.path.dirname(path)
+    prefix = os.path.basename(os.path.splitext(path)[0])
+    try:
+        modified = os.stat(directory).st_mtime_ns
+    except OSError:
+        return {}
+    with _listings_lock:
+        cached = _listings.get(path)
+        if cached is not None and cached[0] == modified:
+            return cached[1]
+    found = {}
+    for entry in os.scandir(directory):
+        match = _ARCHIVE_NAME.search(entry.name)
+        if match and entry.name == f"{prefix}.orders-{match.group(1)}.db":
+            found[int(match.group(1))] = entry.path
+    found = dict(sorted(found.items()))
+    with _listings_lock:
+        _listings[path] = (modified, found)
+    return found
+
+
+def schema(year: int) -> str:
+    """Schema name an archive is attached under."""
+    return f"archive_{year}"
+
+
+def _attach(conn: Connection, year: int, path: str) -> str:
+    """Attach the archive of `year` read-only to the connection, unless it already is."""
+    attached = conn.connection.info.setdefault("pier2_archives", OrderedDict())
+    name = schema(year)
+    if name in attached:
+        attached.move_to_end(name)
+        return name
+    if len(attached) >= MAX_ATTACHED:
+        oldest, _ = attached.popitem(last=False)
+        conn.exec_driver_sql(f"DETACH DATABASE {oldest}")
+    conn.exec_driver_sql(f"ATTACH DATABASE ? AS {name}", (f"file:{pathname2url(path)}?mode=ro&immutable=1",))
+    attached[name] = path
+    return name
+
+
+def partitions(db, start: datetime = None, end: datetime = None, descending: bool = False):
+    """
+    Partitions holding the orders of a time range, attaching the archives among them.
+
+    Each archive is attached only when the iteration reaches it, so a reader
+    that stops early attaches nothing more, and one reading more archives
+    than `MAX_ATTACHED` (one at a time) never loses the one it is reading.
+
+    Args:
+        db (Session or Connection): Session or connection to read through.
+        start (datetime): Optional inclusive lower bound of the order timestamps.
+        end (datetime): Optional exclusive upper bound.
+        descending (bool): Order the archives newest first.
+
+    Yields:
+        tuple: (schema, year) pairs: (None, None) for the hot partition first,
+        then each overlapping archive in year order.
+    """
+    yield None, None
+    conn = db.connection() if not isinstance(db, Connection) else db
+    found = archives(database_path(conn.engine))
+    years = [
+        year for year in found
+        if (start is None or start < datetime(year + 1, 1, 1)) and (end is None or end > datetime(year, 1, 1))
+    ]
+    for year in sorted(years, reverse=descending):
+        yield _attach(conn, year, found[year]), year
+
+
+def _build(path: str, target: str, year: int):
+    """
+    Write the archive of `year` to `target`: orders, items, their addresses and rollup rows.
+
+    Runs while the caller holds the hot database's write lock, so the rows
+    read here are exactly the rows deleted afterwards. The newest order and
+    the order holding the newest item stay hot, so new ids (max + 1) never
+    reuse an archived one.
+
+    Returns:
+        tuple[int, int]: Archived orders and items.
+    """
+    connection = sqlite3.connect(target, isolation_level=None)
+    try:
+        connection.execute("ATTACH DATABASE ? AS hot", (f"file:{pathname2url(path)}?mode=ro",))
+        # Same tables and indexes as the hot partition, as its migrations left them
+        tables = ("orders", "order_items", "addresses", *rollups.ROLLUPS)
+        for (sql,) in connection.execute(
+            f"SELECT sql FROM hot.sqlite_master WHERE type IN ('table', 'index') AND sql IS NOT NULL "
+            f"AND tbl_name IN ({', '.join('?' * len(tables))}) ORDER BY type = 'index'", tables
+        ).fetchall():
+            connection.execute(sql)
+
+        connection.execute("BEGIN")
+        connection.execute("""
+            INSERT INTO orders SELECT * FROM hot.orders
+            WHERE timestamp >= ? AND timestamp < ?
+              AND id != (SELECT MAX(id) FROM hot.orders)
+              AND id IS NOT (SELECT order_id FROM hot.order_items ORDER BY id DESC LIMIT 1)""",
+            (f"{year}-01-01", f"{year + 1}-01-01"))
+        connection.execute(
+            "INSERT INTO order_items SELECT * FROM hot.order_items WHERE order_id IN (SELECT id FROM orders)"
+        )
+        connection.execute("""
+            INSERT INTO addresses SELECT * FROM hot.addresses WHERE id IN (
+                SELECT billing_address_id FROM orders UNION SELECT shipping_address_id FROM order_items
+            )""")
+        # The year's own rollup rows, for `rollups.rebuild`; unqualified names are this file's tables
+        for _, backfill in rollups.ROLLUPS.values():
+            connection.execute(backfill)
+        connection.execute("COMMIT")
+        connection.execute("DETACH DATABASE hot")
+        counts = tuple(connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ARCHIVED_TABLES)
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    return counts
+
+
+def archive(engine: Engine, year: int) -> dict:
+    """
+    Move the orders of `year` from the hot partition into a read-only archive file.
+
+    The hot database's write lock is held throughout. The archive is built
+    under a temporary name, published, and then its rows are deleted from
+    the hot partition with the rollup triggers paused, so rollups (and every
+    analytics result) stay as they were.
+
+    Args:
+        engine (Engine): Write engine of a file database.
+        year (int): Calendar year to archive; it must have ended.
+
+    Returns:
+        dict: Year, archive path and the number of orders and items moved.
+
+    Raises:
+        ValueError: If the database is in memory, the year is still open or already archived.
+    """
+    from app import sketches
+
+    path = database_path(engine)
+    if path is None:
+        raise ValueError("Only file databases can be partitioned")
+    if year >= datetime.now().year:
+        raise ValueError(f"{year} has not ended yet; only closed years can be archived")
+    target = archive_path(path, year)
+    if os.path.exists(target):
+        raise ValueError(f"{year} is already archived in {target}")
+
+    building = f"{target}.building"
+    if os.path.exists(building):
+        os.remove(building)
+    with engine.connect() as conn:
+        # Take the write lock before reading anything, so nothing changes between copy and delete
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        published = False
+        try:
+            # Queued orders are counted before they leave the hot partition
+            sketches.fold(conn)
+            orders, items = _build(path, building, year)
+            if not orders:
+                conn.rollback()
+                os.remove(building)
+                return {"year": year, "path": None, "orders": 0, "items": 0}
+            os.chmod(building, 0o444)
+            os.replace(building, target)
+            published = True
+
+            archived = schema(year)
+            conn.exec_driver_sql(f"ATTACH DATABASE ? AS {archived}", (f"file:{pathname2url(target)}?mode=ro",))
+            with rollups.paused(conn):
+                conn.exec_driver_sql(
+                    f"DELETE FROM main.order_items WHERE id IN (SELECT id FROM {archived}.order_items)"
+                )
+                conn.exec_driver_sql(f"DELETE FROM main.orders WHERE id IN (SELECT id FROM {archived}.orders)")
+            conn.commit()
+            conn.exec_driver_sql(f"DETACH DATABASE {archived}")
+        except BaseException:
+            conn.rollback()
+            for leftover in (target if published else None, building):
+                if leftover and os.path.exists(leftover):
+                    os.chmod(leftover, 0o644)
+                    os.remove(leftover)
+            raise
+    return {"year": year, "path": target, "orders": orders, "items": items}
+
+
+def add_archived_rollups(conn: Connection, name: str):
+    """
+    Add the rollup rows stored in each archive to the hot rollup `name`.
+
+    `rollups.rebuild` recomputes a rollup from the hot partition, then calls
+    this so archived orders keep being counted.
+    """
+    for year, path in archives(database_path(conn.engine)).items():
+        archived = _attach(conn, year, path)
+        if not conn.exec_driver_sql(
+            f"SELECT 1 FROM {archived}.sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).first():
+            continue
+        keys = [row[1] for row in conn.exec_driver_sql(f"PRAGMA {archived}.table_info({name})") if row[5]]
+        conn.exec_driver_sql(f"""
+            INSERT INTO main.{name} ({", ".join(keys)}, order_count)
+            SELECT {", ".join(keys)}, order_count FROM {archived}.{name} WHERE true
+            ON CONFLICT ({", ".join(keys)}) DO UPDATE SET order_count = order_count + excluded.order_count""")
+
+
+def main(engine: Engine, argv=None):
+    """Archive closed years, or list the partitions of a database."""
+    parser = argparse.ArgumentParser(prog="python -m app.partitions", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive_parser = commands.add_parser("archive", help="move closed years into read-only archive files")
+    archive_parser.add_argument("years", nargs="*", type=int)
+    archive_parser.add_argument("--before", type=int, help="archive every year before this one")
+    archive_parser.add_argument(
+        "--compact", action="store_true", help="VACUUM the hot database afterwards (blocks writes meanwhile)"
+    )
+    commands.add_parser("list", help="list the archive files")
+    args = parser.parse_args(argv)
+
+    path = database_path(engine)
+    if args.command == "list":
+        for year, archived in archives(path).items():
+            print(f"{year}: {archived} ({os.path.getsize(archived) / 2 ** 20:.1f} MiB)")
+        print(f"hot: {path} ({os.path.getsize(path) / 2 ** 20:.1f} MiB)")
+        return 0
+
+    years = set(args.years)
+    if args.before is not None:
+        with engine.connect() as conn:
+            first = conn.exec_driver_sql("SELECT MIN(timestamp) FROM orders").scalar()
+        if first is not None:
+            years.update(range(datetime.fromisoformat(str(first)).year, args.before))
+    if not years:
+        parser.error("give the years to archive, or --before")
+    for year in sorted(years - set(archives(path))):
+        try:
+            moved = archive(engine, year)
+        except ValueError as e:
+            print(e)
+            return 1
+        if moved["path"]:
+            print(f"Archived {moved['orders']} orders and {moved['items']} items of {year} to {moved['path']}.")
+    if args.compact:
+        # Deleted rows only free pages; VACUUM gives them back so the hot file shrinks
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+        print(f"Compacted {path} to {os.path.getsize(path) / 2 ** 20:.1f} MiB.")
+    return 0
+
+
+if __name__ == "__main__":
+    from app import database, migrations
+
+    migrations.upgrade(database.engine)
+    sys.exit(main(database.engine, sys.argv[1:]))
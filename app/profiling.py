@@ -0,0 +1,268 @@
+"""
+On-demand request profiling and slow-query capture.
+
+A request is profiled when it carries the `X-Profile` header holding
+`PIER2_PROFILE_TOKEN` (ignored while no token is configured) or is picked
+by `PIER2_PROFILE_SAMPLE_RATE`. cProfile runs on the event loop thread for the
+whole request and, through `wrap`, inside each threadpool call the request
+makes; the merged stats are kept in a bounded ring buffer and the response
+gets an `X-Profile-Id` header. Only one request is profiled at a time, and
+concurrent requests' event-loop work can appear in its profile.
+
+Independently, every SQL statement slower than `PIER2_SLOW_QUERY_MS` is
+logged with the types of its bound parameters (never their values, which
+hold customer emails and phone numbers) and `EXPLAIN QUERY PLAN`.
+"""
+
+import cProfile
+import functools
+import io
+import itertools
+import logging
+import pstats
+import random
+import secrets
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import metrics
+from app.config import settings
+
+PROFILE_HEADER = b"x-profile"
+# Parameter types kept per slow query; longer lists (IN clauses, bulk rows) are truncated
+MAX_LOGGED_PARAMETERS = 20
+
+logger = logging.getLogger("pier2.slow_queries")
+
+PROFILES = metrics.Counter("pier2_profiles_captured_total", "Requests profiled.", ("trigger",))
+PROFILES_SKIPPED = metrics.Counter(
+    "pier2_profiles_skipped_total", "Profiling requests skipped because another profile was running."
+)
+SLOW_QUERIES = metrics.Counter("pier2_slow_queries_total", "SQL statements over the slow query threshold.", ("route",))
+
+
+class RingBuffer:
+    """
+    Thread-safe bounded buffer of records with increasing integer ids;
+    the oldest record is dropped when full.
+    """
+
+    def __init__(self, size: int):
+        self._records = deque(maxlen=max(1, size))
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def append(self, record) -> int:
+        with self._lock:
+            record.id = next(self._ids)
+            self._records.append(record)
+            return record.id
+
+    def get(self, record_id: int):
+        with self._lock:
+            return next((record for record in self._records if record.id == record_id), None)
+
+    def items(self) -> list:
+        """Records, newest first."""
+        with self._lock:
+            return list(reversed(self._records))
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+@dataclass
+class ProfileRecord:
+    """A captured request profile."""
+    method: str
+    path: str
+    query: str
+    trigger: str
+    started_at: str
+    status: int = 0
+    duration_ms: float = 0.0
+    statements: int = 0
+    db_ms: float = 0.0
+    stats: pstats.Stats = field(default=None, repr=False)
+    id: int = 0
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id, "method": self.method, "path": self.path, "query": self.query,
+            "trigger": self.trigger, "started_at": self.started_at, "status": self.status,
+            "duration_ms": self.duration_ms, "statements": self.statements, "db_ms": self.db_ms,
+        }
+
+    def report(self, sort: str = "cumulative", limit: int = 40) -> str:
+        """The profile as pstats text, sorted by `sort` and cut to `limit` functions."""
+        stream = io.StringIO()
+        self.stats.stream = stream
+        self.stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+@dataclass
+class SlowQuery:
+    """A SQL statement that ran over the slow query threshold."""
+    logged_at: str
+    route: str
+    duration_ms: float
+    statement: str
+    parameter_count: int
+    parameter_types: list
+    plan: list
+    id: int = 0
+
+
+profiles = RingBuffer(settings.profile_buffer_size)
+slow_queries = RingBuffer(settings.slow_query_log_size)
+
+# Threadpool profiles of the request being profiled, if any
+_thread_profiles: ContextVar = ContextVar("pier2_thread_profiles", default=None)
+# cProfile on the event loop thread can only profile one request at a time
+_loop_profiler = threading.Lock()
+
+
+def wrap(func):
+    """
+    Return `func`, profiled in whatever thread it runs in when the current
+    request is being profiled. Used for functions sent to the threadpool.
+    """
+    thread_profiles = _thread_profiles.get()
+    if thread_profiles is None:
+        return func
+
+    @functools.wraps(func)
+    def profiled(*args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            thread_profiles.append(profile)
+
+    return profiled
+
+
+def _trigger(scope, config) -> str:
+    """Why this request should be profiled ("header" or "sampled"), or None."""
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            # Without a configured token no client can ask for a profile
+            if config.profile_token and secrets.compare_digest(value, config.profile_token.encode("latin-1")):
+                return "header"
+            break
+    if config.profile_sample_rate > 0 and random.random() < config.profile_sample_rate:
+        return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests selected by `X-Profile` or sampling.
+    """
+
+    def __init__(self, app, config=None):
+        self.app = app
+        self.config = config
+
+    async def __call__(self, scope, receive, send):
+        trigger = _trigger(scope, self.config or settings) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+        if not _loop_profiler.acquire(blocking=False):
+            PROFILES_SKIPPED.inc()
+            await self.app(scope, receive, send)
+            return
+
+        record = ProfileRecord(
+            method=scope["method"], path=scope["path"], query=scope.get("query_string", b"").decode("latin-1"),
+            trigger=trigger, started_at=datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        )
+        record_id = profiles.append(record)
+        request_stats = metrics.current_request.get()
+        thread_profiles = []
+        token = _thread_profiles.set(thread_profiles)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                record.status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", str(record_id).encode())]
+            await send(message)
+
+        loop_profile = cProfile.Profile()
+        started = time.perf_counter()
+        loop_profile.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            loop_profile.disable()
+            record.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            _thread_profiles.reset(token)
+            _loop_profiler.release()
+            if request_stats is not None:
+                record.statements = request_stats.statements
+                record.db_ms = round(request_stats.db_seconds * 1000, 3)
+            stats = pstats.Stats(loop_profile)
+            for profile in thread_profiles:
+                stats.add(profile)
+            record.stats = stats
+            PROFILES.inc(trigger=trigger)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._pier2_slow_query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._pier2_slow_query_started
+    if settings.slow_query_ms <= 0 or elapsed * 1000 < settings.slow_query_ms:
+        return
+
+    plan = []
+    if not executemany:
+        # The plan comes from the same connection, so it sees the same schema and statistics
+        explain = conn.connection.cursor()
+        try:
+            explain.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plan = [row[-1] for row in explain.fetchall()]
+        except Exception as e:
+            plan = [f"EXPLAIN failed: {e}"]
+        finally:
+            explain.close()
+
+    stats = metrics.current_request.get()
+    values = list(parameters[0] if executemany and parameters else parameters or ())
+    query = SlowQuery(
+        logged_at=datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        route=stats.route if stats is not None else metrics.NO_ROUTE,
+        duration_ms=round(elapsed * 1000, 3),
+        statement=statement,
+        parameter_count=len(values),
+        parameter_types=[type(value).__name__ for value in values[:MAX_LOGGED_PARAMETERS]],
+        plan=plan,
+    )
+    slow_queries.append(query)
+    SLOW_QUERIES.inc(route=query.route)
+    logger.warning(
+        "Slow query (%.1f ms, route %s): %s | %d parameters %s | plan %s",
+        query.duration_ms, query.route, " ".join(statement.split()), query.parameter_count, query.parameter_types,
+        " / ".join(plan),
+    )
+
+
+def install_sql_hooks():
+    """Time every statement on every SQLAlchemy engine and log the slow ones. Idempotent."""
+    if not event.contains(Engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,460 @@
+"""
+Incrementally maintained analytics rollups.
+
+Each rollup is a small summary table kept in sync with the fact tables by
+SQLite triggers, so it stays correct for every write path (ORM, bulk inserts,
+raw SQL) inside the writing transaction. Backfill statements recompute a
+rollup from scratch for existing databases.
+
+Rebuild every rollup from the fact tables with:
+
+    python -m app.rollups [rollup_name ...]
+"""
+
+import re
+import sys
+from contextlib import contextmanager
+
+from sqlalchemy.engine import Connection, Engine
+
+# Day and hour buckets of an order timestamp, as stored by SQLAlchemy's DateTime
+_DAY = "date({row}.timestamp)"
+_HOUR = "CAST(strftime('%H', {row}.timestamp) AS INTEGER)"
+
+
+def _hourly_increment(row):
+    return f"""
+        INSERT INTO instore_hourly_counts (day, hour, order_count)
+        VALUES ({_DAY.format(row=row)}, {_HOUR.format(row=row)}, 1)
+        ON CONFLICT (day, hour) DO UPDATE SET order_count = order_count + 1;"""
+
+
+def _hourly_decrement(row):
+    return f"""
+        UPDATE instore_hourly_counts SET order_count = order_count - 1
+        WHERE day = {_DAY.format(row=row)} AND hour = {_HOUR.format(row=row)};
+        DELETE FROM instore_hourly_counts
+        WHERE day = {_DAY.format(row=row)} AND hour = {_HOUR.format(row=row)} AND order_count <= 0;"""
+
+
+INSTORE_HOURLY_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS instore_hourly_counts_order_insert
+    AFTER INSERT ON orders WHEN NEW.in_store AND NEW.timestamp IS NOT NULL
+    BEGIN {_hourly_increment("NEW")}
+    END""",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS instore_hourly_counts_order_delete
+    AFTER DELETE ON orders WHEN OLD.in_store AND OLD.timestamp IS NOT NULL
+    BEGIN {_hourly_decrement("OLD")}
+    END""",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS instore_hourly_counts_order_update_old
+    AFTER UPDATE OF timestamp, in_store ON orders WHEN OLD.in_store AND OLD.timestamp IS NOT NULL
+    BEGIN {_hourly_decrement("OLD")}
+    END""",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS instore_hourly_counts_order_update_new
+    AFTER UPDATE OF timestamp, in_store ON orders WHEN NEW.in_store AND NEW.timestamp IS NOT NULL
+    BEGIN {_hourly_increment("NEW")}
+    END""",
+]
+
+INSTORE_HOURLY_BACKFILL = f"""
+    INSERT INTO instore_hourly_counts (day, hour, order_count)
+    SELECT {_DAY.format(row="orders")}, {_HOUR.format(row="orders")}, COUNT(*)
+    FROM orders
+    WHERE in_store AND timestamp IS NOT NULL
+    GROUP BY 1, 2
+"""
+
+
+def _customer_increment(row):
+    return f"""
+        INSERT INTO instore_customer_daily_counts (customer_id, day, order_count)
+        VALUES ({row}.customer_id, {_DAY.format(row=row)}, 1)
+        ON CONFLICT (customer_id, day) DO UPDATE SET order_count = order_count + 1;
+        INSERT INTO instore_customer_counts (customer_id, order_count)
+        VALUES ({row}.customer_id, 1)
+        ON CONFLICT (customer_id) DO UPDATE SET order_count = order_count + 1;"""
+
+
+def _customer_decrement(row):
+    return f"""
+        UPDATE instore_customer_daily_counts SET order_count = order_count - 1
+        WHERE customer_id = {row}.customer_id AND day = {_DAY.format(row=row)};
+        DELETE FROM instore_customer_daily_counts
+        WHERE customer_id = {row}.customer_id AND day = {_DAY.format(row=row)} AND order_count <= 0;
+        UPDATE instore_customer_counts SET order_count = order_count - 1 WHERE customer_id = {row}.customer_id;
+        DELETE FROM instore_customer_counts WHERE customer_id = {row}.customer_id AND order_count <= 0;"""
+
+
+# Only in-store orders with a customer and a timestamp are counted
+_COUNTED = "{row}.in_store AND {row}.timestamp IS NOT NULL AND {row}.customer_id IS NOT NULL"
+
+INSTORE_CUSTOMER_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS instore_customer_counts_order_insert
+    AFTER INSERT ON orders WHEN {_COUNTED.format(row="NEW")}
+    BEGIN {_customer_increment("NEW")}
+    END""",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS instore_customer_counts_order_delete
+    AFTER DELETE ON orders WHEN {_COUNTED.format(row="OLD")}
+    BEGIN {_customer_decrement("OLD")}
+    END""",
+    # Customer merges re-point orders, so customer_id changes are tracked too
+    f"""
+    CREATE TRIGGER IF NOT EXISTS instore_customer_counts_order_update_old
+    AFTER UPDATE OF timestamp, in_store, customer_id ON orders WHEN {_COUNTED.format(row="OLD")}
+    BEGIN {_customer_decrement("OLD")}
+    END""",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS instore_customer_counts_order_update_new
+    AFTER UPDATE OF timestamp, in_store, customer_id ON orders WHEN {_COUNTED.format(row="NEW")}
+    BEGIN {_customer_increment("NEW")}
+    END""",
+]
+
+INSTORE_CUSTOMER_DAILY_BACKFILL = f"""
+    INSERT INTO instore_customer_daily_counts (customer_id, day, order_count)
+    SELECT customer_id, {_DAY.format(row="orders")}, COUNT(*)
+    FROM orders
+    WHERE {_COUNTED.format(row="orders")}
+    GROUP BY 1, 2
+"""
+
+# Summed from the daily counts, which already include the archived orders
+INSTORE_CUSTOMER_BACKFILL = """
+    INSERT INTO instore_customer_counts (customer_id, order_count)
+    SELECT customer_id, SUM(order_count)
+    FROM instore_customer_daily_counts
+    GROUP BY 1
+"""
+
+
+def _zip_triggers(rollup, fact_table, address_column):
+    """
+    Triggers keeping `rollup` (zip_code -> order_count) in step with the rows
+    of `fact_table` referencing an address through `address_column`.
+
+    Rows without an address or zip code are not counted.
+    """
+    def add(address_id):
+        return f"""
+        INSERT INTO {rollup} (zip_code, order_count)
+        SELECT zip_code, 1 FROM addresses WHERE id = {address_id} AND zip_code IS NOT NULL
+        ON CONFLICT (zip_code) DO UPDATE SET order_count = order_count + 1;"""
+
+    def remove(address_id):
+        return f"""
+        UPDATE {rollup} SET order_count = order_count - 1
+        WHERE zip_code = (SELECT zip_code FROM addresses WHERE id = {address_id});
+        DELETE FROM {rollup} WHERE order_count <= 0;"""
+
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {rollup}_{fact_table}_insert
+        AFTER INSERT ON {fact_table}
+        BEGIN {add(f"NEW.{address_column}")}
+        END""",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {rollup}_{fact_table}_delete
+        AFTER DELETE ON {fact_table}
+        BEGIN {remove(f"OLD.{address_column}")}
+        END""",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {rollup}_{fact_table}_update
+        AFTER UPDATE OF {address_column} ON {fact_table}
+        WHEN OLD.{address_column} IS NOT NEW.{address_column}
+        BEGIN {remove(f"OLD.{address_column}")} {add(f"NEW.{address_column}")}
+        END""",
+        # Re-zoning an address moves every row that references it
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {rollup}_addresses_update
+        AFTER UPDATE OF zip_code ON addresses
+        WHEN OLD.zip_code IS NOT NEW.zip_code
+        BEGIN
+            UPDATE {rollup} SET order_count = order_count - (
+                SELECT COUNT(*) FROM {fact_table} WHERE {address_column} = NEW.id
+            ) WHERE zip_code = OLD.zip_code;
+            DELETE FROM {rollup} WHERE order_count <= 0;
+            INSERT INTO {rollup} (zip_code, order_count)
+            SELECT NEW.zip_code, COUNT(*) FROM {fact_table}
+            WHERE {address_column} = NEW.id AND NEW.zip_code IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT (zip_code) DO UPDATE SET order_count = order_count + excluded.order_count;
+        END""",
+    ]
+
+
+def _zip_backfill(rollup, fact_table, address_column):
+    return f"""
+    INSERT INTO {rollup} (zip_code, order_count)
+    SELECT addresses.zip_code, COUNT(*)
+    FROM {fact_table} JOIN addresses ON addresses.id = {fact_table}.{address_column}
+    WHERE addresses.zip_code IS NOT NULL
+    GROUP BY addresses.zip_code
+"""
+
+
+# Location hierarchy of the geo rollups, coarsest first, then their other key columns
+GEO_LEVELS = ("country", "state", "city", "zip_code")
+_GEO_KEYS = ("level", *GEO_LEVELS, "in_store", "period")
+# Levels with rows of their own: there are few cities, so the coarser levels are summed from the city rows
+GEO_STORED_LEVELS = ("city", "zip_code")
+# One row per stored level for each counted row: the levels' names and depths
+_GEO_DEPTHS = " UNION ALL ".join(
+    f"SELECT '{level}' AS name, {GEO_LEVELS.index(level) + 1} AS depth" for level in GEO_STORED_LEVELS
+)
+# And one per period: its month ("YYYY-MM"), its year ("YYYY") and all time ("")
+_GEO_PERIODS = "SELECT 7 AS width UNION ALL SELECT 4 UNION ALL SELECT 0"
+
+
+def periods(first_year: int, last_year: int, start: str = None, end: str = None) -> list:
+    """
+    The fewest periods covering a range of months: whole years, then single months.
+
+    Args:
+        first_year (int): First year with data.
+        last_year (int): Last year with data.
+        start (str): Optional first month, "YYYY-MM".
+        end (str): Optional last month (inclusive), "YYYY-MM".
+
+    Returns:
+        list[str]: "YYYY" and "YYYY-MM" periods.
+    """
+    chosen = []
+    for year in map(str, range(first_year, last_year + 1)):
+        first, last = max(start or "", f"{year}-01"), min(end or "9999", f"{year}-12")
+        if first > last:
+            continue
+        if first == f"{year}-01" and last == f"{year}-12":
+            chosen.append(year)
+        else:
+            chosen += [f"{year}-{month:02d}" for month in range(int(first[5:]), int(last[5:]) + 1)]
+    return chosen
+
+
+def _geo_count(rollup, sign, address, order, source, where, single=False):
+    """
+    Upsert adding `sign` times the matching rows to the geo rollup, per
+    stored level of the location hierarchy, location, channel and period.
+
+    Each row is counted once per stored level, at its location truncated to
+    that level (deeper parts ""), and once per period (its month, its year
+    and all time), so a range is read without summing every month. `address` and `order` name the rows (or trigger rows) the
+    location and the in_store flag and timestamp are read from. Missing
+    location parts are counted as "", orders without a timestamp not at all.
+    A `single` row source is upserted without grouping, saving a sort per
+    trigger run.
+    """
+    location = ", ".join(
+        f"CASE WHEN levels.depth >= {depth} THEN COALESCE({address}.{level}, '') ELSE '' END"
+        for depth, level in enumerate(GEO_LEVELS, 1)
+    )
+    keys = ", ".join(_GEO_KEYS)
+    count, group = (f"{sign}1", "") if single else (f"{sign}COUNT(*)", "GROUP BY 1, 2, 3, 4, 5, 6, 7")
+    return f"""
+        INSERT INTO {rollup} ({keys}, order_count)
+        SELECT levels.name, {location}, COALESCE({order}.in_store, 0),
+               substr(strftime('%Y-%m', {order}.timestamp), 1, periods.width), {count}
+        FROM {source}, ({_GEO_DEPTHS}) AS levels, ({_GEO_PERIODS}) AS periods
+        WHERE {where} AND {order}.timestamp IS NOT NULL
+        {group}
+        ON CONFLICT ({keys}) DO UPDATE SET order_count = order_count + excluded.order_count;"""
+
+
+def _geo_triggers(rollup, fact_table, address_column):
+    """
+    Triggers keeping the geo rollup `rollup` in step with the rows of
+    `fact_table` (orders or order_items) referencing an address through
+    `address_column`, their order's channel and month, and the addresses.
+
+    Rows without an address are not counted.
+    """
+    # Emptied counts are found through the rollup's partial index
+    prune = f"DELETE FROM {rollup} WHERE order_count <= 0;"
+    if fact_table == "orders":
+        def count(sign, row):
+            return _geo_count(
+                rollup, sign, "addresses", row, "addresses", f"addresses.id = {row}.{address_column}", single=True
+            )
+
+        moved_orders = []
+        rows_of_address = ("orders", "orders", f"orders.{address_column} = NEW.id")
+        changed = f"{address_column}, timestamp, in_store"
+    else:
+        def count(sign, row):
+            return _geo_count(
+                rollup, sign, "addresses", "orders", "addresses, orders",
+                f"addresses.id = {row}.{address_column} AND orders.id = {row}.order_id", single=True,
+            )
+
+        def items_of_order(sign, row):
+            return _geo_count(
+                rollup, sign, "addresses", row, f"{fact_table} JOIN addresses ON addresses.id = {fact_table}.{address_column}",
+                f"{fact_table}.order_id = {row}.id",
+            )
+
+        # An order's new date or channel moves its items; a deleted order takes along those left
+        moved_orders = [
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {rollup}_orders_update
+            AFTER UPDATE OF timestamp, in_store ON orders
+            BEGIN {items_of_order("-", "OLD")} {items_of_order("", "NEW")} {prune}
+            END""",
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {rollup}_orders_delete
+            AFTER DELETE ON orders
+            BEGIN {items_of_order("-", "OLD")} {prune}
+            END""",
+        ]
+        rows_of_address = (
+            "orders", f"{fact_table} JOIN orders ON orders.id = {fact_table}.order_id",
+            f"{fact_table}.{address_column} = NEW.id",
+        )
+        changed = f"{address_column}, order_id"
+
+    location = ", ".join(GEO_LEVELS)
+    order, source, where = rows_of_address
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {rollup}_{fact_table}_insert
+        AFTER INSERT ON {fact_table}
+        BEGIN {count("", "NEW")}
+        END""",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {rollup}_{fact_table}_delete
+        AFTER DELETE ON {fact_table}
+        BEGIN {count("-", "OLD")} {prune}
+        END""",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {rollup}_{fact_table}_update
+        AFTER UPDATE OF {changed} ON {fact_table}
+        BEGIN {count("-", "OLD")} {count("", "NEW")} {prune}
+        END""",
+        *moved_orders,
+        # Relocating an address moves every row that references it
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {rollup}_addresses_update
+        AFTER UPDATE OF {location} ON addresses
+        BEGIN
+            {_geo_count(rollup, "-", "OLD", order, source, where)}
+            {_geo_count(rollup, "", "NEW", order, source, where)}
+            {prune}
+        END""",
+    ]
+
+
+def _geo_backfill(rollup, fact_table, address_column):
+    source = "orders" if fact_table == "orders" else f"{fact_table} JOIN orders ON orders.id = {fact_table}.order_id"
+    return _geo_count(
+        rollup, "", "addresses", "orders", f"{source} JOIN addresses ON addresses.id = {fact_table}.{address_column}",
+        "true",
+    )
+
+
+# Rollup table -> (triggers maintaining it, statement recomputing it from scratch)
+ROLLUPS = {
+    "instore_hourly_counts": (INSTORE_HOURLY_TRIGGERS, INSTORE_HOURLY_BACKFILL),
+    # Both per-customer tables are maintained by the same triggers
+    "instore_customer_daily_counts": (INSTORE_CUSTOMER_TRIGGERS, INSTORE_CUSTOMER_DAILY_BACKFILL),
+    "instore_customer_counts": ([], INSTORE_CUSTOMER_BACKFILL),
+    "billing_zip_counts": (
+        _zip_triggers("billing_zip_counts", "orders", "billing_address_id"),
+        _zip_backfill("billing_zip_counts", "orders", "billing_address_id"),
+    ),
+    "shipping_zip_counts": (
+        _zip_triggers("shipping_zip_counts", "order_items", "shipping_address_id"),
+        _zip_backfill("shipping_zip_counts", "order_items", "shipping_address_id"),
+    ),
+    "billing_geo_counts": (
+        _geo_triggers("billing_geo_counts", "orders", "billing_address_id"),
+        _geo_backfill("billing_geo_counts", "orders", "billing_address_id"),
+    ),
+    "shipping_geo_counts": (
+        _geo_triggers("shipping_geo_counts", "order_items", "shipping_address_id"),
+        _geo_backfill("shipping_geo_counts", "order_items", "shipping_address_id"),
+    ),
+}
+
+
+# Rollups computed from another rollup rather than from the fact tables; rebuilt after it (ROLLUPS order)
+DERIVED = {"instore_customer_counts"}
+
+_TRIGGER_NAME = re.compile(r"CREATE TRIGGER IF NOT EXISTS (\w+)")
+
+
+def rebuild(conn: Connection, names=None):
+    """
+    Recompute rollups from the fact tables.
+
+    Orders moved to archive files (see app/partitions.py) are added back
+    from the rollup rows stored with them.
+
+    Args:
+        conn (Connection): Connection; the caller owns the transaction.
+        names (list[str]): Rollup tables to rebuild; all of them by default.
+    """
+    from app import partitions
+
+    for name in names or ROLLUPS:
+        _, backfill = ROLLUPS[name]
+        conn.exec_driver_sql(f"DELETE FROM {name}")
+        conn.exec_driver_sql(backfill)
+        if name not in DERIVED:
+            partitions.add_archived_rollups(conn, name)
+
+
+@contextmanager
+def paused(conn: Connection):
+    """
+    Drop every rollup trigger for the block and recreate them after it.
+
+    For writes that must leave the rollups as they are, such as moving rows
+    to an archive. DDL is transactional in SQLite, so other connections never
+    see the triggers missing.
+
+    Args:
+        conn (Connection): Connection; the caller owns the transaction.
+    """
+    triggers = [trigger for triggers, _ in ROLLUPS.values() for trigger in triggers]
+    for trigger in triggers:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {_TRIGGER_NAME.search(trigger).group(1)}")
+    yield
+    for trigger in triggers:
+        conn.exec_driver_sql(trigger)
+
+
+def install(conn: Connection, name: str):
+    """
+    Create the triggers maintaining a rollup and backfill it.
+
+    Args:
+        conn (Connection): Connection inside the migration transaction.
+        name (str): Rollup table name.
+    """
+    triggers, _ = ROLLUPS[name]
+    for trigger in triggers:
+        conn.exec_driver_sql(trigger)
+    rebuild(conn, [name])
+
+
+def main(engine: Engine, names=None):
+    """Rebuild rollups in a single transaction."""
+    unknown = set(names or []) - set(ROLLUPS)
+    if unknown:
+        print(f"Unknown rollup(s): {', '.join(sorted(unknown))}. Choose from: {', '.join(ROLLUPS)}")
+        return 1
+    with engine.begin() as conn:
+        rebuild(conn, names)
+    print(f"Rebuilt {', '.join(names or ROLLUPS)}.")
+    return 0
+
+
+if __name__ == "__main__":
+    from app import database, migrations
+
+    migrations.upgrade(database.engine)
+    sys.exit(main(database.engine, sys.argv[1:]))
@@ -3,10 +3,12 @@ Pydantic schemas for request/response models.
 Defines validation and serialization logic for API.
 """
 
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, model_validator
+from typing import List, Optional
 from datetime import datetime
 
+from app.identifiers import normalize_email, normalize_phone
+
 class Address(BaseModel):
     """
     Pydantic model for Address used in billing, shipping, or customer profile.
@@ -42,4 +44,37 @@ class Customer(BaseModel):
     last_name: str
     email: str
     phone: str
-    addresses: List[Address]
\ No newline at end of file
+    addresses: List[Address]
+
+
+class CustomerIdentity(BaseModel):
+    """
+    Identifies the customer placing an order; customers are deduplicated by
+    normalized email or phone (see app/identifiers.py).
+    """
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    email: Optional[str] = None
+    phone: Optional[str] = None
+
+    @model_validator(mode="after")
+    def require_email_or_phone(self):
+        if not normalize_email(self.email) and not normalize_phone(self.phone):
+            raise ValueError("customer needs an email or a phone")
+        return self
+
+
+class BulkOrder(Order):
+    """
+    One record of a bulk order upload: an order plus the identity of its customer.
+    """
+    customer: CustomerIdentity
+
+
+class OrderHistoryBatch(BaseModel):
+    """
+    Request body for looking up the order histories of many customers at once.
+    """
+    identifiers: List[str]  # customer emails and/or phone numbers, in any mix
+    start_date: Optional[str] = None  # MM-DD-YYYY
+    end_date: Optional[str] = None  # MM-DD-YYYY, inclusive
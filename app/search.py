@@ -0,0 +1,154 @@
+"""
+Full-text customer search.
+
+`customer_search` is an FTS5 index over the customers' first name, last
+name and email, using the trigram tokenizer so any fragment of three or more
+characters matches inside a value ("mith" finds "Smith", "ana12" finds
+"diana1200003@example.com"), prefixes included. It is an external-content
+table: it stores only the index, reads the values from `customers`, and is
+kept in sync by the triggers below, so writes made through any path
+(ORM, bulk ingestion, identifier merges) are searchable once committed.
+Matches are ranked with FTS5's bm25: rows where the query's trigrams are
+more frequent and the values shorter come first.
+
+Queries made of phone characters only are matched against the normalized
+`phone_key` instead, as an indexed prefix range: "415-555" or "(415) 555"
+finds every "+1415555..." customer.
+
+Rebuild the index (e.g. after writing customers with the triggers dropped)
+with:
+
+    python -m app.search
+"""
+
+import re
+import sys
+
+from sqlalchemy.engine import Connection, Engine
+
+from app import identifiers
+
+# Indexed columns of `customers`, in FTS column order
+COLUMNS = ("first_name", "last_name", "email")
+# The trigram tokenizer cannot match anything shorter
+MIN_TERM_LENGTH = 3
+# Matches ranked per query: bm25 over the first (lowest id) ones when a query matches more
+MAX_CANDIDATES = 10_000
+
+_PHONE_QUERY = re.compile(r"^[\d\s().+-]+$")
+_MIN_PHONE_DIGITS = 3
+
+_columns = ", ".join(COLUMNS)
+_new = ", ".join(f"new.{column}" for column in COLUMNS)
+_old = ", ".join(f"old.{column}" for column in COLUMNS)
+TRIGGERS = (
+    f"""CREATE TRIGGER IF NOT EXISTS customer_search_insert AFTER INSERT ON customers BEGIN
+        INSERT INTO customer_search (rowid, {_columns}) VALUES (new.id, {_new});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS customer_search_delete AFTER DELETE ON customers BEGIN
+        INSERT INTO customer_search (customer_search, rowid, {_columns}) VALUES ('delete', old.id, {_old});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS customer_search_update AFTER UPDATE OF {_columns} ON customers BEGIN
+        INSERT INTO customer_search (customer_search, rowid, {_columns}) VALUES ('delete', old.id, {_old});
+        INSERT INTO customer_search (rowid, {_columns}) VALUES (new.id, {_new});
+    END""",
+)
+
+
+def install(conn: Connection):
+    """
+    Create the search index and its triggers, and index the existing customers.
+
+    Args:
+        conn (Connection): Connection inside the migration transaction.
+    """
+    conn.exec_driver_sql(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS customer_search USING fts5(
+            {_columns}, content='customers', content_rowid='id', tokenize='trigram'
+        )""")
+    for trigger in TRIGGERS:
+        conn.exec_driver_sql(trigger)
+    rebuild(conn)
+
+
+def rebuild(conn: Connection):
+    """Re-index every customer from the `customers` table."""
+    conn.exec_driver_sql("INSERT INTO customer_search (customer_search) VALUES ('rebuild')")
+
+
+def phone_prefix(query: str):
+    """
+    The `phone_key` range for a query made of phone characters only.
+
+    Returns:
+        tuple[str, str]: Inclusive lower and exclusive upper bound, or None
+        when the query is not a phone number fragment.
+    """
+    if not _PHONE_QUERY.match(query):
+        return None
+    digits = re.sub(r"\D", "", query)
+    if len(digits) < _MIN_PHONE_DIGITS:
+        return None
+    # National numbers are keyed with the default country code (see app/identifiers.py)
+    prefix = "+" + (digits if query.lstrip().startswith("+") else identifiers.DEFAULT_COUNTRY_CODE + digits)
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def terms(query: str) -> list:
+    """
+    Split a query into search terms.
+
+    Raises:
+        ValueError: If no term is long enough to be matched.
+    """
+    found = query.split()
+    if not any(len(term) >= MIN_TERM_LENGTH for term in found):
+        raise ValueError(f"Search for at least {MIN_TERM_LENGTH} consecutive characters")
+    return found
+
+
+def _phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def match_expression(query_terms, fuzzy: bool = False) -> str:
+    """
+    FTS5 MATCH expression requiring every term (of three or more characters).
+
+    With `fuzzy`, a term of five or more characters also matches through any
+    of its one-character deletions and adjacent swaps, which tolerates one
+    extra, swapped or (at either end) wrong letter: "jonahtan" matches
+    "Jonathan", "smiht" matches "Smith" through "smit". Variants of shorter
+    terms would match almost every customer.
+    """
+    clauses = []
+    for term in query_terms:
+        if len(term) < MIN_TERM_LENGTH:
+            continue
+        variants = [term]
+        if fuzzy and len(term) > MIN_TERM_LENGTH + 1:
+            variants += [term[:i] + term[i + 1:] for i in range(len(term))]
+            variants += [term[:i] + term[i + 1] + term[i] + term[i + 2:] for i in range(len(term) - 1)]
+        clauses.append("(" + " OR ".join(_phrase(variant) for variant in dict.fromkeys(variants)) + ")")
+    return " AND ".join(clauses)
+
+
+def short_terms(query_terms) -> list:
+    """Terms too short for the index, matched as substrings of the customers' values instead."""
+    return [term.lower() for term in query_terms if len(term) < MIN_TERM_LENGTH]
+
+
+def main(engine: Engine):
+    """Re-index every customer in one transaction."""
+    with engine.begin() as conn:
+        rebuild(conn)
+        count = conn.exec_driver_sql("SELECT COUNT(*) FROM customers").scalar()
+    print(f"Indexed {count} customers.")
+    return 0
+
+
+if __name__ == "__main__":
+    from app import database, migrations
+
+    migrations.upgrade(database.engine)
+    sys.exit(main(database.engine))
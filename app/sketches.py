@@ -0,0 +1,608 @@
+"""
+Approximate analytics from mergeable sketches.
+
+The best-selling items (overall and per shipping zip code) and the number of
+distinct customers per billing zip code have no small exact rollup: exact
+answers scan every order item, or every (zip code, customer) pair, of the
+requested months. They are answered from sketches instead, stored in the
+`sketches` table per calendar month and per calendar year:
+
+- Item sales go into a Count-Min sketch of `CMS_DEPTH` rows of `CMS_WIDTH`
+  counters. An item's estimate never undercounts, and overcounts by at most
+  e / CMS_WIDTH (0.13%) of the items sold with probability 1 - e^-CMS_DEPTH
+  (98%).
+- Misra-Gries heavy hitters with `HEAVY_HITTERS` counters, overall and per
+  shipping zip code, keep the candidates for the top items. Every item
+  selling more than 1/(HEAVY_HITTERS + 1) of the items is kept, and a kept
+  count undercounts by at most the sketch's recorded error (never more than
+  that same fraction). Overall counts are read from the Count-Min sketch;
+  one Count-Min sketch per zip code would cost too much space, and a shared
+  one would swamp small zip codes with the error of all the others.
+- Distinct customers per billing zip code go into a HyperLogLog of
+  2^HLL_PRECISION registers: a standard error of 1.04 / sqrt(4096) (1.6%).
+
+Every sketch merges with the same sketch of other buckets (counters add,
+registers take their maximum), so a range of months is answered by merging
+whole years and the remaining months. Buckets are calendar months and years
+of the order timestamps in UTC.
+
+Inserted orders are queued in `sketch_pending` by a trigger, whatever the
+write path, and `fold` adds them to their buckets. Re-encoding the stored
+sketches costs milliseconds, so ingestion folds in its writing transaction
+only once `FOLD_BATCH` orders are queued; meanwhile every read sketches the
+queued orders and merges them in, so answers are as current as the orders.
+Archived orders stay counted (see app/partitions.py). Sketches only grow: deleted orders, items
+added to an existing order and customer merges are not reflected until the
+sketches are rebuilt from the fact tables with:
+
+    python -m app.sketches
+"""
+
+import functools
+import hashlib
+import itertools
+import json
+import math
+import sys
+import zlib
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy.engine import Connection, Engine
+
+from app import rollups
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without NumPy
+    np = None
+
+# Count-Min sketch shape: overcount <= e / CMS_WIDTH of the total, with probability 1 - e^-CMS_DEPTH
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+# Misra-Gries counters per bucket and zip code; also the most top items one query can return
+HEAVY_HITTERS = 64
+# HyperLogLog registers: 2^HLL_PRECISION, one byte each
+HLL_PRECISION = 12
+# Ranges with at most this many items sold (or orders) are answered exactly from the fact tables
+EXACT_MAX_ROWS = 10_000
+# Queued orders ingestion folds at once; reads merge in the fewer still queued
+FOLD_BATCH = 250
+
+# Sketch names in the `sketches` table
+ITEMS = "items"
+CUSTOMERS = "customers"
+# Zip code of the sketches over every zip code
+ALL_ZIPS = ""
+
+_MONTH = "strftime('%Y-%m', orders.timestamp)"
+PENDING_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS sketch_pending_order_insert AFTER INSERT ON orders
+    BEGIN
+        INSERT OR IGNORE INTO sketch_pending (order_id) VALUES (NEW.id);
+    END"""
+
+# Formatted with the schema of a partition and the orders to read: pending ones, or all of them
+_ITEM_COUNTS = f"""
+    SELECT {_MONTH}, COALESCE(addresses.zip_code, ''), order_items.item_name, COUNT(*)
+    FROM {{orders}}
+    JOIN {{schema}}.order_items ON order_items.order_id = orders.id
+    LEFT JOIN {{schema}}.addresses ON addresses.id = order_items.shipping_address_id
+    WHERE orders.timestamp IS NOT NULL AND order_items.item_name IS NOT NULL
+    GROUP BY 1, 2, 3"""
+_CUSTOMER_ORDERS = f"""
+    SELECT {_MONTH}, addresses.zip_code, orders.customer_id, COUNT(*)
+    FROM {{orders}}
+    JOIN {{schema}}.addresses ON addresses.id = orders.billing_address_id
+    WHERE orders.timestamp IS NOT NULL AND orders.customer_id IS NOT NULL AND addresses.zip_code IS NOT NULL
+    GROUP BY 1, 2, 3"""
+_HLL_GROUPS = 1024
+# Looked up by primary key: a join would scan (or Bloom-filter) every order for the short queue
+_PENDING_ORDERS = "(SELECT * FROM main.orders WHERE id IN (SELECT order_id FROM sketch_pending)) AS orders"
+_ALL_ORDERS = "{schema}.orders"
+
+
+def _pack(header: dict, array: "np.ndarray" = None) -> bytes:
+    """Serialize a JSON header and an optional array (JSON never contains a raw NUL byte)."""
+    data = json.dumps(header, separators=(",", ":")).encode() + b"\0"
+    if array is not None:
+        data += array.tobytes()
+    return zlib.compress(data, 1)
+
+
+def _unpack(blob: bytes):
+    data = zlib.decompress(blob)
+    split = data.index(b"\0")
+    return json.loads(data[:split]), data[split + 1:]
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch of string keys.
+
+    Each key adds its count to one counter per row; its estimate is the
+    smallest of those counters, an overcount only by colliding keys.
+    """
+
+    def __init__(self, counters: "np.ndarray" = None):
+        self.counters = np.zeros((CMS_DEPTH, CMS_WIDTH), np.int64) if counters is None else counters
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _columns(key: str) -> "np.ndarray":
+        # Row i uses h1 + i * h2 (Kirsch-Mitzenmacher), from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return np.array([(h1 + row * h2) % CMS_WIDTH for row in range(CMS_DEPTH)])
+
+    def add(self, key: str, count: int = 1):
+        self.counters[np.arange(CMS_DEPTH), self._columns(key)] += count
+
+    def estimate(self, key: str) -> int:
+        return int(self.counters[np.arange(CMS_DEPTH), self._columns(key)].min())
+
+    @property
+    def total(self) -> int:
+        return int(self.counters[0].sum())
+
+    def error_bound(self) -> int:
+        """Largest overcount of an estimate, with probability 1 - e^-CMS_DEPTH."""
+        return math.ceil(math.e / CMS_WIDTH * self.total)
+
+    def merge(self, other: "CountMinSketch"):
+        self.counters += other.counters
+
+
+class HeavyHitters:
+    """
+    Misra-Gries summary of the most frequent keys, with at most HEAVY_HITTERS counters.
+
+    When a new key finds every counter taken, the smallest count is
+    subtracted from all of them and the emptied ones are dropped. Counts
+    therefore undercount by at most `error`, the total subtracted so far.
+    """
+
+    def __init__(self, counts: dict = None, error: int = 0):
+        self.counts = counts or {}
+        self.error = error
+
+    def _prune(self):
+        if len(self.counts) <= HEAVY_HITTERS:
+            return
+        cut = sorted(self.counts.values(), reverse=True)[HEAVY_HITTERS]
+        self.counts = {key: count - cut for key, count in self.counts.items() if count > cut}
+        self.error += cut
+
+    def add(self, key: str, count: int = 1):
+        self.counts[key] = self.counts.get(key, 0) + count
+        self._prune()
+
+    def merge(self, other: "HeavyHitters"):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.error += other.error
+        self._prune()
+
+    def top(self, k: int) -> list:
+        """(key, count) pairs of the `k` largest counts, ties to the smaller key."""
+        return sorted(self.counts.items(), key=lambda pair: (-pair[1], pair[0]))[:k]
+
+
+def _mix(values: "np.ndarray") -> "np.ndarray":
+    """splitmix64 finalizer: integer ids to well-spread 64-bit hashes."""
+    with np.errstate(over="ignore"):
+        z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _bit_length(values: "np.ndarray") -> "np.ndarray":
+    """Vectorized int.bit_length of uint64 values."""
+    length = np.zeros(len(values), np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >> np.uint64(shift)
+        found = high > 0
+        values = np.where(found, high, values)
+        length += found * shift
+    return length + (values > 0)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter of integer ids.
+
+    Each id's hash picks a register by its top HLL_PRECISION bits; the
+    register keeps the longest run of leading zeros (plus one) seen in the
+    remaining bits.
+    """
+
+    REGISTERS = 2 ** HLL_PRECISION
+    STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+    def __init__(self, registers: "np.ndarray" = None):
+        self.registers = np.zeros(self.REGISTERS, np.uint8) if registers is None else registers
+
+    @staticmethod
+    def positions(ids):
+        """The register index and rank of each id."""
+        hashes = _mix(np.asarray(ids, np.int64))
+        rest_bits = 64 - HLL_PRECISION
+        indexes = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        ranks = rest_bits + 1 - _bit_length(hashes & np.uint64(2 ** rest_bits - 1))
+        return indexes, ranks.astype(np.uint8)
+
+    def add(self, ids):
+        np.maximum.at(self.registers, *self.positions(ids))
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = self.REGISTERS
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum()
+        empty = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and empty:
+            # Small cardinalities: linear counting over the empty registers is more accurate
+            return round(m * math.log(m / empty))
+        return round(raw)
+
+
+def _dump(name: str, zip_code: str, sketch) -> bytes:
+    if name == CUSTOMERS:
+        return zlib.compress(sketch.registers.tobytes(), 1)
+    heavy, cms = sketch
+    return _pack({"counts": heavy.counts, "error": heavy.error}, cms.counters if zip_code == ALL_ZIPS else None)
+
+
+def load(name: str, zip_code: str, blob: bytes):
+    """
+    Deserialize a stored sketch.
+
+    Returns:
+        HyperLogLog for CUSTOMERS; for ITEMS a (HeavyHitters, CountMinSketch)
+        pair, the latter None except for ALL_ZIPS.
+    """
+    if name == CUSTOMERS:
+        return HyperLogLog(np.frombuffer(zlib.decompress(blob), np.uint8).copy())
+    header, data = _unpack(blob)
+    cms = CountMinSketch(np.frombuffer(data, np.int64).reshape(CMS_DEPTH, CMS_WIDTH).copy()) if data else None
+    return HeavyHitters(header["counts"], header["error"]), cms
+
+
+def _empty(name: str, zip_code: str):
+    if name == CUSTOMERS:
+        return HyperLogLog()
+    return HeavyHitters(), CountMinSketch() if zip_code == ALL_ZIPS else None
+
+
+def _buckets(month: str):
+    """The month and year buckets a "YYYY-MM" month is counted in."""
+    return month, month[:4]
+
+
+def _merge(name: str, into, other):
+    """Merge a sketch into another of the same name and zip code."""
+    if name == CUSTOMERS:
+        into.merge(other)
+        return
+    into[0].merge(other[0])
+    if into[1] is not None:
+        into[1].merge(other[1])
+
+
+def _month_deltas(item_counts, customer_orders) -> dict:
+    """
+    Sketch the rows of the `_ITEM_COUNTS` and `_CUSTOMER_ORDERS` queries per month.
+
+    Rows are summed per (month, zip code, item) before they reach a sketch,
+    and every customer id is hashed in one vectorized pass.
+
+    Returns:
+        dict: (name, month, zip code) -> [rows counted, sketch].
+    """
+    deltas = {}
+    sold = defaultdict(dict)  # (month, zip code) -> item name -> items sold
+    for month, zip_code, item_name, count in item_counts:
+        # Items without a shipping zip code only count overall
+        for key in {(month, ALL_ZIPS), (month, zip_code)}:
+            sold[key][item_name] = sold[key].get(item_name, 0) + count
+    for (month, zip_code), counts in sold.items():
+        heavy, cms = _empty(ITEMS, zip_code)
+        heavy.merge(HeavyHitters(counts))
+        if cms is not None:
+            for item_name, count in counts.items():
+                cms.add(item_name, count)
+        deltas[(ITEMS, month, zip_code)] = [sum(counts.values()), (heavy, cms)]
+
+    groups, group_ids, customer_ids = {}, [], []
+    for month, zip_code, customer_id, count in customer_orders:
+        group = groups.setdefault((month, zip_code), len(groups))
+        group_ids.append(group)
+        customer_ids.append(customer_id)
+        deltas.setdefault((CUSTOMERS, month, zip_code), [0, None])[0] += count
+    indexes, ranks = HyperLogLog.positions(customer_ids)
+    group_ids = np.asarray(group_ids, np.int64)
+    keys = list(groups)
+    # A few MiB of registers at a time
+    for first in range(0, len(keys), _HLL_GROUPS):
+        rows = (group_ids >= first) & (group_ids < first + _HLL_GROUPS)
+        registers = np.zeros((min(_HLL_GROUPS, len(keys) - first), HyperLogLog.REGISTERS), np.uint8)
+        np.maximum.at(registers, (group_ids[rows] - first, indexes[rows]), ranks[rows])
+        for offset, (month, zip_code) in enumerate(keys[first:first + _HLL_GROUPS]):
+            deltas[(CUSTOMERS, month, zip_code)][1] = HyperLogLog(registers[offset])
+    return deltas
+
+
+def _apply(conn: Connection, item_counts, customer_orders):
+    """
+    Add rows of the `_ITEM_COUNTS` and `_CUSTOMER_ORDERS` queries to the stored sketches.
+
+    The rows are sketched per month, the year sketches merged from those,
+    and each affected (name, bucket, zip code) sketch is read once, merged
+    and written back.
+    """
+    updates = _month_deltas(item_counts, customer_orders)
+    for (name, month, zip_code), (count, sketch) in list(updates.items()):
+        year = updates.setdefault((name, _buckets(month)[1], zip_code), [0, _empty(name, zip_code)])
+        year[0] += count
+        _merge(name, year[1], sketch)
+    if not updates:
+        return
+
+    stored = {}
+    by_bucket = defaultdict(list)
+    for name, bucket, zip_code in updates:
+        by_bucket[(name, bucket)].append(zip_code)
+    for (name, bucket), zip_codes in by_bucket.items():
+        for start in range(0, len(zip_codes), 500):
+            chunk = zip_codes[start:start + 500]
+            rows = conn.exec_driver_sql(
+                f"SELECT zip_code, count, data FROM sketches WHERE name = ? AND bucket = ?"
+                f" AND zip_code IN ({', '.join('?' * len(chunk))})",
+                (name, bucket, *chunk),
+            )
+            for zip_code, count, data in rows:
+                stored[(name, bucket, zip_code)] = (count, data)
+
+    written = []
+    for (name, bucket, zip_code), (count, sketch) in updates.items():
+        previous_count, blob = stored.get((name, bucket, zip_code), (0, None))
+        if blob is not None:
+            previous = load(name, zip_code, blob)
+            _merge(name, previous, sketch)
+            sketch = previous
+        written.append((name, bucket, zip_code, previous_count + count, _dump(name, zip_code, sketch)))
+    conn.exec_driver_sql(
+        "INSERT INTO sketches (name, bucket, zip_code, count, data) VALUES (?, ?, ?, ?, ?)"
+        " ON CONFLICT (name, bucket, zip_code) DO UPDATE SET count = excluded.count, data = excluded.data",
+        written,
+    )
+
+
+def _pending_rows(conn: Connection, names=(ITEMS, CUSTOMERS)):
+    """The `_ITEM_COUNTS` and `_CUSTOMER_ORDERS` rows of the queued orders; none for names left out."""
+    return tuple(
+        conn.exec_driver_sql(query.format(orders=_PENDING_ORDERS, schema="main")).all() if name in names else ()
+        for name, query in ((ITEMS, _ITEM_COUNTS), (CUSTOMERS, _CUSTOMER_ORDERS))
+    )
+
+
+def fold(conn: Connection, minimum: int = 1) -> int:
+    """
+    Add the orders queued in `sketch_pending` to the sketches and empty the queue.
+
+    Args:
+        conn (Connection): Connection; the caller owns the transaction.
+        minimum (int): Leave the queue alone while it holds fewer orders.
+
+    Returns:
+        int: Number of orders folded.
+    """
+    if np is None:
+        # Orders stay queued; the sketch analytics answer exactly meanwhile
+        return 0
+    pending = conn.exec_driver_sql("SELECT COUNT(*) FROM sketch_pending").scalar()
+    if not pending or pending < minimum:
+        return 0
+    _apply(conn, *_pending_rows(conn))
+    conn.exec_driver_sql("DELETE FROM sketch_pending")
+    return pending
+
+
+def _pending(conn: Connection, name: str, start: str = None, end: str = None) -> dict:
+    """The queued orders' sketches of a range of months: (name, month, zip code) -> [rows, sketch]."""
+    deltas = _month_deltas(*_pending_rows(conn, (name,)))
+    return {key: delta for key, delta in deltas.items() if (start or "") <= key[1] <= (end or "9999")}
+
+
+def rebuild(conn: Connection):
+    """
+    Recompute every sketch from the orders of the hot partition and the archives.
+
+    Each partition is read in month order and applied one year at a time,
+    which bounds the sketches held in memory.
+
+    Args:
+        conn (Connection): Connection; the caller owns the transaction.
+
+    Raises:
+        RuntimeError: If NumPy is not installed.
+    """
+    from app import partitions
+
+    if np is None:
+        raise RuntimeError("Sketches need NumPy: pip install numpy")
+    conn.exec_driver_sql("DELETE FROM sketches")
+    conn.exec_driver_sql("DELETE FROM sketch_pending")
+    for schema, _ in partitions.partitions(conn):
+        schema = schema or "main"
+        orders = _ALL_ORDERS.format(schema=schema)
+        for query in (_ITEM_COUNTS, _CUSTOMER_ORDERS):
+            rows = conn.exec_driver_sql(query.format(orders=orders, schema=schema) + " ORDER BY 1")
+            for _, year_rows in itertools.groupby(rows, key=lambda row: row[0][:4]):
+                year_rows = list(year_rows)
+                _apply(conn, *((year_rows, ()) if query is _ITEM_COUNTS else ((), year_rows)))
+
+
+def install(conn: Connection):
+    """
+    Create the trigger queueing new orders and build the sketches.
+
+    Without NumPy the existing orders are queued instead, for `python -m
+    app.sketches` to build them later.
+
+    Args:
+        conn (Connection): Connection inside the migration transaction.
+    """
+    conn.exec_driver_sql(PENDING_TRIGGER)
+    if np is None:
+        conn.exec_driver_sql("INSERT OR IGNORE INTO sketch_pending (order_id) SELECT id FROM orders")
+        return
+    rebuild(conn)
+
+
+def buckets(conn: Connection, name: str, start: str = None, end: str = None) -> list:
+    """
+    The fewest buckets covering a range of months: whole years, then single months.
+
+    Args:
+        conn (Connection): Connection to read through.
+        name (str): Sketch name.
+        start (str): Optional first month, "YYYY-MM".
+        end (str): Optional last month (inclusive), "YYYY-MM".
+
+    Returns:
+        list[str]: Bucket names.
+    """
+    # Two primary key lookups: years sort before their months
+    first_bucket, last_bucket = conn.exec_driver_sql(
+        "SELECT (SELECT MIN(bucket) FROM sketches WHERE name = ?), (SELECT MAX(bucket) FROM sketches WHERE name = ?)",
+        (name, name),
+    ).one()
+    if first_bucket is None:
+        return []
+    return rollups.periods(int(first_bucket[:4]), int(last_bucket[:4]), start, end)
+
+
+def counted(conn: Connection, name: str, start: str = None, end: str = None) -> int:
+    """
+    Rows the sketches of a range of months count, queued orders included: items sold for ITEMS, orders for CUSTOMERS.
+
+    Args:
+        conn (Connection): Connection to read through.
+        name (str): Sketch name.
+        start (str): Optional first month, "YYYY-MM".
+        end (str): Optional last month (inclusive), "YYYY-MM".
+    """
+    chosen = buckets(conn, name, start, end)
+    total = 0
+    for start_index in range(0, len(chosen), 500):
+        chunk = chosen[start_index:start_index + 500]
+        statement = (
+            f"SELECT COALESCE(SUM(count), 0) FROM sketches WHERE name = ?"
+            f" AND bucket IN ({', '.join('?' * len(chunk))})"
+        )
+        parameters = (name, *chunk)
+        if name == ITEMS:
+            # Every item sold is in the overall sketches, and some again in their zip code's
+            statement += " AND zip_code = ?"
+            parameters += (ALL_ZIPS,)
+        total += conn.exec_driver_sql(statement, parameters).scalar()
+    return total + sum(
+        count for (_, _, zip_code), (count, _) in _pending(conn, name, start, end).items()
+        if name == CUSTOMERS or zip_code == ALL_ZIPS
+    )
+
+
+def merged(conn: Connection, name: str, start: str = None, end: str = None, zip_code: str = None) -> dict:
+    """
+    Merge the sketches of a range of months per zip code, queued orders included.
+
+    Args:
+        conn (Connection): Connection to read through.
+        name (str): ITEMS or CUSTOMERS.
+        start (str): Optional first month, "YYYY-MM".
+        end (str): Optional last month (inclusive), "YYYY-MM".
+        zip_code (str): Only this zip code (ALL_ZIPS for the overall item sketches).
+
+    Returns:
+        dict: Zip code -> (rows counted, merged sketch).
+    """
+    chosen = buckets(conn, name, start, end)
+    sketches = {}
+
+    def add(row_zip, count, sketch):
+        if row_zip not in sketches:
+            sketches[row_zip] = (count, sketch)
+            return
+        total, into = sketches[row_zip]
+        _merge(name, into, sketch)
+        sketches[row_zip] = (total + count, into)
+
+    for start_index in range(0, len(chosen), 500):
+        chunk = chosen[start_index:start_index + 500]
+        statement = (
+            f"SELECT zip_code, count, data FROM sketches WHERE name = ?"
+            f" AND bucket IN ({', '.join('?' * len(chunk))})"
+        )
+        parameters = (name, *chunk)
+        if zip_code is not None:
+            statement += " AND zip_code = ?"
+            parameters += (zip_code,)
+        for row_zip, count, data in conn.exec_driver_sql(statement, parameters):
+            add(row_zip, count, load(name, row_zip, data))
+    for (_, _, row_zip), (count, sketch) in _pending(conn, name, start, end).items():
+        if zip_code is None or row_zip == zip_code:
+            add(row_zip, count, sketch)
+    return sketches
+
+
+def exact(conn: Connection, name: str, start: str = None, end: str = None) -> list:
+    """
+    The rows a range of months adds to sketches, computed from every partition, for exact answers.
+
+    Args:
+        conn (Connection): Connection to read through.
+        name (str): ITEMS, for (month, shipping zip code, item name, items
+            sold) rows, or CUSTOMERS, for (month, billing zip code, customer
+            id, orders) rows.
+        start (str): Optional first month, "YYYY-MM".
+        end (str): Optional last month (inclusive), "YYYY-MM".
+
+    Returns:
+        list[tuple]: The rows; a month spread over partitions has rows in each.
+    """
+    from app import partitions
+
+    lower = datetime.strptime(start, "%Y-%m") if start else None
+    upper = _next_month(datetime.strptime(end, "%Y-%m")) if end else None
+    criteria = [f"timestamp >= '{lower:%Y-%m-%d}'"] if lower else []
+    criteria += [f"timestamp < '{upper:%Y-%m-%d}'"] if upper else []
+    query = _ITEM_COUNTS if name == ITEMS else _CUSTOMER_ORDERS
+    rows = []
+    for schema, _ in partitions.partitions(conn, lower, upper):
+        schema = schema or "main"
+        orders = f"(SELECT * FROM {schema}.orders WHERE {' AND '.join(criteria) or 'true'}) AS orders"
+        rows += conn.exec_driver_sql(query.format(orders=orders, schema=schema)).all()
+    return rows
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def main(engine: Engine):
+    """Rebuild every sketch in one transaction."""
+    with engine.begin() as conn:
+        rebuild(conn)
+        count = conn.exec_driver_sql("SELECT COUNT(*) FROM sketches").scalar()
+    print(f"Rebuilt {count} sketches.")
+    return 0
+
+
+if __name__ == "__main__":
+    from app import database, migrations
+
+    migrations.upgrade(database.engine)
+    sys.exit(main(database.engine))
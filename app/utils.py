@@ -2,12 +2,13 @@ from sqlalchemy.orm import Session
 
 from app import models
 from app.database import SessionLocal
-from faker import Faker
 import random
 
-faker = Faker()
-
 def create_sample_data(db: Session, num_customers: int = 100):
+    # Imported here: Faker is slow to import and only needed to generate data
+    from faker import Faker
+
+    faker = Faker()
     for _ in range(num_customers):
         customer = models.Customer(
             email=faker.unique.email(),
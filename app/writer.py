@@ -0,0 +1,215 @@
+"""
+Group-commit writer for single-order writes.
+
+SQLite has one writer, and a commit per order makes write throughput the
+fsync rate. `POST /orders` instead hands its order to one background writer
+thread, which gathers everything submitted while it waits (up to
+`PIER2_WRITE_BATCH_MAX_RECORDS` records, or `PIER2_WRITE_BATCH_MAX_DELAY_MS`
+after the first) and writes the batch in one transaction. Callers' futures
+resolve only once that transaction has committed, on a connection with
+`PRAGMA synchronous=PIER2_WRITE_SYNCHRONOUS` (FULL by default, so the commit
+is on disk); one fsync then covers a whole batch, and throughput grows with
+concurrency.
+
+Admission is bounded: once `PIER2_WRITE_QUEUE_MAX_PENDING` records are
+waiting, `submit` raises `Overloaded` (503 with Retry-After) instead of
+queueing more. The queue depth, rejections, batch sizes and commit and
+end-to-end latencies are exported on /metrics.
+"""
+
+import asyncio
+import dataclasses
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, database, metrics
+from app.config import settings
+
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+REJECTED = metrics.Counter("pier2_write_queue_rejected_total", "Order writes rejected because the queue was full.")
+BATCH_RECORDS = metrics.Histogram(
+    "pier2_write_batch_records", "Orders written per group-commit transaction.", buckets=BATCH_BUCKETS
+)
+COMMIT_SECONDS = metrics.Histogram("pier2_write_commit_seconds", "Time to write and commit one batch.")
+WRITE_SECONDS = metrics.Histogram(
+    "pier2_write_latency_seconds", "Time from admission to durable commit of an order, queueing included."
+)
+
+
+class Overloaded(Exception):
+    """The write queue is full; the caller should retry later."""
+
+
+@dataclasses.dataclass
+class _Pending:
+    record: object
+    future: Future
+    admitted: float
+
+
+class GroupCommitWriter:
+    """
+    A background thread writing submitted orders in group-commit batches.
+
+    Args:
+        session_factory: Callable returning a Session on the write database.
+        max_batch (int): Records per transaction.
+        max_delay_ms (float): How long to wait for more records after the first of a batch.
+        max_pending (int): Records admitted but not yet written before `submit` rejects.
+    """
+
+    def __init__(self, session_factory, max_batch: int = 500, max_delay_ms: float = 2.0, max_pending: int = 10000):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    @property
+    def depth(self) -> int:
+        """Records admitted and not yet committed into a batch."""
+        return self._queue.qsize()
+
+    def submit(self, record) -> Future:
+        """
+        Admit an order for the next batch.
+
+        Args:
+            record (schemas.BulkOrder): Validated order.
+
+        Returns:
+            Future: Resolves to the new order id after the commit, or to the
+            SQLAlchemyError that rejected the record.
+
+        Raises:
+            Overloaded: If the queue is full or the writer has shut down.
+        """
+        pending = _Pending(record, Future(), time.perf_counter())
+        with self._lock:
+            if self._closed:
+                raise Overloaded("The order writer is shutting down")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pier2-order-writer", daemon=True)
+                self._thread.start()
+            try:
+                self._queue.put_nowait(pending)
+            except queue.Full:
+                REJECTED.inc()
+                raise Overloaded(f"{self._queue.maxsize} orders are already waiting to be written") from None
+        return pending.future
+
+    async def write(self, record) -> int:
+        """
+        Submit an order and wait for its durable commit.
+
+        Returns:
+            int: The new order id.
+
+        Raises:
+            Overloaded: If the queue is full.
+            SQLAlchemyError: If the database rejected the order.
+        """
+        return await asyncio.wrap_future(self.submit(record))
+
+    def close(self, timeout: float = None):
+        """Stop admitting orders, write everything already admitted and stop the thread."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _next_batch(self) -> list:
+        """Block for a first record, then gather more until the batch is full or the delay has passed."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                # Whatever queued up during the previous commit is taken without waiting
+                pending = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if pending is None:
+                # Shutting down: write this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(pending)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._commit(batch)
+
+    def _commit(self, batch: list):
+        started = time.perf_counter()
+        try:
+            with self.session_factory() as db:
+                results = crud.create_orders([pending.record for pending in batch], db)
+        except Exception as e:  # the session itself failed (e.g. the database is unreachable)
+            results = [e] * len(batch)
+        committed = time.perf_counter()
+        BATCH_RECORDS.observe(len(batch))
+        COMMIT_SECONDS.observe(committed - started)
+        for pending, result in zip(batch, results):
+            WRITE_SECONDS.observe(committed - pending.admitted)
+            if isinstance(result, Exception):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _durable_session_factory():
+    """Sessions on a dedicated one-connection engine with the writer's `synchronous` level."""
+    if database._is_memory(settings.database_url):
+        return database.SessionLocal
+    config = dataclasses.replace(
+        settings, sqlite_synchronous=settings.write_synchronous, db_pool_size=1, db_max_overflow=0
+    )
+    return sessionmaker(autocommit=False, autoflush=False, bind=database.create_sqlite_engine(config))
+
+
+def order_writer() -> GroupCommitWriter:
+    """The process-wide writer, created on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = GroupCommitWriter(
+                _durable_session_factory(),
+                max_batch=settings.write_batch_max_records,
+                max_delay_ms=settings.write_batch_max_delay_ms,
+                max_pending=settings.write_queue_max_pending,
+            )
+        return _writer
+
+
+def shutdown():
+    """Drain and stop the process-wide writer, if it was started."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+metrics.CallbackGauge(
+    "pier2_write_queue_depth", "Orders admitted to the group-commit writer and not yet written.",
+    lambda: _writer.depth if _writer is not None else 0,
+)
@@ -0,0 +1,759 @@
+"""
+Benchmark suite for the API endpoints and crud functions.
+
+Builds seeded databases at several sizes (cached under --data-dir), then runs
+every endpoint through an in-process ASGI client and every crud function
+directly, reporting p50/p95/p99 latency, throughput and peak memory:
+
+    python benchmark.py run --sizes 10K,100K --output baseline.json
+    python benchmark.py run --sizes 10K,100K --compare baseline.json --threshold 0.2
+    python benchmark.py compare baseline.json current.json
+    python benchmark.py startup --runs 10 --output startup.json
+    python benchmark.py writes --concurrency 1,8,64 --output writes.json
+
+Compare mode exits with status 1 when a case's p50 or p95 latency regressed
+by more than the threshold (a fraction: 0.2 = 20% slower).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import itertools
+import json
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+import generate_data
+from app import migrations
+
+DEFAULT_SIZES = "10K,100K"
+# Latency percentiles compared between runs; p99 is reported but too noisy to gate on
+GATED_METRICS = ("p50_ms", "p95_ms")
+
+
+def percentile(samples, p: float) -> float:
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(samples, elapsed: float, peak_bytes: int) -> dict:
+    """
+    Reduce one case's latency samples (seconds) to the reported statistics.
+
+    Args:
+        samples (list): Per-call latencies in seconds.
+        elapsed (float): Wall time of the measured loop in seconds.
+        peak_bytes (int): Peak traced memory of a single call.
+
+    Returns:
+        dict: Iterations, p50/p95/p99/mean in ms, calls per second and peak KiB.
+    """
+    return {
+        "iterations": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "throughput_per_s": round(len(samples) / elapsed, 1),
+        "peak_memory_kib": round(peak_bytes / 1024, 1),
+    }
+
+
+def _measure(call, iterations: int, warmup: int, max_seconds: float) -> dict:
+    """Time a synchronous callable, then trace the peak memory of one call."""
+    for _ in range(warmup):
+        call()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        before = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - before)
+        if before - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summarize(samples, elapsed, peak)
+
+
+async def _measure_async(call, iterations: int, warmup: int, max_seconds: float) -> dict:
+    """Async counterpart of `_measure` for coroutine functions."""
+    for _ in range(warmup):
+        await call()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        before = time.perf_counter()
+        await call()
+        samples.append(time.perf_counter() - before)
+        if before - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    await call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summarize(samples, elapsed, peak)
+
+
+def dataset(data_dir: str, orders: int, seed: int) -> str:
+    """Return the path of the seeded dataset with `orders` orders, generating it once per schema version."""
+    path = os.path.join(data_dir, f"pier2_{orders}_s{seed}_v{len(migrations.MIGRATIONS)}.db")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        partial = path + ".partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        stats = generate_data.generate(partial, orders, seed=seed)
+        os.replace(partial, path)
+        print(f"Generated {path} in {stats['seconds']}s")
+    return path
+
+
+@contextlib.contextmanager
+def _bound_to(path: str):
+    """Point the app's session factories at `path` for the duration of the block."""
+    from app import database
+
+    config = dataclasses.replace(database.settings, database_url=f"sqlite:///{path}")
+    factories = [database.SessionLocal, database.ReadSessionLocal,
+                 database.AsyncSessionLocal, database.AsyncReadSessionLocal]
+    engines = [
+        database.create_sqlite_engine(config),
+        database.create_sqlite_engine(config, read_only=True),
+        database.create_async_sqlite_engine(config),
+        database.create_async_sqlite_engine(config, read_only=True),
+    ]
+    original = [factory.kw["bind"] for factory in factories]
+    for factory, engine in zip(factories, engines):
+        factory.configure(bind=engine)
+    try:
+        yield
+    finally:
+        for factory, engine in zip(factories, original):
+            factory.configure(bind=engine)
+        for engine in engines[:2]:
+            engine.dispose()
+        for engine in engines[2:]:
+            asyncio.run(engine.dispose())
+
+
+def _fixtures(path: str) -> dict:
+    """Pick benchmark identifiers from the dataset: the busiest and a median customer."""
+    conn = sqlite3.connect(path)
+    busiest, = conn.execute(
+        "SELECT customer_id FROM orders GROUP BY customer_id ORDER BY COUNT(*) DESC, customer_id LIMIT 1"
+    ).fetchone()
+    median = conn.execute("SELECT MAX(id) / 2 FROM customers").fetchone()[0] or 1
+    rows = dict(
+        (customer_id, (email, phone, last_name))
+        for customer_id, email, phone, last_name in conn.execute(
+            "SELECT id, email, phone, last_name FROM customers WHERE id IN (?, ?)", (busiest, median)
+        )
+    )
+    last_year, = conn.execute("SELECT MAX(substr(timestamp, 1, 4)) FROM orders").fetchone()
+    shipping_zip, country, state, city = conn.execute(
+        "SELECT zip_code, country, state, city FROM addresses"
+        " WHERE id = (SELECT shipping_address_id FROM order_items LIMIT 1)"
+    ).fetchone()
+    # A batch of 1000 identifiers alternating emails and phones, with a few misses
+    batch = [
+        email if i % 2 else phone
+        for i, (email, phone) in enumerate(conn.execute("SELECT email, phone FROM customers ORDER BY id LIMIT 990"))
+    ]
+    batch += [f"missing{i}@example.com" for i in range(1000 - len(batch))]
+    conn.close()
+    return {
+        "busiest_id": busiest,
+        "busiest_email": rows[busiest][0],
+        "median_phone": rows[median][1],
+        "median_email_user": rows[median][0].split("@")[0],
+        "median_last_name": rows[median][2] or "smith",
+        "start_date": f"01-01-{last_year}",
+        "end_date": f"12-31-{last_year}",
+        "start_month": f"01-{last_year}",
+        "end_month": f"12-{last_year}",
+        "shipping_zip": shipping_zip,
+        "location": {"country": country, "state": state, "city": city},
+        "batch": batch,
+    }
+
+
+def _bulk_payload(count: int, run: int, existing_email: str) -> list:
+    """A bulk upload body of `count` orders, half of them for an existing customer."""
+    records = []
+    for i in range(count):
+        email = f"bench{run}.{i}@example.com" if i % 2 else existing_email
+        records.append({
+            "customer": {"email": email},
+            "timestamp": f"2024-06-01T12:{i % 60:02d}:00",
+            "in_store": bool(i % 3),
+            "billing_address": {"type": "billing", "street": "1 Bench St", "city": "Austin", "state": "TX",
+                                "zip_code": "73301", "country": "USA"},
+            "items": [{"item_name": "Lamp", "shipping_address": {
+                "type": "shipping", "street": "1 Bench St", "city": "Austin", "state": "TX",
+                "zip_code": "73301", "country": "USA"}}],
+        })
+    return records
+
+
+def _legacy_top_instore_customers(db, start_date=None, end_date=None):
+    """
+    The top-customers query before the per-customer rollups: a join and
+    GROUP BY over the in-store orders, kept as the baseline for comparison.
+    """
+    from sqlalchemy import func
+
+    from app import crud, models
+
+    query = db.query(models.Customer.id, func.count(models.Order.id)).join(models.Order).filter(
+        models.Order.in_store == True  # noqa: E712
+    )
+    if start_date:
+        query = query.filter(models.Order.timestamp >= crud.parse_date(start_date))
+    if end_date:
+        query = query.filter(models.Order.timestamp < crud.parse_date(end_date) + timedelta(days=1))
+    return query.group_by(models.Customer.id).order_by(func.count(models.Order.id).desc()).limit(5).all()
+
+
+def _like_search_customers(db, query: str, limit: int = 20):
+    """Customer search as a LIKE '%query%' scan, the baseline for the FTS5 index."""
+    from app import models
+
+    pattern = f"%{query}%"
+    customers = models.Customer
+    return db.query(customers.id).filter(
+        customers.first_name.like(pattern) | customers.last_name.like(pattern) | customers.email.like(pattern)
+    ).limit(limit).all()
+
+
+def _exact_top_items(db, k: int = 10):
+    """The best-selling items as a GROUP BY over every order item, the baseline for the sketches."""
+    from sqlalchemy import func
+
+    from app import models
+
+    count = func.count(models.OrderItem.id)
+    return db.query(models.OrderItem.item_name, count).group_by(models.OrderItem.item_name).order_by(
+        count.desc()
+    ).limit(k).all()
+
+
+def _exact_distinct_customers_by_billing_zip(db):
+    """Distinct customers per billing zip code as a COUNT(DISTINCT) over every order, the baseline for the sketches."""
+    from sqlalchemy import func
+
+    from app import models
+
+    return db.query(models.Address.zip_code, func.count(models.Order.customer_id.distinct())).join(
+        models.Order, models.Order.billing_address_id == models.Address.id
+    ).group_by(models.Address.zip_code).all()
+
+
+def _scan_geo_counts(db, level: str = "state", **filters):
+    """Orders per billing location as a GROUP BY over every order, the baseline for the geo cube."""
+    from sqlalchemy import func
+
+    from app import models, rollups
+
+    path = [getattr(models.Address, name) for name in rollups.GEO_LEVELS[:rollups.GEO_LEVELS.index(level) + 1]]
+    query = db.query(*path, func.count(models.Order.id)).join(
+        models.Order, models.Order.billing_address_id == models.Address.id
+    )
+    for name, value in filters.items():
+        query = query.filter(getattr(models.Address, name) == value)
+    return query.group_by(*path).all()
+
+
+def crud_cases(ids: dict) -> dict:
+    """
+    Direct crud calls, keyed by case name.
+
+    Each case takes a session and performs one call; write cases come last
+    because they change the data the read cases see.
+    """
+    from app import crud, schemas
+
+    def history_stream(db):
+        for _ in crud.iter_order_history(ids["busiest_id"], db):
+            pass
+
+    bulk_runs = itertools.count()
+
+    def bulk(db):
+        payload = _bulk_payload(100, next(bulk_runs), ids["busiest_email"])
+        crud.ingest_orders([(i, schemas.BulkOrder.model_validate(r)) for i, r in enumerate(payload)], db)
+
+    filters = dict(start_date=ids["start_date"], end_date=ids["end_date"])
+    month = dict(start_date=ids["start_date"], end_date=ids["start_date"].replace("01-01", "01-31"))
+    months = dict(start_month=ids["start_month"], end_month=ids["end_month"])
+    location = ids["location"]
+    state = dict(country=location["country"], state=location["state"])
+    email_user = ids["median_email_user"]
+    # The email's user name with its middle letters swapped, found by the fuzzy fallback
+    middle = len(email_user) // 2
+    typo = email_user[:middle - 1] + email_user[middle] + email_user[middle - 1] + email_user[middle + 1:]
+    return {
+        "crud.find_customer_id": lambda db: crud.find_customer_id(ids["median_phone"], db),
+        "crud.get_order_history": lambda db: crud.get_order_history(ids["busiest_email"], db),
+        "crud.get_order_history[limit=50]": lambda db: crud.get_order_history(ids["busiest_email"], db, limit=50),
+        "crud.get_order_history[year]": lambda db: crud.get_order_history(ids["busiest_email"], db, **filters),
+        "crud.iter_order_history": history_stream,
+        "crud.get_order_histories[1000]": lambda db: crud.get_order_histories(ids["batch"], db),
+        "crud.get_data_version": lambda db: crud.get_data_version(db),
+        "crud.get_orders_grouped_by_billing_zip": lambda db: crud.get_orders_grouped_by_billing_zip(db),
+        "crud.get_orders_grouped_by_shipping_zip": lambda db: crud.get_orders_grouped_by_shipping_zip(db),
+        "crud.get_peak_instore_purchase_hour": lambda db: crud.get_peak_instore_purchase_hour(db),
+        "crud.get_peak_instore_purchase_hour[year]": lambda db: crud.get_peak_instore_purchase_hour(db, **filters),
+        "crud.get_top_instore_customer": lambda db: crud.get_top_instore_customer(db, None, None),
+        "crud.get_top_instore_customer[year]": lambda db: crud.get_top_instore_customer(db, **filters),
+        "crud.get_top_instore_customer[month]": lambda db: crud.get_top_instore_customer(db, **month),
+        "crud.get_top_instore_customer[year,k=100]": lambda db: crud.get_top_instore_customer(db, k=100, **filters),
+        "legacy.top_instore_customers": lambda db: _legacy_top_instore_customers(db),
+        "legacy.top_instore_customers[year]": lambda db: _legacy_top_instore_customers(db, **filters),
+        "legacy.top_instore_customers[month]": lambda db: _legacy_top_instore_customers(db, **month),
+        "crud.search_customers[email]": lambda db: crud.search_customers(email_user, db),
+        "crud.search_customers[name]": lambda db: crud.search_customers(ids["median_last_name"], db),
+        "crud.search_customers[phone]": lambda db: crud.search_customers(ids["median_phone"][:7], db),
+        "crud.search_customers[typo]": lambda db: crud.search_customers(typo, db),
+        "crud.search_customers[miss]": lambda db: crud.search_customers("zqxwv", db, fuzzy=False),
+        "legacy.search_customers_like[email]": lambda db: _like_search_customers(db, email_user),
+        "legacy.search_customers_like[miss]": lambda db: _like_search_customers(db, "zqxwv"),
+        "crud.get_top_items": lambda db: crud.get_top_items(db),
+        "crud.get_top_items[year]": lambda db: crud.get_top_items(db, **months),
+        "crud.get_top_items[zip]": lambda db: crud.get_top_items(db, zip_code=ids["shipping_zip"]),
+        "crud.get_distinct_customers_by_billing_zip": lambda db: crud.get_distinct_customers_by_billing_zip(db),
+        "crud.get_distinct_customers_by_billing_zip[year]": (
+            lambda db: crud.get_distinct_customers_by_billing_zip(db, **months)
+        ),
+        "legacy.top_items": lambda db: _exact_top_items(db),
+        "legacy.distinct_customers_by_billing_zip": lambda db: _exact_distinct_customers_by_billing_zip(db),
+        "crud.get_geo_counts[state]": lambda db: crud.get_geo_counts(db),
+        "crud.get_geo_counts[state,year,in_store]": lambda db: crud.get_geo_counts(db, in_store=True, **months),
+        "crud.get_geo_counts[city]": lambda db: crud.get_geo_counts(db, level="city", **state),
+        "crud.get_geo_counts[zip,city]": lambda db: crud.get_geo_counts(db, level="zip_code", **location),
+        "crud.get_geo_counts[zip,top10]": lambda db: crud.get_geo_counts(db, level="zip_code", top_n=10),
+        "crud.get_geo_counts[shipping,zip,top10]": (
+            lambda db: crud.get_geo_counts(db, level="zip_code", role="shipping", top_n=10)
+        ),
+        "legacy.geo_counts[state]": lambda db: _scan_geo_counts(db),
+        "legacy.geo_counts[zip,city]": lambda db: _scan_geo_counts(db, level="zip_code", **location),
+        **columnar_cases(ids),
+        "crud.ingest_orders[100]": bulk,
+    }
+
+
+def columnar_cases(ids: dict) -> dict:
+    """The analytics crud cases on the columnar snapshot engine; none without NumPy."""
+    from app import columnar
+
+    if columnar.np is None:
+        return {}
+    # Each dataset gets its own snapshot; the first (warmup) call loads it
+    columnar.reset()
+    filters = dict(start_date=ids["start_date"], end_date=ids["end_date"])
+    month = dict(start_date=ids["start_date"], end_date=ids["start_date"].replace("01-01", "01-31"))
+    return {
+        "columnar.get_orders_grouped_by_billing_zip": lambda db: columnar.get_orders_grouped_by_billing_zip(db),
+        "columnar.get_orders_grouped_by_shipping_zip": lambda db: columnar.get_orders_grouped_by_shipping_zip(db),
+        "columnar.get_peak_instore_purchase_hour[year]": (
+            lambda db: columnar.get_peak_instore_purchase_hour(db, **filters)
+        ),
+        "columnar.get_top_instore_customer": lambda db: columnar.get_top_instore_customer(db),
+        "columnar.get_top_instore_customer[year]": lambda db: columnar.get_top_instore_customer(db, **filters),
+        "columnar.get_top_instore_customer[month]": lambda db: columnar.get_top_instore_customer(db, **month),
+    }
+
+
+def http_cases(ids: dict) -> dict:
+    """
+    Endpoint requests through the ASGI app, keyed by case name.
+
+    Analytics endpoints are measured twice: `[cold]` clears the response cache
+    before every request, `[cached]` serves repeated requests from it.
+    """
+    from app import cache
+
+    def get(url, cold=False):
+        async def call(client):
+            if cold:
+                cache.analytics_cache.clear()
+            response = await client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {url} returned {response.status_code}")
+        return call
+
+    bulk_runs = itertools.count()
+
+    async def bulk(client):
+        response = await client.post("/orders/bulk", json=_bulk_payload(100, next(bulk_runs), ids["busiest_email"]))
+        if response.status_code != 200 or response.json()["failed"]:
+            raise RuntimeError(f"POST /orders/bulk returned {response.status_code}: {response.text[:200]}")
+
+    async def batch(client):
+        response = await client.post("/customers/orders:batch", json={"identifiers": ids["batch"]})
+        if response.status_code != 200:
+            raise RuntimeError(f"POST /customers/orders:batch returned {response.status_code}")
+
+    history = f"/customer/{ids['busiest_email']}/orders"
+    year = f"start_date={ids['start_date']}&end_date={ids['end_date']}"
+    state = f"country={ids['location']['country']}&state={ids['location']['state']}"
+    cases = {
+        "GET /health": get("/health"),
+        "GET /customer/{phone}/orders": get(f"/customer/{ids['median_phone']}/orders"),
+        "GET /customer/{email}/orders": get(history),
+        "GET /customer/{email}/orders?limit=50": get(f"{history}?limit=50"),
+        "GET /customer/{email}/orders?year": get(f"{history}?{year}"),
+        "GET /customer/{email}/orders?format=ndjson": get(f"{history}?format=ndjson"),
+        "POST /customers/orders:batch[1000]": batch,
+        "GET /customers/search?q={name}": get(f"/customers/search?q={ids['median_last_name']}"),
+    }
+    for url in (
+        "/analytics/orders_by_billing_zip",
+        "/analytics/orders_by_shipping_zip",
+        "/analytics/in_store_peak_hour",
+        f"/analytics/in_store_peak_hour?{year}&top_n=3",
+        "/analytics/top_instore_customers",
+        f"/analytics/top_instore_customers?{year}",
+        "/analytics/top_items",
+        f"/analytics/top_items?zip_code={ids['shipping_zip']}",
+        "/analytics/distinct_customers_by_zip",
+        "/analytics/geo?level=state",
+        f"/analytics/geo?level=city&{state}",
+        "/analytics/geo?level=zip_code&role=shipping&top_n=10",
+    ):
+        name = f"GET {url.replace(year, 'year').replace(ids['shipping_zip'], '{zip}').replace(state, '{state}')}"
+        cases[f"{name} [cold]"] = get(url, cold=True)
+        cases[f"{name} [cached]"] = get(url)
+    cases["GET /cache/stats"] = get("/cache/stats")
+    cases["POST /orders/bulk[100]"] = bulk
+    return cases
+
+
+def run_size(path: str, iterations: int, warmup: int, max_seconds: float, selected=None) -> dict:
+    """
+    Benchmark every case against one dataset.
+
+    The dataset is copied first so write cases leave the cached file untouched.
+
+    Args:
+        path (str): Seeded dataset to benchmark.
+        iterations (int): Measured calls per case.
+        warmup (int): Unmeasured calls per case before timing.
+        max_seconds (float): Stop a case early once it has run this long.
+        selected (str): Only run cases whose name contains this substring.
+
+    Returns:
+        dict: Statistics per case name.
+    """
+    from app import database
+    from app.main import app
+
+    workdir = tempfile.mkdtemp(prefix="pier2-bench-")
+    copy = os.path.join(workdir, os.path.basename(path))
+    shutil.copyfile(path, copy)
+    ids = _fixtures(copy)
+    results = {}
+
+    def report(name, stats):
+        results[name] = stats
+        print(f"  {name:<60} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms")
+
+    async def run_http():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, case in http_cases(ids).items():
+                if not selected or selected in name:
+                    report(name, await _measure_async(lambda: case(client), iterations, warmup, max_seconds))
+
+    try:
+        with _bound_to(copy):
+            for name, case in crud_cases(ids).items():
+                if selected and selected not in name:
+                    continue
+                db = (database.SessionLocal if "ingest" in name else database.ReadSessionLocal)()
+                try:
+                    report(name, _measure(lambda: case(db), iterations, warmup, max_seconds))
+                finally:
+                    db.close()
+            asyncio.run(run_http())
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Run in a fresh interpreter: time to import the app, then to finish its lifespan startup
+STARTUP_SCRIPT = """
+import asyncio, json, resource, sys, time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+async def ready():
+    async with app.router.lifespan_context(app):
+        pass
+
+asyncio.run(ready())
+print(json.dumps({
+    "import": imported - started,
+    "ready": time.perf_counter() - started,
+    "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "faker_imported": "faker" in sys.modules,
+}))
+"""
+
+
+def _start_app(database_url: str) -> dict:
+    """Start the app once in a new interpreter; returns its timings plus the process wall time."""
+    env = {**os.environ, "PIER2_DATABASE_URL": database_url}
+    before = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT], env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - before
+    return timings
+
+
+def startup(data_dir: str, runs: int = 10, orders: int = 10_000, seed: int = 42) -> dict:
+    """
+    Measure cold start: fresh interpreter to imported app and to lifespan ready.
+
+    Warm starts use an up-to-date seeded dataset (the common case: every
+    worker boot and --reload cycle); first starts use an empty file, so they
+    include migrations and the sample data load.
+
+    Returns:
+        dict: Statistics per phase, in the same shape as one size of `run`.
+    """
+    path = dataset(data_dir, orders, seed)
+    samples = {"warm: process to ready": [], "warm: import app.main": [], "warm: import to ready": []}
+    first_starts = []
+    peak_kib = 0
+    for _ in range(runs):
+        timings = _start_app(f"sqlite:///{path}")
+        if timings["faker_imported"]:
+            print("  warning: Faker was imported on the serving path")
+        samples["warm: process to ready"].append(timings["process"])
+        samples["warm: import app.main"].append(timings["import"])
+        samples["warm: import to ready"].append(timings["ready"] - timings["import"])
+        peak_kib = max(peak_kib, timings["max_rss_kib"])
+    with tempfile.TemporaryDirectory(prefix="pier2-startup-") as workdir:
+        for run_number in range(max(1, runs // 5)):
+            first_starts.append(_start_app(f"sqlite:///{workdir}/empty{run_number}.db")["process"])
+
+    results = {name: summarize(values, sum(values), peak_kib * 1024) for name, values in samples.items()}
+    results["first start: process to ready"] = summarize(first_starts, sum(first_starts), 0)
+    for name, stats in results.items():
+        print(f"  {name:<60} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms")
+    return results
+
+
+def writes(data_dir: str, concurrency=(1, 8, 64), orders: int = 2000, seed: int = 42) -> dict:
+    """
+    Measure durable single-order write throughput: a commit per order versus
+    the group-commit writer, with `concurrency` clients each writing its
+    share of `orders`. Both commit with PRAGMA synchronous=FULL.
+
+    Returns:
+        dict: Per case, throughput in orders per second and latency statistics.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from sqlalchemy.orm import sessionmaker
+
+    from app import crud, database, schemas, writer
+
+    path = dataset(data_dir, 10_000, seed)
+    existing_email = _fixtures(path)["busiest_email"]
+    results = {}
+    for clients in concurrency:
+        records = [schemas.BulkOrder.model_validate(r) for r in _bulk_payload(orders, clients, existing_email)]
+        for mode in ("commit per order", "group commit"):
+            with tempfile.TemporaryDirectory(prefix="pier2-writes-") as workdir:
+                copy = os.path.join(workdir, "pier2.db")
+                shutil.copyfile(path, copy)
+                config = dataclasses.replace(
+                    database.settings, database_url=f"sqlite:///{copy}", sqlite_synchronous="full",
+                    db_pool_size=clients, db_max_overflow=0,
+                )
+                engine = database.create_sqlite_engine(config)
+                sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                group_writer = writer.GroupCommitWriter(sessions)
+
+                def write(record):
+                    started = time.perf_counter()
+                    if mode == "group commit":
+                        group_writer.submit(record).result()
+                    else:
+                        with sessions() as db:
+                            [result] = crud.create_orders([record], db)
+                            if isinstance(result, Exception):
+                                raise result
+                    return time.perf_counter() - started
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=clients) as pool:
+                    samples = list(pool.map(write, records))
+                elapsed = time.perf_counter() - started
+                group_writer.close()
+                engine.dispose()
+
+            name = f"{mode} [{clients} clients]"
+            results[name] = summarize(samples, elapsed, 0)
+            print(f"  {name:<40} {len(records) / elapsed:>9.0f} orders/s  "
+                  f"p50 {results[name]['p50_ms']:>8.3f} ms  p95 {results[name]['p95_ms']:>8.3f} ms")
+    return results
+
+
+def _meta(seed: int, iterations: int) -> dict:
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "seed": seed,
+        "iterations": iterations,
+    }
+
+
+def run(sizes, data_dir: str, seed: int = 42, iterations: int = 100, warmup: int = 5,
+        max_seconds: float = 10.0, selected=None) -> dict:
+    """
+    Run the suite at each dataset size.
+
+    Returns:
+        dict: Run metadata under "meta" and per-size case statistics under
+        "results", keyed by order count.
+    """
+    report = {"meta": _meta(seed, iterations), "results": {}}
+    for orders in sizes:
+        path = dataset(data_dir, orders, seed)
+        print(f"{orders:,} orders ({path})")
+        report["results"][str(orders)] = run_size(path, iterations, warmup, max_seconds, selected)
+    return report
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.2, min_delta_ms: float = 0.05) -> list:
+    """
+    Find cases that got slower than the baseline.
+
+    A case regresses when a gated percentile grew by more than `threshold`
+    (relative) and by more than `min_delta_ms` (absolute, so sub-millisecond
+    jitter does not trip the gate). Cases or sizes missing from either
+    report are skipped.
+
+    Returns:
+        list: One dict per regression with size, case, metric, both values
+        and the relative change.
+    """
+    regressions = []
+    for size, cases in current["results"].items():
+        for name, stats in cases.items():
+            before = baseline["results"].get(size, {}).get(name)
+            if before is None:
+                continue
+            for metric in GATED_METRICS:
+                old, new = before[metric], stats[metric]
+                if old > 0 and new > old * (1 + threshold) and new - old > min_delta_ms:
+                    regressions.append({
+                        "size": size, "case": name, "metric": metric,
+                        "baseline": old, "current": new, "change": round(new / old - 1, 3),
+                    })
+    return regressions
+
+
+def _report_regressions(regressions, threshold: float) -> int:
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%}.")
+        return 0
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%}:")
+    for r in regressions:
+        print(f"  [{r['size']}] {r['case']} {r['metric']}: {r['baseline']} -> {r['current']} ms (+{r['change']:.0%})")
+    return 1
+
+
+def _load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pier2 API endpoints and crud functions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the suite and write a JSON report")
+    run_parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated order counts, e.g. 10K,100K,1M")
+    run_parser.add_argument("--data-dir", default=".benchmarks", help="where seeded datasets are cached")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--iterations", type=int, default=100)
+    run_parser.add_argument("--warmup", type=int, default=5)
+    run_parser.add_argument("--max-seconds", type=float, default=10.0, help="time cap per case")
+    run_parser.add_argument("--only", help="only run cases whose name contains this text")
+    run_parser.add_argument("--output", help="write the JSON report here")
+    run_parser.add_argument("--compare", help="baseline report to check for regressions")
+    run_parser.add_argument("--threshold", type=float, default=0.2)
+
+    startup_parser = commands.add_parser("startup", help="measure cold start time in fresh interpreters")
+    startup_parser.add_argument("--runs", type=int, default=10)
+    startup_parser.add_argument("--data-dir", default=".benchmarks", help="where seeded datasets are cached")
+    startup_parser.add_argument("--output", help="write the JSON report here")
+    startup_parser.add_argument("--compare", help="baseline report to check for regressions")
+    startup_parser.add_argument("--threshold", type=float, default=0.2)
+
+    writes_parser = commands.add_parser("writes", help="measure durable single-order write throughput")
+    writes_parser.add_argument("--concurrency", default="1,8,64", help="comma-separated client counts")
+    writes_parser.add_argument("--orders", type=int, default=2000, help="orders written per client count and mode")
+    writes_parser.add_argument("--data-dir", default=".benchmarks", help="where seeded datasets are cached")
+    writes_parser.add_argument("--output", help="write the JSON report here")
+    writes_parser.add_argument("--compare", help="baseline report to check for regressions")
+    writes_parser.add_argument("--threshold", type=float, default=0.2)
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        return _report_regressions(compare(_load(args.baseline), _load(args.current), args.threshold), args.threshold)
+
+    if args.command == "startup":
+        report = {"meta": _meta(seed=42, iterations=args.runs), "results": {"startup": startup(args.data_dir, args.runs)}}
+    elif args.command == "writes":
+        concurrency = [int(clients) for clients in args.concurrency.split(",")]
+        report = {"meta": _meta(seed=42, iterations=args.orders),
+                  "results": {"writes": writes(args.data_dir, concurrency, args.orders)}}
+    else:
+        sizes = [generate_data.parse_count(size) for size in args.sizes.split(",")]
+        report = run(sizes, args.data_dir, args.seed, args.iterations, args.warmup, args.max_seconds, args.only)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    if args.compare:
+        return _report_regressions(compare(_load(args.compare), report, args.threshold), args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
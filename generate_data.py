@@ -0,0 +1,270 @@
+"""
+Synthetic dataset generator for load and capacity testing.
+
+Builds a pier2-schema SQLite database with a given number of orders from a
+seeded RNG, so the same arguments always produce the same data:
+
+    python generate_data.py 1M --output pier2_1m.db --seed 7 --zip-skew 1.2
+
+Rows are written with executemany in large transactions while triggers and
+secondary indexes are dropped; indexes and triggers are then recreated and
+the rollups, the search index and the sketches rebuilt in a single pass,
+which is far faster than maintaining them row by row.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from itertools import accumulate
+
+from app import addresses, identifiers, migrations, rollups, search, sketches
+from app.config import Settings
+from app.database import create_sqlite_engine
+
+FIRST_NAMES = ["Alice", "Bob", "Charlie", "Diana", "Eve", "Frank", "Grace", "Henry", "Isabella", "Jack"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez"]
+ITEM_NAMES = ["Chair", "Table", "Lamp", "Sofa", "Desk", "Couch", "Bed", "Pillow", "Blanket", "Rug"]
+STREETS = ["123 Main St", "456 Elm Ave", "789 Oak Dr", "321 Maple Rd", "654 Pine Blvd", "101 Sunrise Blvd",
+           "202 Birchwood Ln", "303 Riverwalk Dr", "404 Aspen Ct", "505 Highland Ave", "606 Willow Creek Rd"]
+CITIES = ["San Francisco", "New York", "Chicago", "Austin", "Seattle", "Los Angeles", "San Diego", "Dallas",
+          "San Jose", "Houston"]
+STATES = ["CA", "NY", "IL", "TX", "WA"]
+
+# Relative in-store traffic per hour of day (stores open 9am-9pm, afternoon peak)
+INSTORE_HOUR_WEIGHTS = [0, 0, 0, 0, 0, 0, 0, 0, 1, 4, 6, 8, 10, 9, 9, 11, 12, 10, 8, 6, 3, 1, 0, 0]
+
+def parse_count(value: str) -> int:
+    """Parse an order count such as 1000, 10K or 2.5M."""
+    multipliers = {"K": 1_000, "M": 1_000_000}
+    value = value.strip().upper()
+    if value[-1:] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def _zipf_cum_weights(n: int, skew: float):
+    """Cumulative Zipf weights: rank r is chosen with probability ~ 1 / r**skew."""
+    return list(accumulate(1 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+def _customer_rows(num_customers: int):
+    for i in range(1, num_customers + 1):
+        first = FIRST_NAMES[i % len(FIRST_NAMES)]
+        email = f"{first.lower()}{i}@example.com"
+        phone = f"{200 + i // 10_000_000:03d}-{(i // 10_000) % 1000:03d}-{i % 10_000:04d}"
+        # Lookup keys as app.identifiers normalizes them
+        yield (
+            i,
+            first,
+            LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)],
+            email,
+            phone,
+            identifiers.normalize_email(email),
+            identifiers.normalize_phone(phone),
+        )
+
+
+def _address_id(address_ids: dict, address_rows: list, address_type: str, columns: tuple) -> int:
+    """Id of an address, appending a row for it the first time it is seen."""
+    key = (address_type, *columns)
+    address_id = address_ids.get(key)
+    if address_id is None:
+        address_id = address_ids[key] = len(address_ids) + 1
+        address_rows.append((address_id, *key, "USA", addresses.address_key(*key, "USA")))
+    return address_id
+
+
+def _drop_triggers_and_indexes(conn):
+    """Drop triggers and secondary indexes, returning the SQL to recreate them."""
+    objects = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE type IN ('trigger', 'index') AND sql IS NOT NULL"
+    ).fetchall()
+    for object_type, name, _ in objects:
+        conn.execute(f"DROP {object_type.upper()} {name}")
+    return [sql for _, _, sql in objects]
+
+
+def generate(path: str, orders: int, seed: int = 42, zip_codes: int = 1000, zip_skew: float = 1.0,
+             in_store_ratio: float = 0.5, repeat_ratio: float = 0.6, customer_skew: float = 2.0,
+             max_items: int = 4, start_year: int = 2015, end_year: int = 2025, chunk_size: int = 100_000):
+    """
+    Generate a synthetic database.
+
+    Args:
+        path (str): SQLite file to create; must not exist.
+        orders (int): Number of orders.
+        seed (int): RNG seed; equal arguments give identical databases.
+        zip_codes (int): Number of distinct zip codes.
+        zip_skew (float): Zipf exponent of zip code popularity (0 = uniform).
+        in_store_ratio (float): Fraction of orders placed in store.
+        repeat_ratio (float): Fraction of orders placed by returning customers;
+            the number of customers is orders * (1 - repeat_ratio).
+        customer_skew (float): How strongly repeat orders concentrate on a few
+            customers (1 = uniform, higher = heavier repeat buyers).
+        max_items (int): Items per order are uniform in 1..max_items.
+        start_year (int): First year of order timestamps.
+        end_year (int): Last year of order timestamps.
+        chunk_size (int): Orders generated and committed per transaction.
+
+    Returns:
+        dict: Row counts, elapsed seconds and file size.
+    """
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    num_customers = max(1, int(orders * (1 - repeat_ratio)))
+
+    engine = create_sqlite_engine(Settings(database_url=f"sqlite:///{path}"))
+    migrations.upgrade(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    recreate = _drop_triggers_and_indexes(conn)
+
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO customers (id, first_name, last_name, email, phone, email_key, phone_key)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+        _customer_rows(num_customers),
+    )
+    conn.execute("COMMIT")
+
+    zips = [f"{code:05d}" for code in rng.sample(range(501, 99951), zip_codes)]
+    zip_weights = _zipf_cum_weights(zip_codes, zip_skew)
+    hour_weights = list(accumulate(INSTORE_HOUR_WEIGHTS))
+    # Timestamps are written in SQLAlchemy's SQLite DateTime storage format
+    first_day = datetime(start_year, 1, 1).toordinal()
+    days = datetime(end_year, 12, 31).toordinal() - first_day + 1
+
+    day_strings = [datetime.fromordinal(first_day + day).strftime("%Y-%m-%d") for day in range(days)]
+    # Canonical address store: each distinct address is written once, keyed like app.addresses.resolve
+    address_ids = {}
+    item_id = 0
+    for chunk_start in range(0, orders, chunk_size):
+        chunk_orders = min(chunk_size, orders - chunk_start)
+        # Draw every random column of the chunk in bulk; rng.choices is much cheaper per value than rng.choice
+        items_per_order = rng.choices(range(1, max_items + 1), k=chunk_orders)
+        num_items = sum(items_per_order)
+        num_addresses = chunk_orders + num_items
+        address_columns = zip(
+            rng.choices(STREETS, k=num_addresses),
+            rng.choices(CITIES, k=num_addresses),
+            rng.choices(STATES, k=num_addresses),
+            rng.choices(zips, cum_weights=zip_weights, k=num_addresses),
+        )
+        item_names = iter(rng.choices(ITEM_NAMES, k=num_items))
+        order_days = rng.choices(day_strings, k=chunk_orders)
+        seconds_of_hour = rng.choices(range(3600), k=chunk_orders)
+        instore_hours = iter(rng.choices(range(24), cum_weights=hour_weights, k=chunk_orders))
+
+        address_rows, order_rows, item_rows = [], [], []
+        for offset, item_count in enumerate(items_per_order):
+            order_id = chunk_start + offset + 1
+            # Every customer places at least one order; the rest go to repeat buyers
+            if order_id <= num_customers:
+                customer_id = order_id
+            else:
+                customer_id = int(num_customers * rng.random() ** customer_skew) + 1
+
+            in_store = rng.random() < in_store_ratio
+            hour = next(instore_hours) if in_store else int(rng.random() * 24)
+            second = seconds_of_hour[offset]
+            timestamp = f"{order_days[offset]} {hour:02d}:{second // 60:02d}:{second % 60:02d}.000000"
+
+            billing_address_id = _address_id(address_ids, address_rows, "billing", next(address_columns))
+            order_rows.append((order_id, customer_id, billing_address_id, timestamp, in_store))
+            for _ in range(item_count):
+                item_id += 1
+                shipping_address_id = _address_id(address_ids, address_rows, "shipping", next(address_columns))
+                item_rows.append((item_id, order_id, next(item_names), shipping_address_id))
+
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO addresses (id, type, street, city, state, zip_code, country, address_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            address_rows,
+        )
+        conn.executemany(
+            "INSERT INTO orders (id, customer_id, billing_address_id, timestamp, in_store) VALUES (?, ?, ?, ?, ?)",
+            order_rows,
+        )
+        conn.executemany(
+            "INSERT INTO order_items (id, order_id, item_name, shipping_address_id) VALUES (?, ?, ?, ?)",
+            item_rows,
+        )
+        conn.execute("COMMIT")
+
+    # Indexes and triggers in one pass each, then rollups, the search index and the sketches from scratch
+    conn.execute("BEGIN")
+    for sql in recreate:
+        conn.execute(sql)
+    conn.execute("COMMIT")
+    engine = create_sqlite_engine(Settings(database_url=f"sqlite:///{path}"))
+    with engine.begin() as connection:
+        rollups.rebuild(connection)
+        search.rebuild(connection)
+        if sketches.np is not None:
+            # Otherwise the sketch analytics answer exactly until `python -m app.sketches`
+            sketches.rebuild(connection)
+        connection.exec_driver_sql("UPDATE data_version SET version = version + 1 WHERE id = 1")
+    engine.dispose()
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+    return {
+        "customers": num_customers,
+        "orders": orders,
+        "order_items": item_id,
+        "addresses": len(address_ids),
+        "seconds": round(time.perf_counter() - started, 1),
+        "bytes": os.path.getsize(path),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic pier2 SQLite database.")
+    parser.add_argument("orders", type=parse_count, help="number of orders, e.g. 1000, 100K, 10M")
+    parser.add_argument("--output", default="pier2_synthetic.db", help="database file to create")
+    parser.add_argument("--force", action="store_true", help="overwrite the output file if it exists")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--zip-codes", type=int, default=1000)
+    parser.add_argument("--zip-skew", type=float, default=1.0)
+    parser.add_argument("--in-store-ratio", type=float, default=0.5)
+    parser.add_argument("--repeat-ratio", type=float, default=0.6)
+    parser.add_argument("--customer-skew", type=float, default=2.0)
+    parser.add_argument("--max-items", type=int, default=4)
+    parser.add_argument("--start-year", type=int, default=2015)
+    parser.add_argument("--end-year", type=int, default=2025)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.output):
+        if not args.force:
+            print(f"{args.output} already exists. Use --force to overwrite.")
+            return 1
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+
+    stats = generate(
+        args.output, args.orders, seed=args.seed, zip_codes=args.zip_codes, zip_skew=args.zip_skew,
+        in_store_ratio=args.in_store_ratio, repeat_ratio=args.repeat_ratio, customer_skew=args.customer_skew,
+        max_items=args.max_items, start_year=args.start_year, end_year=args.end_year, chunk_size=args.chunk_size,
+    )
+    print(
+        f"Generated {stats['orders']:,} orders, {stats['order_items']:,} items, {stats['customers']:,} customers "
+        f"and {stats['addresses']:,} addresses in {stats['seconds']}s ({stats['bytes'] / 2**20:,.0f} MiB)."
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
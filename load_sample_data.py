@@ -1,21 +1,24 @@
-from app import models
+from app import addresses, models, migrations
 from app.database import SessionLocal
 from datetime import datetime
+import argparse
 import random
-import sys
 
 def load_data():
-    """Used by main.py to safely auto-load when DB is empty."""
-    if "--auto" not in sys.argv:
-        sys.argv.append("--auto")
-    main()
+    """Used by the app's startup to safely auto-load when DB is empty."""
+    main(["--auto"])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load sample customers and orders into the database.")
+    parser.add_argument("--force", action="store_true", help="delete existing data and reload")
+    parser.add_argument("--auto", action="store_true", help="skip quietly if data already exists")
+    args = parser.parse_args(argv)
 
-def main():
     db = SessionLocal()
-    models.Base.metadata.create_all(bind=db.bind)
+    migrations.upgrade(db.bind)
 
-    force = "--force" in sys.argv
-    auto = "--auto" in sys.argv
+    force = args.force
+    auto = args.auto
 
     if db.query(models.Customer).first():
         if force:
@@ -55,57 +58,54 @@ def main():
             phone=phone
         )
         db.add(customer)
-        db.commit()
-        db.refresh(customer)
+        db.flush()
         
 
         for _ in range(random.randint(1, 3)):
             billing_zip = random.choice(zip_codes)
 
-            billing_address = models.Address(
-                type="billing",            
+            # Identical addresses resolve to one canonical row
+            billing_address_id, = addresses.resolve(db, [dict(
+                type="billing",
                 street = random.choice(streets),
                 city = random.choice(cities),
                 state = random.choice(states),
                 zip_code=billing_zip,
                 country="USA"
-            )
-            db.add(billing_address)
-            db.commit()
+            )])
             year = year_list[i % len(year_list)]  # Distributes evenly across years
             order = models.Order(
             customer_id=customer.id,
-            billing_address_id=billing_address.id,
+            billing_address_id=billing_address_id,
             timestamp=datetime(year, random.randint(1, 12), random.randint(1, 28), random.randint(0, 23)),
             in_store=random.choice([True, False])
         )
 
             
             db.add(order)
-            db.commit()
-            db.refresh(order)
+            db.flush()
 
             for _ in range(random.randint(1, 4)):
                 shipping_zip = random.choice(zip_codes)
-                shipping_address = models.Address(
+                shipping_address_id, = addresses.resolve(db, [dict(
                     type="shipping",
                     street = random.choice(streets),
                     city = random.choice(cities),
                     state = random.choice(states),
                     zip_code=shipping_zip,
                     country="USA"
-                )
-                db.add(shipping_address)
-                db.commit()
+                )])
 
                 item = models.OrderItem(
                     order_id=order.id,
                     item_name=random.choice(item_names),
-                    shipping_address_id=shipping_address.id
+                    shipping_address_id=shipping_address_id
                 )
                 db.add(item)
-            db.commit()
 
+    # Everything is written in one transaction; ids come from flushes
+    db.commit()
+    db.close()
     print("Sample data loaded successfully.")
 
 if __name__ == "__main__":
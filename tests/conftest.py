@@ -0,0 +1,122 @@
+import os
+import sys
+
+# Adding the project root directory to sys.path so that 'app' can be imported when running tests directly
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import cache, database, main, migrations, models
+
+
+ZIP_CODES = ["94110", "10001", "60614", "30301"]
+ITEM_NAMES = ["Chair", "Table", "Lamp", "Sofa", "Desk"]
+
+
+@pytest.fixture(autouse=True)
+def clear_analytics_cache():
+    """Start every test with an empty analytics response cache."""
+    cache.analytics_cache.clear()
+
+
+@pytest.fixture
+def engine():
+    """Fresh in-memory SQLite database with the full schema."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    migrations.upgrade(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    """Session bound to the in-memory test database."""
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def make_address(zip_code, type="shipping"):
+    return models.Address(
+        type=type,
+        street="123 Main St",
+        city="San Francisco",
+        state="CA",
+        zip_code=zip_code,
+        country="USA",
+    )
+
+
+def seed(db, num_customers=6):
+    """
+    Insert a small deterministic dataset.
+
+    Customer `i` gets `i + 1` orders, order `j` gets `j % 3 + 1` items, and
+    timestamps, zip codes and in-store flags cycle through fixed lists.
+    """
+    for i in range(num_customers):
+        customer = models.Customer(
+            first_name=f"First{i}",
+            last_name=f"Last{i}",
+            email=f"customer{i}@example.com",
+            phone=f"415-555-{1000 + i}",
+        )
+        db.add(customer)
+        for j in range(i + 1):
+            order = models.Order(
+                customer=customer,
+                billing_address=make_address(ZIP_CODES[(i + j) % len(ZIP_CODES)], "billing"),
+                timestamp=datetime(2015 + (i + j) % 10, j % 12 + 1, i % 28 + 1, (i * 5 + j) % 24),
+                in_store=(i + j) % 2 == 0,
+            )
+            db.add(order)
+            for k in range(j % 3 + 1):
+                db.add(models.OrderItem(
+                    order=order,
+                    item_name=ITEM_NAMES[(i + j + k) % len(ITEM_NAMES)],
+                    shipping_address=make_address(ZIP_CODES[(i + k) % len(ZIP_CODES)]),
+                ))
+    db.commit()
+
+
+@pytest.fixture
+def seeded_db(db):
+    """Session over a database populated by `seed`."""
+    seed(db)
+    return db
+
+
+@pytest.fixture
+def client_db(seeded_db):
+    """Session the `client` fixture serves requests from; override it in a module to serve another one."""
+    return seeded_db
+
+
+@pytest.fixture
+def client_settings():
+    """Settings the app runs with under the `client` fixture; override it in a module to change them."""
+    return None
+
+
+@pytest.fixture
+def client(client_db, client_settings, monkeypatch):
+    """Test client whose read and write sessions use `client_db`, with `client_settings` if any."""
+    if client_settings is not None:
+        monkeypatch.setattr(main, "settings", client_settings)
+    app = main.app
+    app.dependency_overrides[database.get_read_session] = lambda: client_db
+    app.dependency_overrides[database.get_session] = lambda: client_db
+    yield TestClient(app)
+    app.dependency_overrides.clear()
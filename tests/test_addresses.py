@@ -0,0 +1,111 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app import addresses, crud, migrations, models, schemas
+from test_rollups import assert_zip_parity
+
+
+def address(zip_code="94110", type="shipping", street="123 Main St"):
+    return {"type": type, "street": street, "city": "San Francisco", "state": "CA", "zip_code": zip_code,
+            "country": "USA"}
+
+
+def histories(db):
+    return {
+        customer.email: crud.get_order_history(customer.email, db)
+        for customer in db.query(models.Customer).order_by(models.Customer.id)
+    }
+
+
+def test_address_key_ignores_case_spacing_and_punctuation():
+    key = addresses.address_key("shipping", "123 Main St.", "San Francisco", "CA", "94110", "USA")
+    assert addresses.address_key("Shipping", " 123  main st", "SAN FRANCISCO", "ca", "94110", None) == key
+    assert addresses.address_key("billing", "123 Main St", "San Francisco", "CA", "94110", "USA") != key
+    assert addresses.address_key("shipping", "123 Main St", "San Francisco", "CA", "94111", "USA") != key
+
+
+def test_resolve_reuses_existing_rows(db):
+    first = addresses.resolve(db, [address(), address("10001"), address()])
+    second = addresses.resolve(db, [address("10001"), {**address(), "street": "123 MAIN ST."}, address("60614")])
+    db.commit()
+
+    assert first[0] == first[2] == second[1]
+    assert second[0] == first[1]
+    assert db.query(models.Address).count() == 3
+
+
+def test_unique_index_rejects_duplicate_keys(db):
+    [address_id] = addresses.resolve(db, [address()])
+    duplicate = models.Address(**address(), address_key=db.get(models.Address, address_id).address_key)
+    db.add(duplicate)
+    with pytest.raises(Exception, match="UNIQUE"):
+        db.commit()
+
+
+def test_bulk_ingest_shares_addresses(db):
+    record = schemas.BulkOrder.model_validate({
+        "customer": {"email": "bulk@example.com"},
+        "timestamp": "2024-01-01T10:00:00",
+        "in_store": True,
+        "billing_address": address(type="billing"),
+        "items": [{"item_name": "Lamp", "shipping_address": address()} for _ in range(3)],
+    })
+
+    result = crud.ingest_orders([(i, record) for i in range(4)], db)
+
+    assert result == {"inserted": 4, "errors": []}
+    assert db.query(models.Address).count() == 2
+    assert db.query(models.OrderItem).count() == 12
+    assert_zip_parity(db)
+
+
+def test_compaction_merges_and_repoints(seeded_db):
+    before = histories(seeded_db)
+    keyed_id, = addresses.resolve(seeded_db, [address("94110", "billing")])
+    seeded_db.commit()
+    rows_before = seeded_db.query(models.Address).count()
+
+    with seeded_db.get_bind().begin() as conn:
+        removed = addresses.compact(conn)
+    seeded_db.expire_all()
+
+    # Four zip codes, as billing and as shipping addresses
+    assert seeded_db.query(models.Address).count() == 8
+    assert removed == rows_before - 8
+    assert seeded_db.query(models.Address).filter(models.Address.address_key.is_(None)).count() == 0
+    # The address already in the store is the canonical one
+    billing_ids = seeded_db.query(models.Order.billing_address_id).join(models.Order.billing_address).filter(
+        models.Address.zip_code == "94110"
+    ).distinct().all()
+    assert billing_ids == [(keyed_id,)]
+    assert histories(seeded_db) == before
+    assert_zip_parity(seeded_db)
+
+
+def test_upgrade_compacts_existing_database():
+    # A database from before the address store: no address_key column, duplicate addresses
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE addresses DROP COLUMN address_key")
+    with Session(bind=engine) as db:
+        db.execute(models.Customer.__table__.insert(), [{"id": 1, "email": "a@example.com", "phone": "1"}])
+        for i in range(5):
+            db.execute(models.Address.__table__.insert().values(id=i + 1, **address(type="billing")))
+            db.execute(models.Order.__table__.insert().values(
+                id=i + 1, customer_id=1, billing_address_id=i + 1, timestamp=datetime(2020, 1, 1), in_store=False
+            ))
+        db.commit()
+
+        migrations.upgrade(engine)
+
+        assert db.query(models.Address.id, models.Address.address_key).all() == [
+            (1, addresses.address_key(**address(type="billing")))
+        ]
+        assert {row.billing_address_id for row in db.query(models.Order)} == {1}
+        assert_zip_parity(db)
+    engine.dispose()
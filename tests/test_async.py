@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import async_crud, crud, database, migrations
+from app.main import app
+from conftest import seed
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    """Seeded SQLite file shared by a sync and an async engine."""
+    url = f"sqlite:///{tmp_path / 'pier2.db'}"
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    migrations.upgrade(engine)
+    with sessionmaker(bind=engine)() as db:
+        seed(db)
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def sync_sessions(db_url):
+    engine = create_engine(db_url, connect_args={"check_same_thread": False})
+    yield sessionmaker(autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def async_sessions(db_url):
+    engine = create_async_engine(db_url.replace("sqlite://", "sqlite+aiosqlite://", 1))
+    yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+CALLS = [
+    ("get_order_history", ("customer5@example.com",), {}),
+    ("get_order_history", ("415-555-1003",), {"limit": 2, "start_date": "01-01-2016"}),
+    ("find_customer_id", ("customer4@example.com",), {}),
+    ("get_orders_grouped_by_billing_zip", (), {"order": "asc"}),
+    ("get_orders_grouped_by_shipping_zip", (), {}),
+    ("get_peak_instore_purchase_hour", (), {"top_n": 3}),
+    ("get_top_instore_customer", (), {"start_date": "01-01-2016"}),
+    ("search_customers", ("example.com",), {"limit": 3, "offset": 2}),
+    ("get_top_items", (), {"start_month": "01-2016", "k": 3}),
+    ("get_distinct_customers_by_billing_zip", (), {"order": "asc"}),
+    ("get_geo_counts", (), {"level": "city", "role": "shipping", "top_n": 3}),
+]
+
+
+@pytest.mark.parametrize("name, args, kwargs", CALLS)
+def test_async_crud_matches_sync(name, args, kwargs, sync_sessions, async_sessions):
+    with sync_sessions() as db:
+        expected = getattr(crud, name)(*args, db=db, **kwargs)
+
+    async def run():
+        async with async_sessions() as db:
+            return await getattr(async_crud, name)(*args, db=db, **kwargs)
+
+    assert asyncio.run(run()) == expected
+
+
+def test_async_iter_order_history(sync_sessions, async_sessions):
+    with sync_sessions() as db:
+        customer_id = crud.find_customer_id("customer5@example.com", db)
+        expected = crud.get_order_history("customer5@example.com", db)
+
+    async def run():
+        async with async_sessions() as db:
+            orders = await async_crud.iter_order_history(customer_id, db, batch_size=4)
+            return [order async for order in orders]
+
+    assert asyncio.run(run()) == expected
+
+
+def test_async_iter_order_history_validates_eagerly(async_sessions):
+    async def run():
+        async with async_sessions() as db:
+            await async_crud.iter_order_history(1, db, after="not-a-cursor")
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_endpoints_identical_in_both_modes(sync_sessions, async_sessions):
+    def sync_db():
+        with sync_sessions() as db:
+            yield db
+
+    async def async_db():
+        async with async_sessions() as db:
+            yield db
+
+    urls = [
+        "/customer/customer5@example.com/orders",
+        "/customer/415-555-1003/orders?limit=2",
+        "/analytics/orders_by_billing_zip",
+        "/analytics/orders_by_shipping_zip?order=asc",
+        "/analytics/in_store_peak_hour?top_n=5",
+        "/analytics/top_instore_customers",
+    ]
+    client = TestClient(app)
+    responses = {}
+    try:
+        for mode, dependency in (("sync", sync_db), ("async", async_db)):
+            app.dependency_overrides[database.get_read_session] = dependency
+            responses[mode] = [client.get(url) for url in urls]
+    finally:
+        app.dependency_overrides.clear()
+
+    for sync_response, async_response in zip(responses["sync"], responses["async"]):
+        assert sync_response.status_code == async_response.status_code == 200
+        assert sync_response.json() == async_response.json()
+        assert sync_response.headers.get("X-Next-Cursor") == async_response.headers.get("X-Next-Cursor")
@@ -0,0 +1,64 @@
+from app import crud
+from app.config import settings
+from conftest import seed
+from test_crud import count_queries
+
+IDENTIFIERS = ["customer1@example.com", "415-555-1004", "nobody@example.com", "customer5@example.com", "000"]
+
+
+def test_batch_matches_single_lookups(seeded_db):
+    result = crud.get_order_histories(IDENTIFIERS, seeded_db)
+
+    assert list(result["results"]) == IDENTIFIERS
+    assert result["missing"] == ["nobody@example.com", "000"]
+    for identifier in IDENTIFIERS:
+        assert result["results"][identifier] == crud.get_order_history(identifier, seeded_db)
+
+
+def test_batch_applies_date_filters(seeded_db):
+    filters = dict(start_date="01-01-2018", end_date="12-31-2020")
+    result = crud.get_order_histories(["customer5@example.com", "415-555-1003"], seeded_db, **filters)
+
+    for identifier, history in result["results"].items():
+        assert history == crud.get_order_history(identifier, seeded_db, **filters)
+    assert all("2018" <= order["timestamp"][:4] <= "2020" for order in result["results"]["415-555-1003"])
+
+
+def test_batch_query_count_is_fixed(engine, db):
+    seed(db, num_customers=30)
+    few = ["customer1@example.com", "415-555-1002"]
+    many = [f"customer{i}@example.com" for i in range(30)] + [f"415-555-{1000 + i}" for i in range(30)] + ["x@y.z"]
+
+    counts = []
+    for identifiers in (few, many):
+        with count_queries(engine) as statements:
+            crud.get_order_histories(identifiers, db)
+        counts.append(len(statements))
+
+    assert counts == [4, 4]
+
+
+def test_same_customer_under_two_identifiers(seeded_db):
+    result = crud.get_order_histories(["customer3@example.com", "415-555-1003"], seeded_db)
+    assert result["results"]["customer3@example.com"] == result["results"]["415-555-1003"]
+    assert len(result["results"]["415-555-1003"]) == 4
+
+
+def test_batch_endpoint(client, seeded_db):
+    response = client.post("/customers/orders:batch", json={"identifiers": IDENTIFIERS})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["missing"] == ["nobody@example.com", "000"]
+    assert body["results"]["nobody@example.com"] == {"error": "Customer not found"}
+    assert len(body["results"]["customer5@example.com"]) == 6
+
+
+def test_batch_endpoint_validation(client, monkeypatch):
+    bad_date = client.post("/customers/orders:batch", json={"identifiers": ["a@b.c"], "start_date": "2020-01-01"})
+    assert bad_date.status_code == 422
+    assert client.post("/customers/orders:batch", json={"ids": []}).status_code == 422
+
+    monkeypatch.setattr("app.main.settings", settings.__class__(batch_max_identifiers=2))
+    too_many = client.post("/customers/orders:batch", json={"identifiers": ["a@b.c", "1", "2"]})
+    assert too_many.status_code == 413
@@ -0,0 +1,64 @@
+import json
+
+import benchmark
+from app import database
+
+
+def report(cases):
+    return {"meta": {}, "results": {"1000": cases}}
+
+
+def stats(p50, p95):
+    return {"p50_ms": p50, "p95_ms": p95}
+
+
+def test_percentile_is_nearest_rank():
+    samples = list(range(1, 101))
+    assert benchmark.percentile(samples, 50) == 50
+    assert benchmark.percentile(samples, 95) == 95
+    assert benchmark.percentile(samples, 99) == 99
+    assert benchmark.percentile([7], 99) == 7
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    baseline = report({"a": stats(1.0, 2.0), "b": stats(10.0, 20.0), "gone": stats(1.0, 1.0)})
+    current = report({"a": stats(1.1, 2.1), "b": stats(10.0, 30.0), "new": stats(5.0, 5.0)})
+
+    regressions = benchmark.compare(baseline, current, threshold=0.2)
+
+    assert regressions == [{
+        "size": "1000", "case": "b", "metric": "p95_ms", "baseline": 20.0, "current": 30.0, "change": 0.5,
+    }]
+
+
+def test_compare_ignores_sub_threshold_absolute_jitter():
+    baseline = report({"health": stats(0.01, 0.02)})
+    current = report({"health": stats(0.03, 0.05)})
+    assert benchmark.compare(baseline, current, threshold=0.2) == []
+
+
+def test_run_reports_statistics_and_restores_bindings(tmp_path):
+    bind = database.ReadSessionLocal.kw["bind"]
+
+    result = benchmark.run([300], str(tmp_path), iterations=3, warmup=0, selected="get_order_history")
+
+    assert database.ReadSessionLocal.kw["bind"] is bind
+    cases = result["results"]["300"]
+    assert set(cases) == {
+        "crud.get_order_history", "crud.get_order_history[limit=50]", "crud.get_order_history[year]",
+    }
+    for case in cases.values():
+        assert case["iterations"] == 3
+        assert 0 < case["p50_ms"] <= case["p95_ms"] <= case["p99_ms"]
+        assert case["throughput_per_s"] > 0
+        assert case["peak_memory_kib"] > 0
+    json.dumps(result)
+
+
+def test_main_compare_exit_status(tmp_path):
+    baseline, current = tmp_path / "baseline.json", tmp_path / "current.json"
+    baseline.write_text(json.dumps(report({"a": stats(1.0, 1.0)})))
+    current.write_text(json.dumps(report({"a": stats(2.0, 2.0)})))
+
+    assert benchmark.main(["compare", str(baseline), str(baseline)]) == 0
+    assert benchmark.main(["compare", str(baseline), str(current)]) == 1
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import budgets, crud, migrations
+from app.config import Settings
+
+# Counts to a hundred million: seconds of SQLite work with no I/O
+SLOW_QUERY = """
+    WITH RECURSIVE numbers(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM numbers LIMIT 100000000)
+    SELECT COUNT(*) FROM numbers"""
+
+
+def slow(db, **params):
+    return db.connection().exec_driver_sql(SLOW_QUERY).scalar()
+
+
+def test_time_budget_interrupts_statement(db):
+    cancelled = budgets.CANCELLED.value(route="-")
+
+    with pytest.raises(budgets.BudgetExceeded, match="50 ms") as raised:
+        with budgets.time_budget(db, 50):
+            slow(db)
+
+    assert raised.value.retry_after == 1
+    assert budgets.CANCELLED.value(route="-") == cancelled + 1
+    # The handler is gone, so the connection is usable again without a budget
+    assert db.connection().exec_driver_sql("SELECT 1").scalar() == 1
+
+
+def test_time_budget_leaves_fast_queries_and_other_errors_alone(seeded_db):
+    with budgets.time_budget(seeded_db, 5000):
+        assert crud.get_order_history("customer2@example.com", seeded_db)
+    with pytest.raises(Exception, match="no such table"):
+        with budgets.time_budget(seeded_db, 5000):
+            seeded_db.connection().exec_driver_sql("SELECT * FROM missing")
+
+    assert budgets.bounded(crud.get_order_history, 0) is crud.get_order_history
+
+
+def test_async_time_budget_interrupts_statement(tmp_path):
+    url = f"sqlite:///{tmp_path / 'pier2.db'}"
+    migrations.upgrade(create_engine(url))
+
+    async def run():
+        engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://", 1))
+        try:
+            async with async_sessionmaker(engine)() as db:
+                with pytest.raises(budgets.BudgetExceeded):
+                    async with budgets.async_time_budget(db, 50):
+                        await db.run_sync(slow)
+                return (await db.execute(text("SELECT 1"))).scalar()
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(run())
+
+
+@pytest.fixture
+def client_settings():
+    return Settings(analytics_time_budget_ms=50, history_time_budget_ms=50)
+
+
+def test_routes_over_budget_get_503(client, monkeypatch):
+    monkeypatch.setattr(crud, "get_top_instore_customer", slow)
+    monkeypatch.setattr(crud, "get_order_history", lambda email_or_phone, db, **filters: slow(db))
+    route = "/analytics/top_instore_customers"
+    cancelled = budgets.CANCELLED.value(route=route)
+
+    for url in (route, "/customer/customer2@example.com/orders"):
+        response = client.get(url)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert "time budget" in response.json()["detail"]
+    assert budgets.CANCELLED.value(route=route) == cancelled + 1
+    # Other routes are served on the same connection afterwards
+    assert client.get("/analytics/in_store_peak_hour").status_code == 200
+
+
+def test_limiter_queues_then_rejects():
+    limiter = budgets.Limiter("test", limit=1, queue_timeout_ms=100)
+    order = []
+
+    async def hold(name, seconds):
+        async with limiter.slot():
+            order.append(name)
+            await asyncio.sleep(seconds)
+
+    async def run():
+        first = asyncio.create_task(hold("first", 0.05))
+        await asyncio.sleep(0)
+        # Waits about 50 ms for the slot; the third request would wait longer than 100 ms and gives up
+        second = asyncio.create_task(hold("second", 0.2))
+        await asyncio.sleep(0)
+        third = asyncio.create_task(hold("third", 0))
+        return await asyncio.gather(first, second, third, return_exceptions=True)
+
+    queued = budgets.QUEUE_SECONDS.value(pool="test")[0]
+    results = asyncio.run(run())
+
+    assert order == ["first", "second"]
+    assert isinstance(results[2], budgets.Saturated)
+    assert budgets.REJECTED.value(pool="test") == 1
+    assert budgets.QUEUE_SECONDS.value(pool="test")[0] == queued + 2
+    assert limiter.active == 0
+    assert budgets.IN_USE.value(pool="test") == 0
+    assert budgets.WAITING.value(pool="test") == 0
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    limiter = budgets.Limiter("test-cancel", limit=1, queue_timeout_ms=1000)
+
+    async def wait_for_slot():
+        async with limiter.slot():
+            await asyncio.sleep(0)
+
+    async def run():
+        async with limiter.slot():
+            waiter = asyncio.create_task(wait_for_slot())
+            await asyncio.sleep(0)
+        # The slot was handed to the waiter; cancelling it before it runs must not leak the slot
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert limiter.active == 0
+        async with limiter.slot():
+            return limiter.active
+
+    assert asyncio.run(run()) == 1
+    assert limiter.active == 0
+
+
+def test_saturated_analytics_get_503(client, monkeypatch):
+    busy = budgets.Limiter("busy", limit=1, queue_timeout_ms=10)
+    busy.active = 1  # held by a long-running query
+    monkeypatch.setattr(budgets, "analytics_slots", busy)
+
+    response = client.get("/analytics/orders_by_billing_zip")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert budgets.REJECTED.value(pool="busy") == 1
+
+    # Cached results are served without a slot
+    busy.active = 0
+    assert client.get("/analytics/orders_by_billing_zip").status_code == 200
+    busy.active = 1
+    assert client.get("/analytics/orders_by_billing_zip").status_code == 200
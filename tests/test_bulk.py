@@ -0,0 +1,87 @@
+import json
+
+from app import crud, models, schemas
+from test_rollups import assert_zip_parity, rollup_hours, scan_instore_hours
+
+
+def address(zip_code, type="shipping"):
+    return {"street": "1 Pier Way", "city": "Oakland", "state": "CA", "zip_code": zip_code, "type": type}
+
+
+def bulk_order(email=None, phone=None, hour=9, items=2):
+    return {
+        "customer": {"first_name": "Bulk", "last_name": "Buyer", "email": email, "phone": phone},
+        "timestamp": f"2024-03-01T{hour:02d}:30:00",
+        "in_store": True,
+        "billing_address": address("94607", "billing"),
+        "items": [{"item_name": f"Item{i}", "shipping_address": address(f"9460{i}")} for i in range(items)],
+    }
+
+
+def test_bulk_json_array(client, seeded_db):
+    customers_before = seeded_db.query(models.Customer).count()
+    records = [
+        bulk_order(email="new@example.com", phone="510-555-0001"),
+        bulk_order(email="new@example.com", hour=17),  # same customer by email
+        bulk_order(phone="415-555-1000"),  # existing customer0 by phone
+        {"customer": {"email": "broken@example.com"}, "in_store": True},  # invalid record
+    ]
+    response = client.post("/orders/bulk", json=records)
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["received"], result["inserted"], result["failed"]) == (4, 3, 1)
+    assert result["errors"][0]["index"] == 3
+    assert "timestamp" in result["errors"][0]["error"]
+
+    assert seeded_db.query(models.Customer).count() == customers_before + 1
+    history = crud.get_order_history("new@example.com", seeded_db)
+    assert [order["timestamp"] for order in history] == ["2024-03-01T09:30:00", "2024-03-01T17:30:00"]
+    assert [len(order["items"]) for order in history] == [2, 2]
+    assert len(crud.get_order_history("customer0@example.com", seeded_db)) == 2
+
+
+def test_bulk_keeps_phone_only_customers_apart(client, seeded_db):
+    phones = ["510-555-0101", "510-555-0102", "510-555-0103"]
+    records = [bulk_order(phone=phone, hour=9 + i) for i, phone in enumerate(phones)]
+    records.append(bulk_order(email="email.only@example.com"))
+    response = client.post("/orders/bulk", json=records)
+
+    assert response.json()["inserted"] == 4
+    customer_ids = [crud.find_customer_id(phone, seeded_db) for phone in phones]
+    assert len(set(customer_ids)) == 3
+    for i, phone in enumerate(phones):
+        assert [order["timestamp"] for order in crud.get_order_history(phone, seeded_db)] == [
+            f"2024-03-01T{9 + i:02d}:30:00"
+        ]
+    assert len(crud.get_order_history("email.only@example.com", seeded_db)) == 1
+
+
+def test_bulk_ndjson(client, seeded_db):
+    lines = [json.dumps(bulk_order(email=f"line{i}@example.com")) for i in range(5)]
+    lines.insert(2, "{not json")
+    response = client.post(
+        "/orders/bulk", content="\n".join(lines), headers={"Content-Type": "application/x-ndjson"}
+    )
+
+    result = response.json()
+    assert (result["received"], result["inserted"], result["failed"]) == (6, 5, 1)
+    assert result["errors"][0]["index"] == 2
+    assert crud.find_customer_id("line4@example.com", seeded_db) is not None
+
+
+def test_bulk_keeps_rollups_exact(seeded_db):
+    records = [
+        (i, schemas.BulkOrder.model_validate(bulk_order(email=f"r{i % 3}@example.com", hour=i % 24, items=i % 3)))
+        for i in range(50)
+    ]
+    result = crud.ingest_orders(records, seeded_db, chunk_size=7)
+
+    assert result == {"inserted": 50, "errors": []}
+    assert rollup_hours(seeded_db) == scan_instore_hours(seeded_db)
+    assert_zip_parity(seeded_db)
+
+
+def test_bulk_rejects_non_array(client):
+    response = client.post("/orders/bulk", json={"orders": []})
+    assert response.status_code == 400
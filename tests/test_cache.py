@@ -0,0 +1,70 @@
+from datetime import datetime
+from unittest.mock import patch
+
+from app import cache, crud, models
+from conftest import make_address
+
+
+def test_lru_eviction():
+    lru = cache.ResponseCache(max_entries=2, ttl_seconds=60)
+    lru.put("a", b"1")
+    lru.put("b", b"2")
+    assert lru.get("a").body == b"1"  # "a" is now most recently used
+    lru.put("c", b"3")
+
+    assert lru.get("b") is None
+    assert lru.get("c").body == b"3"
+    assert lru.stats()["evictions"] == 1
+
+
+def test_ttl_expiry():
+    lru = cache.ResponseCache(max_entries=2, ttl_seconds=0)
+    lru.put("a", b"1")
+    assert lru.get("a") is None
+    assert lru.stats()["misses"] == 1
+
+
+def test_data_version_bumps_on_order_writes(seeded_db):
+    before = crud.get_data_version(seeded_db)
+    order = models.Order(customer_id=1, billing_address=make_address("10001"), in_store=True)
+    seeded_db.add(order)
+    seeded_db.commit()
+    assert crud.get_data_version(seeded_db) > before
+
+
+def test_analytics_served_from_cache_until_data_changes(client, seeded_db):
+    with patch("app.crud.get_orders_grouped_by_billing_zip", wraps=crud.get_orders_grouped_by_billing_zip) as spy:
+        first = client.get("/analytics/orders_by_billing_zip?order=asc")
+        second = client.get("/analytics/orders_by_billing_zip?order=asc")
+        assert spy.call_count == 1
+        assert first.json() == second.json()
+        assert first.headers["ETag"] == second.headers["ETag"]
+
+        # Different parameters are a different entry
+        client.get("/analytics/orders_by_billing_zip?order=desc")
+        assert spy.call_count == 2
+
+        seeded_db.add(models.Order(
+            customer_id=1, billing_address=make_address("99999"), timestamp=datetime(2024, 1, 1), in_store=False
+        ))
+        seeded_db.commit()
+
+        third = client.get("/analytics/orders_by_billing_zip?order=asc")
+        assert spy.call_count == 3
+        assert {"zip_code": "99999", "order_count": 1} in third.json()
+
+    stats = client.get("/cache/stats").json()
+    assert (stats["hits"], stats["misses"]) == (1, 3)
+
+
+def test_etag_revalidation(client):
+    response = client.get("/analytics/in_store_peak_hour?top_n=3")
+    etag = response.headers["ETag"]
+
+    revalidated = client.get("/analytics/in_store_peak_hour?top_n=3", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+    stale = client.get("/analytics/in_store_peak_hour?top_n=3", headers={"If-None-Match": '"stale"'})
+    assert stale.status_code == 200
+    assert stale.json() == response.json()
@@ -0,0 +1,177 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+pytest.importorskip("numpy")
+
+from app import columnar, crud, database, main, migrations, models
+from app.config import Settings
+from app.main import app
+from conftest import make_address, seed
+from test_rollups import RANGES, seed_random_orders
+
+
+@pytest.fixture(autouse=True)
+def snapshot(monkeypatch):
+    """A fresh process-wide snapshot per test, since every test has its own database."""
+    snapshot = columnar.Snapshot()
+    monkeypatch.setattr(columnar, "_snapshot", snapshot)
+    return snapshot
+
+
+def assert_parity(db):
+    for order in ("asc", "desc"):
+        for name in ("get_orders_grouped_by_billing_zip", "get_orders_grouped_by_shipping_zip"):
+            assert getattr(columnar, name)(db, order=order) == getattr(crud, name)(db, order=order), (name, order)
+    for start_date, end_date in RANGES:
+        dates = {"start_date": start_date, "end_date": end_date}
+        for top_n in (1, 3, 24):
+            assert columnar.get_peak_instore_purchase_hour(db, **dates, top_n=top_n) == (
+                crud.get_peak_instore_purchase_hour(db, **dates, top_n=top_n)
+            ), (dates, top_n)
+        for k in (1, 5, 12):
+            assert columnar.get_top_instore_customer(db, **dates, k=k) == (
+                crud.get_top_instore_customer(db, **dates, k=k)
+            ), (dates, k)
+
+
+def test_matches_sql_on_seed(seeded_db):
+    assert_parity(seeded_db)
+
+
+def test_matches_sql_on_random_orders(db):
+    seed_random_orders(db)
+    assert_parity(db)
+
+
+def test_orders_without_address_timestamp_or_customer(seeded_db):
+    seeded_db.add_all([
+        models.Order(timestamp=datetime(2020, 5, 1, 9), in_store=True),
+        models.Order(customer_id=1, in_store=True, billing_address=make_address(None, "billing")),
+        models.Order(customer_id=2, timestamp=datetime(2020, 5, 1, 9), in_store=True, billing_address_id=10 ** 6),
+    ])
+    seeded_db.commit()
+
+    assert_parity(seeded_db)
+
+
+def test_appends_refresh_incrementally(snapshot, db):
+    seed(db)
+    assert_parity(db)
+    assert snapshot.reloads == 1
+
+    for i in range(3):
+        db.add(models.Customer(email=f"new{i}@example.com"))
+    customer = db.query(models.Customer).first()
+    for hour in range(5):
+        order = models.Order(
+            customer=customer, timestamp=datetime(2016, 1, 1, hour), in_store=True,
+            billing_address=make_address("73301", "billing"),
+        )
+        db.add_all([order, models.OrderItem(order=order, item_name="Lamp", shipping_address=make_address("73301"))])
+    db.commit()
+    assert_parity(db)
+    assert snapshot.reloads == 1
+    assert len(snapshot.columns.order_ids) == db.query(models.Order).count()
+
+
+@pytest.mark.parametrize("write", ["update", "delete"])
+def test_other_writes_reload(snapshot, seeded_db, write):
+    assert_parity(seeded_db)
+    order = seeded_db.query(models.Order).filter(models.Order.in_store == True).first()
+    if write == "update":
+        order.in_store = False
+    else:
+        seeded_db.delete(order)
+    seeded_db.commit()
+
+    assert_parity(seeded_db)
+    assert snapshot.reloads == 2
+
+
+def test_unchanged_database_reuses_columns(snapshot, seeded_db):
+    columns = snapshot.refresh(seeded_db)
+    assert snapshot.refresh(seeded_db) is columns
+    assert columns.nbytes > 0
+
+
+def test_rejects_bad_dates(seeded_db):
+    with pytest.raises(ValueError, match="MM-DD-YYYY"):
+        columnar.get_top_instore_customer(seeded_db, start_date="2020-01-01")
+    with pytest.raises(ValueError, match="MM-DD-YYYY"):
+        columnar.get_peak_instore_purchase_hour(seeded_db, end_date="13-45-2020")
+
+
+def test_endpoints_served_from_snapshot(snapshot, seeded_db, monkeypatch):
+    monkeypatch.setattr(main, "settings", Settings(analytics_engine="columnar"))
+    app.dependency_overrides[database.get_read_session] = lambda: seeded_db
+    try:
+        client = TestClient(app)
+        responses = {
+            "get_orders_grouped_by_billing_zip": client.get("/analytics/orders_by_billing_zip?order=asc"),
+            "get_orders_grouped_by_shipping_zip": client.get("/analytics/orders_by_shipping_zip"),
+            "get_peak_instore_purchase_hour": client.get("/analytics/in_store_peak_hour?top_n=3"),
+            "get_top_instore_customer": client.get("/analytics/top_instore_customers?start_date=01-01-2016&k=3"),
+        }
+        bad_date = client.get("/analytics/top_instore_customers?start_date=2016-01-01")
+    finally:
+        app.dependency_overrides.clear()
+
+    params = {
+        "get_orders_grouped_by_billing_zip": {"order": "asc"},
+        "get_peak_instore_purchase_hour": {"top_n": 3},
+        "get_top_instore_customer": {"start_date": "01-01-2016", "k": 3},
+    }
+    for name, response in responses.items():
+        assert response.status_code == 200
+        assert response.json() == getattr(crud, name)(seeded_db, **params.get(name, {})), name
+    assert snapshot.reloads == 1
+    assert bad_date.status_code == 422
+
+
+def test_async_sessions_read_through_run_sync(tmp_path, snapshot):
+    url = f"sqlite:///{tmp_path / 'pier2.db'}"
+    engine = create_engine(url)
+    migrations.upgrade(engine)
+    with sessionmaker(bind=engine)() as db:
+        seed(db)
+        expected = crud.get_top_instore_customer(db, k=3)
+    engine.dispose()
+
+    async def run():
+        async_engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://", 1))
+        try:
+            async with async_sessionmaker(async_engine)() as db:
+                return await db.run_sync(lambda session: columnar.get_top_instore_customer(session, k=3))
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(run()) == expected
+
+
+def test_reload_runs_outside_the_time_budget(snapshot, seeded_db, monkeypatch):
+    monkeypatch.setattr(main, "settings", Settings(analytics_engine="columnar", analytics_time_budget_ms=50))
+    fetch = columnar._fetch
+
+    def slow_fetch(conn, *args, **kwargs):
+        # Stands in for the full reload of a large database, well over the budget
+        conn.exec_driver_sql(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n LIMIT 1000000) SELECT COUNT(*) FROM n"
+        ).scalar()
+        return fetch(conn, *args, **kwargs)
+
+    monkeypatch.setattr(columnar, "_fetch", slow_fetch)
+    app.dependency_overrides[database.get_read_session] = lambda: seeded_db
+    try:
+        response = TestClient(app).get("/analytics/top_instore_customers?k=3")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.json() == crud.get_top_instore_customer(seeded_db, k=3)
+    assert snapshot.columns.version is not None
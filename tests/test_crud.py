@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import crud
+
+
+@contextmanager
+def count_queries(engine):
+    """Collect every SQL statement executed on `engine` inside the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_order_history_contents(seeded_db):
+    history = crud.get_order_history("customer2@example.com", seeded_db)
+
+    assert len(history) == 3
+    assert [len(order["items"]) for order in history] == [1, 2, 3]
+    assert history[0]["billing_address"]["zip_code"] == "60614"
+    assert history[0]["items"][0]["shipping_address"]["country"] == "USA"
+
+
+def test_order_history_lookup_by_phone(seeded_db):
+    by_phone = crud.get_order_history("415-555-1003", seeded_db)
+    by_email = crud.get_order_history("customer3@example.com", seeded_db)
+
+    assert by_phone == by_email
+
+
+def test_order_history_unknown_customer(seeded_db):
+    assert crud.get_order_history("nobody@example.com", seeded_db) == {"error": "Customer not found"}
+
+
+def test_order_history_query_count_is_fixed(engine, seeded_db):
+    # Customer lookup, orders with billing addresses, items with shipping addresses
+    for identifier in ("customer0@example.com", "customer5@example.com"):
+        seeded_db.expire_all()
+        with count_queries(engine) as statements:
+            crud.get_order_history(identifier, seeded_db)
+        assert len(statements) == 3
+
+
+def test_order_history_keyset_pages(seeded_db):
+    full = crud.get_order_history("customer5@example.com", seeded_db)
+    timestamps = [order["timestamp"] for order in full]
+    assert timestamps == sorted(timestamps)
+
+    pages, cursor = [], None
+    while True:
+        page = crud.get_order_history("customer5@example.com", seeded_db, limit=4, after=cursor)
+        if not page:
+            break
+        pages.extend(page)
+        cursor = crud.encode_cursor(page[-1])
+    assert pages == full
+
+    before = crud.get_order_history(
+        "customer5@example.com", seeded_db, limit=2, before=crud.encode_cursor(full[-1])
+    )
+    assert before == full[-3:-1]
+
+
+def test_order_history_date_range(seeded_db):
+    history = crud.get_order_history(
+        "customer5@example.com", seeded_db, start_date="01-01-2020", end_date="12-31-2022"
+    )
+    assert [order["timestamp"][:4] for order in history] == ["2020", "2021", "2022"]
+
+
+def test_order_history_rejects_bad_cursor(seeded_db):
+    with pytest.raises(ValueError):
+        crud.get_order_history("customer5@example.com", seeded_db, limit=2, after="not-a-cursor")
+
+
+def test_iter_order_history_matches_full_history(seeded_db):
+    customer_id = crud.find_customer_id("customer5@example.com", seeded_db)
+    streamed = list(crud.iter_order_history(customer_id, seeded_db, batch_size=4))
+    assert streamed == crud.get_order_history("customer5@example.com", seeded_db)
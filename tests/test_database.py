@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import migrations
+from app.config import Settings
+from app.database import create_sqlite_engine
+
+
+@pytest.fixture
+def config(tmp_path):
+    return Settings(database_url=f"sqlite:///{tmp_path / 'pier2.db'}", sqlite_busy_timeout_ms=1234)
+
+
+def pragma(engine, name):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def test_settings_from_env():
+    settings = Settings.from_env({
+        "PIER2_DB_MODE": "async",
+        "PIER2_SQLITE_CACHE_SIZE_KIB": "2048",
+        "PIER2_DB_READ_POOL_SIZE": "32",
+    })
+    assert settings.db_mode == "async"
+    assert settings.sqlite_cache_size_kib == 2048
+    assert settings.db_read_pool_size == 32
+    assert settings.sqlite_journal_mode == Settings.sqlite_journal_mode
+
+
+def test_settings_reject_unknown_mode():
+    with pytest.raises(ValueError):
+        Settings.from_env({"PIER2_DB_MODE": "threads"})
+
+
+def test_write_engine_profile(config):
+    engine = create_sqlite_engine(config)
+    assert pragma(engine, "journal_mode") == "wal"
+    assert pragma(engine, "synchronous") == 1  # NORMAL
+    assert pragma(engine, "busy_timeout") == 1234
+    assert pragma(engine, "cache_size") == -config.sqlite_cache_size_kib
+    assert engine.pool.size() == config.db_pool_size
+    engine.dispose()
+
+
+def test_read_engine_rejects_writes(config):
+    engine = create_sqlite_engine(config)
+    migrations.upgrade(engine)
+    read_engine = create_sqlite_engine(config, read_only=True)
+
+    assert pragma(read_engine, "query_only") == 1
+    assert read_engine.pool.size() == config.db_read_pool_size
+    with pytest.raises(OperationalError):
+        with read_engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO customers (email) VALUES ('x@example.com')")
+
+    engine.dispose()
+    read_engine.dispose()
@@ -8,12 +8,21 @@ import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 
+from app import database
 from app.main import app
 
 # Create a FastAPI test client to simulate HTTP requests
 client = TestClient(app)
 
 
+# crud is mocked, but the analytics cache still reads the data version, so sessions come from an in-memory database
+@pytest.fixture(autouse=True)
+def migrated_db(db):
+    app.dependency_overrides[database.get_read_session] = lambda: db
+    yield
+    app.dependency_overrides.clear()
+
+
 # Mocking the `crud.get_order_history` function to return fake order data
 @patch("app.crud.get_order_history")
 def test_get_order_history(mock_get_order_history):
@@ -36,6 +45,38 @@ def test_get_order_history(mock_get_order_history):
     assert len(response.json()) == 1
 
 
+# Paged requests expose keyset cursors in response headers
+@patch("app.crud.get_order_history")
+def test_get_order_history_page_cursors(mock_get_order_history):
+    mock_get_order_history.return_value = [
+        {"order_id": 7, "timestamp": "2025-06-17T15:00:00", "in_store": True, "billing_address": {}, "items": []}
+    ]
+    response = client.get("/customer/johndoe@gmail.com/orders?limit=1")
+    assert response.status_code == 200
+    assert response.headers["X-Next-Cursor"]
+    assert mock_get_order_history.call_args.kwargs["limit"] == 1
+
+
+# Malformed cursors are rejected as a validation error
+@patch("app.crud.get_order_history")
+def test_get_order_history_bad_cursor(mock_get_order_history):
+    mock_get_order_history.side_effect = ValueError("Invalid cursor 'x'")
+    response = client.get("/customer/johndoe@gmail.com/orders?limit=1&after=x")
+    assert response.status_code == 422
+
+
+# NDJSON mode streams one order per line
+@patch("app.crud.iter_order_history")
+@patch("app.crud.find_customer_id")
+def test_get_order_history_ndjson(mock_find_customer_id, mock_iter_order_history):
+    mock_find_customer_id.return_value = 1
+    mock_iter_order_history.side_effect = lambda *args, **kwargs: iter([{"order_id": 1}, {"order_id": 2}])
+    response = client.get("/customer/johndoe@gmail.com/orders?format=ndjson")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text.splitlines() == ['{"order_id": 1}', '{"order_id": 2}']
+
+
 # Mocks total count of orders grouped by billing zip code
 @patch("app.crud.get_orders_grouped_by_billing_zip")
 def test_orders_by_billing_zip(mock_func):
@@ -79,3 +120,20 @@ def test_top_instore_customer(mock_func):
     assert response.status_code == 200
     assert len(response.json()) == 1
     assert response.json()[0]["in_store_count"] == 5
+
+
+# Forwards k and the dates to crud, and rejects malformed dates and out-of-range k
+@patch("app.crud.get_top_instore_customer")
+def test_top_instore_customer_parameters(mock_func):
+    mock_func.return_value = []
+    response = client.get("/analytics/top_instore_customers?start_date=01-01-2020&end_date=12-31-2020&k=20")
+    assert response.status_code == 200
+    mock_func.assert_called_once()
+    assert {name: mock_func.call_args.kwargs[name] for name in ("start_date", "end_date", "k")} == {
+        "start_date": "01-01-2020", "end_date": "12-31-2020", "k": 20
+    }
+
+    mock_func.side_effect = ValueError("Invalid date '2020-01-01', expected MM-DD-YYYY")
+    assert client.get("/analytics/top_instore_customers?start_date=2020-01-01").status_code == 422
+    assert client.get("/analytics/top_instore_customers?k=0").status_code == 422
+    assert client.get("/analytics/top_instore_customers?k=101").status_code == 422
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import generate_data
+from app import crud, models
+from conftest import make_address
+from test_rollups import assert_zip_parity, rollup_hours, scan_instore_hours
+
+
+def table_rows(path, table):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"SELECT * FROM {table} ORDER BY 1").all()
+    engine.dispose()
+    return rows
+
+
+@pytest.mark.parametrize("value, expected", [("1500", 1500), ("10K", 10_000), ("2.5m", 2_500_000)])
+def test_parse_count(value, expected):
+    assert generate_data.parse_count(value) == expected
+
+
+def test_generate_is_reproducible(tmp_path):
+    first = generate_data.generate(str(tmp_path / "a.db"), 500, seed=3)
+    second = generate_data.generate(str(tmp_path / "b.db"), 500, seed=3)
+
+    assert first["orders"] == 500
+    assert first["customers"] == 200
+    for table in ("customers", "addresses", "orders", "order_items"):
+        assert table_rows(tmp_path / "a.db", table) == table_rows(tmp_path / "b.db", table)
+
+
+def test_generated_database_is_fully_maintained(tmp_path):
+    path = tmp_path / "generated.db"
+    generate_data.generate(str(path), 2000, seed=11, zip_codes=20, in_store_ratio=0.8)
+
+    engine = create_engine(f"sqlite:///{path}")
+    db = sessionmaker(bind=engine)()
+    in_store = db.query(models.Order).filter(models.Order.in_store == True).count()
+    assert 0.75 < in_store / 2000 < 0.85
+    assert rollup_hours(db) == scan_instore_hours(db)
+    assert_zip_parity(db)
+    assert crud.search_customers("example.com", db, limit=5)["results"]
+
+    # Triggers were recreated after the load
+    db.add(models.Order(
+        customer_id=1, billing_address=make_address("00001"), timestamp=datetime(2020, 1, 1, 3), in_store=True
+    ))
+    db.commit()
+    assert rollup_hours(db) == scan_instore_hours(db)
+    assert_zip_parity(db)
+    db.close()
+    engine.dispose()
@@ -0,0 +1,148 @@
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, database, models, rollups
+from app.main import app
+
+LOCATIONS = [
+    ("USA", "CA", "Oakland", "94607"),
+    ("USA", "CA", "Oakland", "94612"),
+    ("USA", "CA", "Fresno", "93650"),
+    ("USA", "NY", "Buffalo", "14201"),
+    ("Canada", "ON", "Toronto", "M5V"),
+]
+
+
+def address(location, type):
+    country, state, city, zip_code = location
+    return models.Address(type=type, street="1 Pier Way", city=city, state=state, zip_code=zip_code, country=country)
+
+
+@pytest.fixture
+def geo_db(db):
+    """Orders billed and shipped across five locations, two channels and two years."""
+    for i in range(40):
+        db.add(models.Order(
+            billing_address=address(LOCATIONS[i % 5], "billing"),
+            timestamp=datetime(2023 + i % 2, i % 12 + 1, 1 + i % 28),
+            in_store=i % 3 == 0,
+            items=[models.OrderItem(item_name="Chair", shipping_address=address(LOCATIONS[(i + k) % 5], "shipping"))
+                   for k in range(i % 3 + 1)],
+        ))
+    db.commit()
+    return db
+
+
+def scan(db, role, level, in_store=None, start=None, end=None, **filters):
+    """Reference counts from the fact tables: orders per billing, items per shipping location."""
+    path = rollups.GEO_LEVELS[:rollups.GEO_LEVELS.index(level) + 1]
+    counts = Counter()
+    for order in db.query(models.Order).filter(models.Order.timestamp.isnot(None)):
+        month = order.timestamp.strftime("%Y-%m")
+        if in_store is not None and bool(order.in_store) != in_store or not (start or "") <= month <= (end or "9"):
+            continue
+        addresses = [order.billing_address] if role == "billing" else [item.shipping_address for item in order.items]
+        for location in filter(None, addresses):
+            if all(getattr(location, name) == value for name, value in filters.items()):
+                counts[tuple(getattr(location, name) or "" for name in path)] += 1
+    return counts
+
+
+def counts(result, level):
+    path = rollups.GEO_LEVELS[:rollups.GEO_LEVELS.index(level) + 1]
+    return Counter({tuple(group[name] for name in path): group["order_count"] for group in result["groups"]})
+
+
+SLICES = [
+    {},
+    {"in_store": True},
+    {"in_store": False, "start_month": "03-2023", "end_month": "02-2024"},
+    {"country": "USA", "state": "CA"},
+    {"city": "Oakland", "start_month": "07-2024"},
+    {"state": "CA", "start_month": "01-2023", "end_month": "12-2023"},
+]
+
+
+def assert_cube_matches_scan(db):
+    for role in crud.GEO_ROLLUPS:
+        for level in rollups.GEO_LEVELS:
+            for params in SLICES:
+                months = [params.get(key) and crud.parse_month(params[key]) for key in ("start_month", "end_month")]
+                filters = {key: value for key, value in params.items() if key in ("country", "state", "city")}
+                expected = scan(db, role, level, params.get("in_store"), *months, **filters)
+                result = crud.get_geo_counts(db, level=level, role=role, **params)
+                assert counts(result, level) == expected, (role, level, params)
+                assert result["total"] == sum(expected.values())
+
+
+def test_cube_matches_ad_hoc_queries(geo_db):
+    assert_cube_matches_scan(geo_db)
+
+
+def test_cube_tracks_writes(geo_db):
+    orders = geo_db.query(models.Order).order_by(models.Order.id).all()
+
+    # Re-point an order and an item, move an order in time and channel, relocate an address, delete an order
+    orders[0].billing_address = address(("USA", "TX", "Austin", "73301"), "billing")
+    orders[1].items[0].shipping_address = orders[2].billing_address
+    orders[3].timestamp, orders[3].in_store = datetime(2022, 5, 5), not orders[3].in_store
+    orders[4].billing_address.city = "Berkeley"
+    orders[5].items[0].shipping_address.state = None
+    for item in orders[6].items:
+        geo_db.delete(item)
+    geo_db.delete(orders[6])
+    geo_db.commit()
+    assert_cube_matches_scan(geo_db)
+
+    expected = {name: geo_db.connection().exec_driver_sql(f"SELECT * FROM {name} ORDER BY 1, 2, 3, 4, 5, 6, 7").all()
+                for name in ("billing_geo_counts", "shipping_geo_counts")}
+    rollups.rebuild(geo_db.connection(), list(expected))
+    for name, rows in expected.items():
+        assert geo_db.connection().exec_driver_sql(f"SELECT * FROM {name} ORDER BY 1, 2, 3, 4, 5, 6, 7").all() == rows
+
+
+def test_drill_down_sorts_and_limits(geo_db):
+    # 40 orders, 8 per location
+    assert crud.get_geo_counts(geo_db, level="country") == {
+        "groups": [{"country": "USA", "order_count": 32}, {"country": "Canada", "order_count": 8}], "total": 40,
+    }
+    assert crud.get_geo_counts(geo_db, level="city", country="USA", state="CA", sort="name", order="asc") == {
+        "groups": [{"country": "USA", "state": "CA", "city": "Fresno", "order_count": 8},
+                   {"country": "USA", "state": "CA", "city": "Oakland", "order_count": 16}],
+        "total": 24,
+    }
+    assert crud.get_geo_counts(geo_db, start_month="01-2030") == {"groups": [], "total": 0}
+    top = crud.get_geo_counts(geo_db, level="zip_code", role="shipping", top_n=2)
+    assert len(top["groups"]) == 2 and top["total"] == geo_db.query(models.OrderItem).count()
+    assert [group["order_count"] for group in top["groups"]] == sorted(
+        counts(crud.get_geo_counts(geo_db, level="zip_code", role="shipping"), "zip_code").values(), reverse=True
+    )[:2]
+    # Ties go to the location (country first) in either order
+    ascending = crud.get_geo_counts(geo_db, level="zip_code", order="asc")["groups"]
+    assert [group["zip_code"] for group in ascending] == ["M5V", "93650", "94607", "94612", "14201"]
+
+
+def test_rejects_bad_parameters(geo_db):
+    for params in ({"level": "street"}, {"role": "home"}, {"sort": "zip"}, {"start_month": "2024-01"},
+                   {"start_month": "05-2024", "end_month": "04-2024"}):
+        with pytest.raises(ValueError):
+            crud.get_geo_counts(geo_db, **params)
+
+
+def test_geo_endpoint(geo_db):
+    app.dependency_overrides[database.get_read_session] = lambda: geo_db
+    try:
+        client = TestClient(app)
+        states = client.get("/analytics/geo", params={"level": "state", "country": "USA", "in_store": "false",
+                                                       "top_n": 1})
+        invalid = client.get("/analytics/geo", params={"level": "street"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert states.status_code == 200
+    assert states.json() == crud.get_geo_counts(geo_db, level="state", country="USA", in_store=False, top_n=1)
+    assert states.json()["groups"][0]["state"] == "CA"
+    assert invalid.status_code == 422
@@ -0,0 +1,161 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app import crud, database, identifiers, migrations, models, schemas
+from app.main import app
+from test_crud import count_queries
+
+
+@pytest.mark.parametrize("phone", [
+    "415-555-1000", "(415) 555 1000", "+14155551000", "+1 415.555.1000", "1-415-555-1000", "001 415 555 1000",
+    " 4155551000 ",
+])
+def test_phone_formats_share_one_key(phone):
+    assert identifiers.normalize_phone(phone) == "+14155551000"
+
+
+def test_phone_keys_keep_extensions_and_international_numbers():
+    assert identifiers.normalize_phone("415-555-1000x42") == "+14155551000x42"
+    assert identifiers.normalize_phone("415-555-1000 ext. 42") == "+14155551000x42"
+    assert identifiers.normalize_phone("+44 20 7946 0958") == "+442079460958"
+    assert identifiers.normalize_phone("n/a") is None
+
+
+def test_email_keys_ignore_case_and_spacing():
+    assert identifiers.normalize_email(" Customer1@Example.COM ") == "customer1@example.com"
+    assert identifiers.normalize_email("  ") is None
+
+
+def test_inserts_set_keys(seeded_db):
+    customer = seeded_db.query(models.Customer).filter_by(email="customer2@example.com").one()
+    assert (customer.email_key, customer.phone_key) == ("customer2@example.com", "+14155551002")
+
+
+@pytest.mark.parametrize("identifier", [
+    "customer3@example.com", "CUSTOMER3@Example.com", "415-555-1003", "(415) 555-1003", "+14155551003",
+])
+def test_any_format_resolves_in_one_probe(engine, seeded_db, identifier):
+    expected = crud.find_customer_id("customer3@example.com", seeded_db)
+
+    with count_queries(engine) as statements:
+        assert crud.find_customer_id(identifier, seeded_db) == expected
+    assert len(statements) == 1
+    assert crud.get_order_history(identifier, seeded_db) == crud.get_order_history("415-555-1003", seeded_db)
+
+
+def test_lookup_uses_unique_key_index(seeded_db):
+    for column in ("email_key", "phone_key"):
+        plan = seeded_db.connection().exec_driver_sql(
+            f"EXPLAIN QUERY PLAN SELECT id FROM customers WHERE {column} = ?", ("x",)
+        ).all()
+        assert f"INDEX ux_customers_{column} ({column}=?)" in plan[0][-1]
+
+
+def test_unparseable_identifiers_do_not_match(seeded_db):
+    assert crud.find_customer_id("no digits", seeded_db) is None
+    assert crud.get_order_histories(["no digits", "415 555 1001"], seeded_db)["missing"] == ["no digits"]
+
+
+def test_unique_index_rejects_formatting_duplicates(seeded_db):
+    seeded_db.add(models.Customer(email="other@example.com", phone="(415) 555-1000"))
+    with pytest.raises(Exception, match="UNIQUE"):
+        seeded_db.commit()
+
+
+def test_bulk_ingest_deduplicates_formatting_variants(seeded_db):
+    customers_before = seeded_db.query(models.Customer).count()
+    records = [
+        {"customer": {"phone": "+1 (415) 555-1000"}},
+        {"customer": {"email": "CUSTOMER1@EXAMPLE.COM"}},
+        {"customer": {"email": "New@Example.com", "phone": "212 555 0000"}},
+        {"customer": {"email": "new@example.com"}},
+        {"customer": {"phone": "+12125550000"}},
+    ]
+    address = {"type": "billing", "street": "1 Main St", "city": "Austin", "state": "TX", "zip_code": "73301"}
+    payload = [
+        (i, schemas.BulkOrder.model_validate({
+            **record, "timestamp": "2024-01-01T10:00:00", "in_store": True, "billing_address": address,
+            "items": [{"item_name": "Lamp", "shipping_address": {**address, "type": "shipping"}}],
+        }))
+        for i, record in enumerate(records)
+    ]
+
+    assert crud.ingest_orders(payload, seeded_db) == {"inserted": 5, "errors": []}
+    assert seeded_db.query(models.Customer).count() == customers_before + 1
+    assert len(crud.get_order_history("415-555-1000", seeded_db)) == 2
+    assert len(crud.get_order_history("customer1@example.com", seeded_db)) == 3
+    assert len(crud.get_order_history("new@example.com", seeded_db)) == 3
+
+
+def test_group_committed_orders_resolve_phone_only_customers_by_their_own_phone(seeded_db):
+    # The group-commit writer inserts many single orders through one create_orders call
+    address = {"type": "billing", "street": "1 Main St", "city": "Austin", "state": "TX", "zip_code": "73301"}
+
+    def order(phone):
+        return schemas.BulkOrder.model_validate({
+            "customer": {"phone": phone}, "timestamp": "2024-01-01T10:00:00", "in_store": False,
+            "billing_address": address, "items": [],
+        })
+
+    crud.create_orders([order("(510) 555-0201")], seeded_db)
+    crud.create_orders([order("+1 510 555 0201"), order("510.555.0202"), order("510-555-0203")], seeded_db)
+
+    assert len(crud.get_order_history("5105550201", seeded_db)) == 2
+    assert len(crud.get_order_history("5105550202", seeded_db)) == 1
+    assert len(crud.get_order_history("5105550203", seeded_db)) == 1
+
+
+def test_customer_without_usable_identifier_is_rejected():
+    with pytest.raises(ValueError, match="email or a phone"):
+        schemas.CustomerIdentity(phone="unknown")
+
+
+def test_endpoint_accepts_formatted_phone(seeded_db):
+    app.dependency_overrides[database.get_read_session] = lambda: seeded_db
+    try:
+        response = TestClient(app).get("/customer/(415) 555-1002/orders")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+
+
+def test_upgrade_backfills_and_merges_existing_customers():
+    # A database from before lookup keys: no key columns, one customer stored in two formats
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    migrations.upgrade(engine)
+    with engine.begin() as conn:
+        for column in ("email_key", "phone_key"):
+            conn.exec_driver_sql(f"DROP INDEX ux_customers_{column}")
+            conn.exec_driver_sql(f"ALTER TABLE customers DROP COLUMN {column}")
+        version = migrations.MIGRATIONS.index(migrations._customer_lookup_keys)
+        conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+    with Session(bind=engine) as db:
+        db.connection().exec_driver_sql("INSERT INTO customers (id, email, phone) VALUES (?, ?, ?)", [
+            (1, "Ann@Example.com", None),
+            (2, "ann@example.com", "415-555-0100"),
+            (3, None, "(415) 555-0100"),
+            (4, "bob@example.com", "415-555-0200"),
+        ])
+        for i, customer_id in enumerate((1, 2, 3, 4, 4), start=1):
+            db.execute(models.Order.__table__.insert().values(
+                id=i, customer_id=customer_id, timestamp=datetime(2020, 1, i), in_store=False
+            ))
+        db.commit()
+
+        migrations.upgrade(engine)
+
+        assert db.query(models.Customer.id, models.Customer.email, models.Customer.phone,
+                        models.Customer.email_key, models.Customer.phone_key).order_by(models.Customer.id).all() == [
+            (1, "Ann@Example.com", "415-555-0100", "ann@example.com", "+14155550100"),
+            (4, "bob@example.com", "415-555-0200", "bob@example.com", "+14155550200"),
+        ]
+        assert [order.customer_id for order in db.query(models.Order).order_by(models.Order.id)] == [1, 1, 1, 4, 4]
+        assert len(crud.get_order_history("+1 415 555 0100", db)) == 3
+    engine.dispose()
@@ -0,0 +1,94 @@
+import re
+
+from fastapi.testclient import TestClient
+
+from app import database, metrics
+from app.main import app
+from test_async import async_sessions, db_url, sync_sessions  # noqa: F401 (fixtures)
+
+HISTORY_ROUTE = "/customer/{email_or_phone}/orders"
+
+
+def server_timing_queries(response):
+    return int(re.search(r'desc="(\d+) queries"', response.headers["server-timing"]).group(1))
+
+
+def test_histogram_exposition():
+    histogram = metrics.Histogram("test_latency_seconds", "Test.", ("route",), buckets=(0.1, 1))
+    try:
+        histogram.observe(0.05, route="/a")
+        histogram.observe(0.1, route="/a")
+        histogram.observe(3, route="/a")
+        lines = metrics.render().splitlines()
+    finally:
+        metrics.REGISTRY.remove(histogram)
+
+    start = lines.index("# TYPE test_latency_seconds histogram")
+    assert lines[start + 1:start + 6] == [
+        'test_latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'test_latency_seconds_bucket{route="/a",le="1"} 2',
+        'test_latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'test_latency_seconds_sum{route="/a"} 3.15',
+        'test_latency_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    assert metrics._format_labels(("q",), ('say "hi"\\\n',)) == '{q="say \\"hi\\"\\\\\\n"}'
+
+
+def test_server_timing_counts_request_statements(client):
+    single_query = client.get("/customer/customer3@example.com/orders")
+    assert single_query.status_code == 200
+    # Customer lookup, orders and items
+    assert server_timing_queries(single_query) == 3
+    assert re.search(r"db;dur=[\d.]+", single_query.headers["server-timing"])
+
+    assert server_timing_queries(client.get("/health")) == 0
+
+
+def test_metrics_endpoint_reports_routes_and_sql(client):
+    requests_before = metrics.REQUESTS.value(method="GET", route=HISTORY_ROUTE, status="200")
+    statements_before = metrics.DB_STATEMENTS.value(route=HISTORY_ROUTE)
+    count_before, _ = metrics.REQUEST_SECONDS.value(method="GET", route=HISTORY_ROUTE)
+
+    client.get("/customer/customer3@example.com/orders")
+    client.get("/customer/415-555-1002/orders?limit=1")
+    client.get("/analytics/orders_by_billing_zip")
+    client.get("/does/not/exist")
+
+    assert metrics.REQUESTS.value(method="GET", route=HISTORY_ROUTE, status="200") == requests_before + 2
+    assert metrics.DB_STATEMENTS.value(route=HISTORY_ROUTE) == statements_before + 6
+    assert metrics.REQUEST_SECONDS.value(method="GET", route=HISTORY_ROUTE)[0] == count_before + 2
+    assert metrics.IN_FLIGHT.value(method="GET", route=HISTORY_ROUTE) == 0
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert "# TYPE pier2_http_request_duration_seconds histogram" in body
+    assert 'pier2_http_requests_total{method="GET",route="unmatched",status="404"}' in body
+    assert 'pier2_http_requests_in_flight{method="GET",route="/metrics"} 1' in body
+    assert "pier2_analytics_cache_misses_total 1" in body
+    assert "pier2_analytics_cache_entries 1" in body
+
+
+def test_async_sessions_are_instrumented(sync_sessions, async_sessions):  # noqa: F811
+    def sync_db():
+        with sync_sessions() as db:
+            yield db
+
+    async def async_db():
+        async with async_sessions() as db:
+            yield db
+
+    client = TestClient(app)
+    counts = {}
+    try:
+        for mode, dependency in (("sync", sync_db), ("async", async_db)):
+            app.dependency_overrides[database.get_read_session] = dependency
+            counts[mode] = server_timing_queries(client.get("/customer/customer5@example.com/orders"))
+    finally:
+        app.dependency_overrides.clear()
+
+    assert counts["async"] == counts["sync"] == 3
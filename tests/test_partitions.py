@@ -0,0 +1,229 @@
+import os
+import stat
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, database, migrations, models, partitions, rollups, schemas, sketches
+from app.config import Settings
+from conftest import seed
+from test_crud import count_queries
+
+ANALYTICS = [
+    ("get_orders_grouped_by_billing_zip", {}),
+    ("get_orders_grouped_by_shipping_zip", {"order": "asc"}),
+    ("get_peak_instore_purchase_hour", {"top_n": 24}),
+    ("get_peak_instore_purchase_hour", {"start_date": "01-01-2016", "end_date": "12-31-2017"}),
+    ("get_top_instore_customer", {"k": 20}),
+    ("get_top_instore_customer", {"start_date": "06-01-2016", "end_date": "03-31-2021", "k": 20}),
+    ("get_geo_counts", {"level": "zip_code", "role": "shipping", "start_month": "06-2016", "in_store": True}),
+]
+# Exact answers read every partition; estimates come from sketches archiving leaves alone
+SKETCH_ANALYTICS = [
+    ("get_top_items", {}),
+    ("get_top_items", {"start_month": "06-2016", "end_month": "03-2021", "zip_code": "10001"}),
+    ("get_distinct_customers_by_billing_zip", {"start_month": "01-2017"}),
+]
+DATE_RANGES = [(None, None), ("01-01-2016", None), (None, "06-30-2018"), ("03-01-2017", "02-28-2019"),
+               ("01-01-2023", None)]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Migrated database file with orders spread over 2015-2024."""
+    engine = database.create_sqlite_engine(Settings(database_url=f"sqlite:///{tmp_path / 'pier2.db'}"))
+    migrations.upgrade(engine)
+    with sessionmaker(bind=engine)() as db:
+        seed(db, num_customers=12)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def sessions(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def snapshot(db):
+    """Every history view and analytics result the API can serve."""
+    emails = [email for (email,) in db.query(models.Customer.email).order_by(models.Customer.id)]
+    results = {}
+    for email in emails:
+        for start_date, end_date in DATE_RANGES:
+            results[email, start_date, end_date] = crud.get_order_history(
+                email, db, start_date=start_date, end_date=end_date
+            )
+        pages, after = [], None
+        while True:
+            page = crud.get_order_history(email, db, limit=2, after=after)
+            if not page:
+                break
+            pages.append(page)
+            after = crud.encode_cursor(page[-1])
+        results[email, "pages"] = pages
+        if pages:
+            results[email, "before"] = crud.get_order_history(
+                email, db, limit=3, before=crud.encode_cursor(pages[-1][-1])
+            )
+            customer_id = crud.find_customer_id(email, db)
+            results[email, "iter"] = list(crud.iter_order_history(customer_id, db, batch_size=2))
+    for start_date, end_date in DATE_RANGES:
+        results["batch", start_date, end_date] = crud.get_order_histories(
+            emails, db, start_date=start_date, end_date=end_date
+        )
+    for name, params in ANALYTICS:
+        results[name, tuple(params.items())] = getattr(crud, name)(db, **params)
+    for name, params in SKETCH_ANALYTICS:
+        results[name, tuple(params.items())] = getattr(crud, name)(db, **params)
+    return results
+
+
+def rollup_rows(db):
+    return {
+        name: sorted(db.connection().exec_driver_sql(f"SELECT * FROM {name}").all()) for name in rollups.ROLLUPS
+    }
+
+
+def test_archiving_changes_no_result(engine, sessions):
+    with sessions() as db:
+        expected = snapshot(db)
+        total = db.query(models.Order).count()
+
+    moved = [partitions.archive(engine, year) for year in range(2015, 2020)]
+
+    assert [archived["year"] for archived in moved] == list(range(2015, 2020))
+    assert all(stat.S_IMODE(os.stat(archived["path"]).st_mode) == 0o444 for archived in moved)
+    with sessions() as db:
+        assert db.query(models.Order).count() == total - sum(archived["orders"] for archived in moved)
+        assert snapshot(db) == expected
+
+
+def test_rebuild_counts_archived_orders(engine, sessions, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(sketches, "EXACT_MAX_ROWS", -1)
+    with sessions() as db:
+        expected = rollup_rows(db)
+    # The seeded orders are still queued for the sketches: archiving folds them first
+    partitions.archive(engine, 2016)
+    partitions.archive(engine, 2018)
+    with sessions() as db:
+        estimates = [getattr(crud, name)(db, **params) for name, params in SKETCH_ANALYTICS]
+
+    with engine.begin() as conn:
+        rollups.rebuild(conn)
+        sketches.rebuild(conn)
+    with sessions() as db:
+        assert rollup_rows(db) == expected
+        assert [getattr(crud, name)(db, **params) for name, params in SKETCH_ANALYTICS] == estimates
+
+
+def test_rebuild_keeps_archived_orders_in_all_time_top_customers(engine, sessions):
+    # The seeded in-store orders fall in odd years
+    full_range = {"start_date": "01-01-2015", "end_date": "12-31-2024", "k": 20}
+    with sessions() as db:
+        expected = crud.get_top_instore_customer(db, k=20)
+    partitions.archive(engine, 2015)
+    partitions.archive(engine, 2017)
+
+    with engine.begin() as conn:
+        rollups.rebuild(conn)
+    with sessions() as db:
+        assert crud.get_top_instore_customer(db, k=20) == expected
+        assert crud.get_top_instore_customer(db, **full_range) == expected
+
+
+def test_reads_prune_archives_outside_the_dates(engine, sessions, monkeypatch):
+    for year in range(2015, 2020):
+        partitions.archive(engine, year)
+    read = []
+    fetch_partition = crud._fetch_partition
+    monkeypatch.setattr(crud, "_fetch_partition", lambda db, criteria, schema=None: (
+        read.append(schema) or fetch_partition(db, criteria, schema)
+    ))
+
+    with sessions() as db:
+        crud.get_order_history("customer11@example.com", db, start_date="01-01-2020")
+        assert read == [None]
+        read.clear()
+        crud.get_order_history("customer11@example.com", db, start_date="06-01-2016", end_date="01-31-2017")
+        assert read == [None, "archive_2016", "archive_2017"]
+        read.clear()
+        # The page fills up from the oldest archive, so later years are never read
+        page = crud.get_order_history("customer11@example.com", db, limit=1)
+        assert read == [None, "archive_2015"]
+        assert page[0]["timestamp"].startswith("2015")
+
+
+def test_history_without_archives_needs_no_extra_statements(engine, sessions):
+    with sessions() as db:
+        with count_queries(engine) as statements:
+            crud.get_order_history("customer5@example.com", db)
+        assert len(statements) == 3
+
+    partitions.archive(engine, 2016)
+    with sessions() as db:
+        with count_queries(engine) as statements:
+            crud.get_order_history("customer5@example.com", db, start_date="01-01-2020")
+        assert len(statements) == 3
+
+
+def test_writes_after_archiving_keep_unique_ids(engine, sessions):
+    with sessions() as db:
+        newest = db.query(models.Order.id).order_by(models.Order.id.desc()).first().id
+    for year in range(2015, 2025):
+        partitions.archive(engine, year)
+
+    address = {"type": "billing", "street": "1 Main St", "city": "Austin", "state": "TX", "zip_code": "73301"}
+    record = schemas.BulkOrder.model_validate({
+        "customer": {"email": "customer3@example.com"}, "timestamp": "2016-07-01T10:00:00", "in_store": True,
+        "billing_address": address, "items": [{"item_name": "Lamp", "shipping_address": address}],
+    })
+    with sessions() as db:
+        # The newest order stays hot, so ids keep counting up from it
+        assert db.get(models.Order, newest) is not None
+        [order_id] = crud.create_orders([record], db)
+        assert order_id == newest + 1
+        history = crud.get_order_history("customer3@example.com", db, start_date="01-01-2016", end_date="12-31-2016")
+        assert order_id in [order["order_id"] for order in history]
+        assert len({order["order_id"] for order in crud.get_order_history("customer3@example.com", db)}) == 5
+
+
+def test_archive_refuses_open_archived_or_empty_years(engine, tmp_path):
+    with pytest.raises(ValueError, match="not ended"):
+        partitions.archive(engine, datetime.now().year)
+    partitions.archive(engine, 2017)
+    with pytest.raises(ValueError, match="already archived"):
+        partitions.archive(engine, 2017)
+    assert partitions.archive(engine, 1999)["path"] is None
+    assert not os.path.exists(partitions.archive_path(str(tmp_path / "pier2.db"), 1999))
+
+
+def test_cli_archives_years_before(engine, sessions, capsys):
+    assert partitions.main(engine, ["archive", "--before", "2018", "--compact"]) == 0
+    assert partitions.main(engine, ["list"]) == 0
+
+    output = capsys.readouterr().out
+    assert [line.split(":")[0] for line in output.splitlines() if line[0].isdigit() or line.startswith("hot")] == [
+        "2015", "2016", "2017", "hot"
+    ]
+    with sessions() as db:
+        assert db.connection().exec_driver_sql("PRAGMA freelist_count").scalar() == 0
+        # Only the newest order, which always stays hot, is left of those years
+        newest = db.query(models.Order.id).order_by(models.Order.id.desc()).first().id
+        assert [order.id for order in db.query(models.Order).filter(models.Order.timestamp < datetime(2018, 1, 1))] == [
+            newest
+        ]
+
+
+def test_columnar_snapshot_reads_archives(engine, sessions, monkeypatch):
+    columnar = pytest.importorskip("app.columnar")
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(columnar, "_snapshot", columnar.Snapshot())
+    partitions.archive(engine, 2016)
+
+    with sessions() as db:
+        for name, params in ANALYTICS:
+            if not hasattr(columnar, name):
+                continue  # the API serves it from crud
+            assert getattr(columnar, name)(db, **params) == getattr(crud, name)(db, **params), name
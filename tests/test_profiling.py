@@ -0,0 +1,128 @@
+import dataclasses
+import logging
+
+import pytest
+from sqlalchemy import text
+
+from app import profiling
+from app.config import settings
+
+SLOW_SQL = text(
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < :n) SELECT count(*) FROM c"
+    " WHERE :email IS NOT NULL"
+)
+TOKEN = "s3cret"
+
+
+@pytest.fixture(autouse=True)
+def clear_profiles():
+    """Start every test without stored profiles."""
+    profiling.profiles.clear()
+
+
+@pytest.fixture
+def secured(monkeypatch):
+    """Configure a profile token for the admin routes and the profiling middleware."""
+    config = dataclasses.replace(settings, profile_token=TOKEN)
+    monkeypatch.setattr("app.main.settings", config)
+    monkeypatch.setattr(profiling, "settings", config)
+    return config
+
+
+def scope(headers=()):
+    return {"type": "http", "headers": [(name.encode(), value.encode()) for name, value in headers]}
+
+
+def test_trigger_by_header_token_and_sampling(monkeypatch):
+    # Without a configured token the header is ignored
+    assert profiling._trigger(scope([("x-profile", "1")]), settings) is None
+    assert profiling._trigger(scope([("x-profile", "")]), settings) is None
+    assert profiling._trigger(scope(), settings) is None
+
+    secured = dataclasses.replace(settings, profile_token="s3cret")
+    assert profiling._trigger(scope([("x-profile", "1")]), secured) is None
+    assert profiling._trigger(scope([("x-profile", "s3cret")]), secured) == "header"
+
+    sampled = dataclasses.replace(settings, profile_sample_rate=0.5)
+    monkeypatch.setattr(profiling.random, "random", lambda: 0.3)
+    assert profiling._trigger(scope(), sampled) == "sampled"
+    monkeypatch.setattr(profiling.random, "random", lambda: 0.7)
+    assert profiling._trigger(scope(), sampled) is None
+
+
+def test_ring_buffer_drops_oldest():
+    buffer = profiling.RingBuffer(2)
+    records = [profiling.SlowQuery("t", "-", 1.0, f"SELECT {i}", 0, [], []) for i in range(3)]
+    ids = [buffer.append(record) for record in records]
+
+    assert ids == [1, 2, 3]
+    assert [record.statement for record in buffer.items()] == ["SELECT 2", "SELECT 1"]
+    assert buffer.get(1) is None
+    assert buffer.get(3) is records[2]
+
+
+def test_profiled_request_is_captured(client, secured):
+    history = "/customer/customer3@example.com/orders"
+    assert "x-profile-id" not in client.get(history).headers
+    assert "x-profile-id" not in client.get(history, headers={"X-Profile": "1"}).headers
+
+    response = client.get(f"{history}?limit=2", headers={"X-Profile": TOKEN})
+    assert response.status_code == 200
+    profile_id = int(response.headers["x-profile-id"])
+
+    admin = {"X-Admin-Token": TOKEN}
+    summaries = client.get("/admin/profiles", headers=admin).json()
+    assert summaries[0]["id"] == profile_id
+    assert summaries[0]["path"] == "/customer/customer3@example.com/orders"
+    assert summaries[0]["query"] == "limit=2"
+    assert summaries[0]["trigger"] == "header"
+    assert summaries[0]["status"] == 200
+    assert summaries[0]["statements"] == 3
+
+    profile = client.get(f"/admin/profiles/{profile_id}?sort=tottime&limit=200", headers=admin).json()
+    # The crud call ran in the threadpool and is part of the merged profile
+    assert "get_order_history" in profile["report"]
+    assert client.get("/admin/profiles/999999", headers=admin).status_code == 404
+
+
+def test_admin_endpoints_require_configured_token(client, secured):
+    assert client.get("/admin/profiles").status_code == 403
+    assert client.get("/admin/slow_queries", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/profiles", headers={"X-Admin-Token": TOKEN}).status_code == 200
+
+
+def test_without_a_token_admin_endpoints_and_profiling_are_off(client):
+    assert not settings.profile_token
+    for path in ("/admin/profiles", "/admin/profiles/1", "/admin/slow_queries"):
+        assert client.get(path).status_code == 404
+        assert client.get(path, headers={"X-Admin-Token": ""}).status_code == 404
+
+    response = client.get("/customer/customer3@example.com/orders", headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert profiling.profiles.items() == []
+
+
+def test_slow_query_logged_with_plan_and_parameter_types(db, monkeypatch, caplog):
+    profiling.slow_queries.clear()
+    monkeypatch.setattr(profiling, "settings", dataclasses.replace(settings, slow_query_ms=1))
+
+    db.execute(text("SELECT id FROM customers WHERE email = :email"), {"email": "nobody@example.com"})
+    with caplog.at_level(logging.WARNING, logger="pier2.slow_queries"):
+        db.execute(SLOW_SQL, {"n": 300_000, "email": "private@example.com"})
+
+    [query] = [query for query in profiling.slow_queries.items() if "RECURSIVE" in query.statement]
+    assert "WITH RECURSIVE" in query.statement
+    assert (query.parameter_count, query.parameter_types) == (2, ["int", "str"])
+    # Parameter values (customer emails, phone numbers) are never kept or logged
+    assert "private@example.com" not in str(vars(query)) and "private@example.com" not in caplog.text
+    assert query.duration_ms >= 1
+    assert any("SCAN" in step for step in query.plan)
+    assert "Slow query" in caplog.text
+
+
+def test_slow_query_log_disabled(db, monkeypatch):
+    profiling.slow_queries.clear()
+    monkeypatch.setattr(profiling, "settings", dataclasses.replace(settings, slow_query_ms=0))
+    db.execute(SLOW_SQL, {"n": 300_000, "email": "private@example.com"})
+    assert profiling.slow_queries.items() == []
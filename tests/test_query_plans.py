@@ -0,0 +1,112 @@
+import re
+
+import pytest
+from sqlalchemy import event, inspect
+
+from app import crud, migrations, models
+
+
+# Summary tables are bounded by the number of zip codes / days and are meant to be read whole
+SCANNABLE_TABLES = {"billing_zip_counts", "shipping_zip_counts", "instore_hourly_counts"}
+# Scans some calls are built on: the FTS candidates are capped at search.MAX_CANDIDATES and ranked into a
+# page, and the exact top items fallback only runs on ranges of at most sketches.EXACT_MAX_ROWS items sold
+INTENDED_SCANS = {
+    "search_customers": {"candidates", "page"},
+    "search_customers_fuzzy": {"candidates", "page"},
+    "top_items": {"order_items"},
+    "top_items_by_zip": {"order_items"},
+}
+
+CURSOR = crud.encode_cursor({"timestamp": "2020-01-01T00:00:00", "order_id": 3})
+
+CRUD_CALLS = {
+    "order_history_by_email": lambda db: crud.get_order_history("customer5@example.com", db),
+    "order_history_by_phone": lambda db: crud.get_order_history("415-555-1003", db),
+    "order_history_page": lambda db: crud.get_order_history(
+        "customer5@example.com", db, limit=2, after=CURSOR, start_date="01-01-2016"
+    ),
+    "order_history_page_before": lambda db: crud.get_order_history(
+        "customer5@example.com", db, limit=2, before=CURSOR
+    ),
+    "order_history_stream": lambda db: list(crud.iter_order_history(1, db, batch_size=2)),
+    "orders_by_billing_zip": lambda db: crud.get_orders_grouped_by_billing_zip(db),
+    "orders_by_shipping_zip": lambda db: crud.get_orders_grouped_by_shipping_zip(db, order="asc"),
+    "peak_hour": lambda db: crud.get_peak_instore_purchase_hour(db),
+    "peak_hour_range": lambda db: crud.get_peak_instore_purchase_hour(
+        db, start_date="01-01-2018", end_date="12-31-2020", top_n=3
+    ),
+    "top_instore_customers": lambda db: crud.get_top_instore_customer(db),
+    "top_instore_customers_range": lambda db: crud.get_top_instore_customer(
+        db, start_date="01-01-2018", end_date="12-31-2020"
+    ),
+    "order_histories": lambda db: crud.get_order_histories(
+        ["customer5@example.com", "415-555-1003", "nobody@example.com"], db, start_date="01-01-2016"
+    ),
+    "search_customers": lambda db: crud.search_customers("customer5", db),
+    "search_customers_fuzzy": lambda db: crud.search_customers("custmer5@exa", db),
+    "search_customers_by_phone": lambda db: crud.search_customers("415-555", db),
+    "top_items": lambda db: crud.get_top_items(db),
+    "top_items_by_zip": lambda db: crud.get_top_items(
+        db, start_month="01-2016", end_month="12-2020", zip_code="94110"
+    ),
+    "distinct_customers_by_billing_zip": lambda db: crud.get_distinct_customers_by_billing_zip(db),
+    "distinct_customers_by_billing_zip_range": lambda db: crud.get_distinct_customers_by_billing_zip(
+        db, start_month="01-2016", end_month="12-2020", order="asc"
+    ),
+    "geo_counts": lambda db: crud.get_geo_counts(db),
+    "geo_counts_drill_down": lambda db: crud.get_geo_counts(
+        db, level="city", role="shipping", country="USA", in_store=True, start_month="02-2016", end_month="11-2020"
+    ),
+}
+
+
+def query_plans(engine, db, call):
+    """Run `call` and return (statement, plan details) for every SELECT it issued."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        call(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    plans = []
+    connection = db.connection()
+    for statement, parameters in statements:
+        if statement.lstrip().upper().startswith("SELECT"):
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            plans.append((statement, [row[3] for row in rows]))
+    return plans
+
+
+@pytest.mark.parametrize("name", CRUD_CALLS)
+def test_crud_queries_do_not_scan_tables(name, engine, seeded_db):
+    plans = query_plans(engine, seeded_db, CRUD_CALLS[name])
+    assert plans
+
+    allowed = SCANNABLE_TABLES | INTENDED_SCANS.get(name, set())
+    for statement, details in plans:
+        for detail in details:
+            # Tables of the exact sketch fallbacks are qualified with their schema ("main", or an archive)
+            scan = re.match(r"SCAN (?:\w+\.)?(\w+)", detail)
+            # A SELECT of scalar subqueries scans a single constant row, not a table
+            if scan and "INDEX" not in detail and detail != "SCAN CONSTANT ROW":
+                assert scan.group(1) in allowed, f"{detail} in plan for:\n{statement}"
+
+
+def test_upgrade_creates_missing_indexes(engine):
+    # Simulate a database from before the index migration
+    declared = {index.name for table in models.Base.metadata.sorted_tables for index in table.indexes}
+    with engine.begin() as conn:
+        for name in ("ix_orders_customer_id_timestamp", "ix_order_items_order_id", "ix_addresses_zip_code"):
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+        conn.exec_driver_sql(f"PRAGMA user_version = {migrations.MIGRATIONS.index(migrations._query_indexes)}")
+
+    migrations.upgrade(engine)
+
+    inspector = inspect(engine)
+    existing = {index["name"] for table in inspector.get_table_names() for index in inspector.get_indexes(table)}
+    assert declared <= existing
@@ -0,0 +1,233 @@
+import random
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app import crud, migrations, models, rollups
+from conftest import make_address, seed
+
+
+def scan_instore_hours(db):
+    """Reference hourly histogram computed the old way, by scanning every order."""
+    orders = db.query(models.Order).filter(models.Order.in_store == True).all()
+    return Counter(order.timestamp.hour for order in orders)
+
+
+def rollup_hours(db):
+    hours = Counter()
+    for row in db.query(models.InstoreHourlyCount):
+        hours[row.hour] += row.order_count
+    return hours
+
+
+def test_instore_hourly_rollup_tracks_writes(seeded_db):
+    assert rollup_hours(seeded_db) == scan_instore_hours(seeded_db)
+
+    # Flip, move and delete orders; the triggers must keep the rollup exact
+    orders = seeded_db.query(models.Order).order_by(models.Order.id).all()
+    orders[0].in_store = not orders[0].in_store
+    orders[1].timestamp = orders[1].timestamp.replace(hour=3)
+    for item in orders[2].items:
+        seeded_db.delete(item)
+    seeded_db.delete(orders[2])
+    seeded_db.commit()
+
+    assert rollup_hours(seeded_db) == scan_instore_hours(seeded_db)
+
+
+def test_peak_hour_matches_scan(seeded_db):
+    expected = scan_instore_hours(seeded_db)
+    peak = crud.get_peak_instore_purchase_hour(seeded_db, top_n=3)
+
+    counts = list(peak.values())
+    assert counts == sorted(expected.values(), reverse=True)[:3]
+
+
+def test_peak_hour_date_range(seeded_db):
+    orders = seeded_db.query(models.Order).filter(models.Order.in_store == True).all()
+    in_2020 = Counter(o.timestamp.hour for o in orders if o.timestamp.year == 2020)
+    peak = crud.get_peak_instore_purchase_hour(
+        seeded_db, start_date="01-01-2020", end_date="12-31-2020", top_n=24
+    )
+    assert sum(peak.values()) == sum(in_2020.values())
+
+
+def test_peak_hour_empty(db):
+    assert crud.get_peak_instore_purchase_hour(db) == {}
+
+
+def test_upgrade_backfills_existing_database():
+    # A database created before the rollup existed: tables only, no triggers
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    with Session(bind=engine) as db:
+        seed(db)
+        assert db.query(models.InstoreHourlyCount).count() == 0
+
+        migrations.upgrade(engine)
+        assert rollup_hours(db) == scan_instore_hours(db)
+        assert db.connection().exec_driver_sql("PRAGMA user_version").scalar() == len(migrations.MIGRATIONS)
+
+
+def scan_billing_zips(db):
+    """Reference billing zip counts from the original join + GROUP BY."""
+    rows = db.query(
+        models.Address.zip_code, func.count(models.Order.id)
+    ).join(
+        models.Order, models.Order.billing_address_id == models.Address.id
+    ).group_by(models.Address.zip_code).all()
+    return dict(rows)
+
+
+def scan_shipping_zips(db):
+    """Reference shipping zip counts from the original join + GROUP BY."""
+    rows = db.query(
+        models.Address.zip_code, func.count(models.OrderItem.id)
+    ).join(
+        models.OrderItem, models.OrderItem.shipping_address_id == models.Address.id
+    ).group_by(models.Address.zip_code).all()
+    return dict(rows)
+
+
+def assert_zip_parity(db):
+    billing = crud.get_orders_grouped_by_billing_zip(db)
+    shipping = crud.get_orders_grouped_by_shipping_zip(db, order="asc")
+    assert {row["zip_code"]: row["order_count"] for row in billing} == scan_billing_zips(db)
+    assert {row["zip_code"]: row["order_count"] for row in shipping} == scan_shipping_zips(db)
+    assert [row["order_count"] for row in billing] == sorted(scan_billing_zips(db).values(), reverse=True)
+    assert [row["order_count"] for row in shipping] == sorted(scan_shipping_zips(db).values())
+
+
+def test_zip_rollups_match_ad_hoc_queries(seeded_db):
+    assert_zip_parity(seeded_db)
+
+
+def test_zip_rollups_track_writes(seeded_db):
+    orders = seeded_db.query(models.Order).order_by(models.Order.id).all()
+
+    # Re-point an order and an item, re-zone an address, delete an order
+    orders[0].billing_address = make_address("99999", "billing")
+    orders[1].items[0].shipping_address_id = orders[2].items[0].shipping_address_id
+    orders[3].billing_address.zip_code = "10001"
+    for item in orders[4].items:
+        seeded_db.delete(item)
+    seeded_db.delete(orders[4])
+    seeded_db.commit()
+
+    assert_zip_parity(seeded_db)
+
+
+def test_rebuild_recomputes_rollups(engine, seeded_db):
+    seeded_db.execute(models.BillingZipCount.__table__.delete())
+    seeded_db.execute(models.ShippingZipCount.__table__.update().values(order_count=1))
+    seeded_db.commit()
+
+    assert rollups.main(engine) == 0
+    assert_zip_parity(seeded_db)
+
+
+def scan_top_customers(db, start=None, end=None, k=5):
+    """Reference top customers: in-store orders counted per customer, ties to the lower id."""
+    counts = Counter(
+        order.customer_id for order in db.query(models.Order).filter(models.Order.in_store == True)
+        if (start is None or order.timestamp.date() >= start) and (end is None or order.timestamp.date() <= end)
+    )
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+    emails = dict(db.query(models.Customer.id, models.Customer.email))
+    return [(emails[customer_id], count) for customer_id, count in ranked]
+
+
+def top_customers(db, **filters):
+    return [(row["email"], row["in_store_order_count"]) for row in crud.get_top_instore_customer(db, **filters)]
+
+
+def seed_random_orders(db, customers=40, orders=600):
+    rng = random.Random(7)
+    db.execute(models.Customer.__table__.insert(), [
+        {"id": i, "email": f"c{i}@example.com", "phone": f"415-555-{2000 + i}"} for i in range(1, customers + 1)
+    ])
+    db.execute(models.Order.__table__.insert(), [
+        {
+            # Skewed towards low ids so totals differ, with plenty of ties in narrow ranges
+            "customer_id": min(rng.randint(1, customers), rng.randint(1, customers)),
+            "timestamp": datetime(2020, 1, 1) + timedelta(days=rng.randrange(730), hours=rng.randrange(24)),
+            "in_store": rng.random() < 0.6,
+        }
+        for _ in range(orders)
+    ])
+    db.commit()
+
+
+RANGES = [
+    (None, None), ("01-01-2020", None), (None, "06-30-2020"), ("03-01-2020", "02-28-2021"),
+    ("07-04-2021", "07-20-2021"), ("05-05-2020", "05-05-2020"), ("01-01-2030", None),
+]
+
+
+@pytest.mark.parametrize("batch, rows_per_candidate", [(500, 16), (3, 1e-6), (3, 0.1), (500, 1e6)])
+def test_top_customers_match_scan(db, monkeypatch, batch, rows_per_candidate):
+    # Small batches exercise the early stop; candidate budgets range from unlimited to none (range scan only)
+    monkeypatch.setattr(crud, "TOP_CUSTOMERS_BATCH", batch)
+    monkeypatch.setattr(crud, "TOP_CUSTOMERS_ROWS_PER_CANDIDATE", rows_per_candidate)
+    seed_random_orders(db)
+
+    for start_date, end_date in RANGES:
+        start = crud.parse_date(start_date).date() if start_date else None
+        end = crud.parse_date(end_date).date() if end_date else None
+        for k in (1, 5, 12):
+            actual = top_customers(db, start_date=start_date, end_date=end_date, k=k)
+            assert actual == scan_top_customers(db, start, end, k), (start_date, end_date, k)
+
+
+def test_top_customers_end_date_includes_whole_day(seeded_db):
+    order = seeded_db.query(models.Order).filter(models.Order.in_store == True).order_by(models.Order.id).first()
+    day = order.timestamp.strftime("%m-%d-%Y")
+
+    assert top_customers(seeded_db, start_date=day, end_date=day, k=10) == scan_top_customers(
+        seeded_db, order.timestamp.date(), order.timestamp.date(), 10
+    )
+    assert top_customers(seeded_db, start_date=day, end_date=day, k=10)
+
+
+def test_top_customer_ties_go_to_lower_id(db):
+    db.execute(models.Customer.__table__.insert(), [{"id": i, "email": f"c{i}@example.com"} for i in (3, 1, 2)])
+    db.execute(models.Order.__table__.insert(), [
+        {"customer_id": customer_id, "timestamp": datetime(2021, 1, 1), "in_store": True} for customer_id in (3, 2, 1)
+    ])
+    db.commit()
+
+    assert [email for email, _ in top_customers(db, k=2)] == ["c1@example.com", "c2@example.com"]
+    assert [email for email, _ in top_customers(db, start_date="01-01-2021", k=2)] == [
+        "c1@example.com", "c2@example.com"
+    ]
+
+
+def test_customer_rollups_track_writes(db):
+    seed_random_orders(db, customers=10, orders=100)
+    orders = db.query(models.Order).order_by(models.Order.id).all()
+
+    # Flip in-store, move a day, re-point to another customer, delete
+    orders[0].in_store = not orders[0].in_store
+    orders[1].timestamp = orders[1].timestamp + timedelta(days=40)
+    orders[2].customer_id = 10 if orders[2].customer_id != 10 else 9
+    db.delete(orders[3])
+    db.commit()
+
+    daily = Counter()
+    for order in db.query(models.Order).filter(models.Order.in_store == True):
+        daily[order.customer_id, order.timestamp.date()] += 1
+    assert {(row.customer_id, row.day): row.order_count for row in db.query(models.InstoreCustomerDailyCount)} == daily
+    totals = Counter()
+    for (customer_id, _), count in daily.items():
+        totals[customer_id] += count
+    assert dict(db.query(models.InstoreCustomerCount.customer_id, models.InstoreCustomerCount.order_count)) == totals
+    assert top_customers(db, start_date="01-01-2020", k=10) == scan_top_customers(db, date(2020, 1, 1), None, 10)
+
+
+def test_top_customers_reject_bad_dates(seeded_db):
+    with pytest.raises(ValueError, match="MM-DD-YYYY"):
+        crud.get_top_instore_customer(seeded_db, start_date="2020-01-01")
@@ -0,0 +1,157 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, database, identifiers, models, schemas, search
+from app.main import app
+from conftest import seed
+
+
+@pytest.fixture
+def customers(db):
+    """Twelve seeded customers plus a few real-looking names."""
+    seed(db, num_customers=12)
+    db.add_all([
+        models.Customer(first_name="Jonathan", last_name="Smith", email="jon.smith@shop.com", phone="212-555-0101"),
+        models.Customer(first_name="Joanna", last_name="Smithers", email="jo@mail.com", phone="+44 20 7946 0958"),
+        models.Customer(first_name="Ana", last_name="Goldsmith", email="ana.g@mail.com"),
+    ])
+    db.commit()
+    return db
+
+
+def names(page):
+    return [f"{customer['first_name']} {customer['last_name']}" for customer in page["results"]]
+
+
+def assert_index_in_sync(db):
+    db.connection().exec_driver_sql("INSERT INTO customer_search (customer_search) VALUES ('integrity-check')")
+
+
+def test_matches_fragments_of_names_and_emails(customers):
+    assert names(crud.search_customers("smith", customers)) == ["Jonathan Smith", "Joanna Smithers", "Ana Goldsmith"]
+    assert names(crud.search_customers("SMITH jo", customers)) == ["Jonathan Smith", "Joanna Smithers"]
+    assert names(crud.search_customers("jon.smith@", customers)) == ["Jonathan Smith"]
+    assert names(crud.search_customers("ustomer1", customers)) == ["First1 Last1", "First10 Last10", "First11 Last11"]
+    # Every term must match, in any column
+    assert names(crud.search_customers("first1 last11", customers)) == ["First11 Last11"]
+    assert crud.search_customers("nobody", customers) == {
+        "results": [], "next_offset": None, "fuzzy": True, "truncated": False
+    }
+
+
+def test_results_carry_contact_details(customers):
+    [customer] = crud.search_customers("customer7@", customers)["results"]
+    assert customer == {
+        "id": crud.find_customer_id("customer7@example.com", customers), "first_name": "First7", "last_name": "Last7",
+        "email": "customer7@example.com", "phone": "415-555-1007",
+    }
+
+
+def test_phone_queries_match_number_prefixes(customers):
+    assert names(crud.search_customers("(415) 555-100", customers)) == [f"First{i} Last{i}" for i in range(10)]
+    assert names(crud.search_customers("4155551011", customers)) == ["First11 Last11"]
+    assert names(crud.search_customers("+44 20", customers)) == ["Joanna Smithers"]
+    assert names(crud.search_customers("212 555", customers)) == ["Jonathan Smith"]
+
+
+def test_fuzzy_fallback_tolerates_one_typo(customers):
+    assert crud.search_customers("smiht", customers, fuzzy=False)["results"] == []
+
+    page = crud.search_customers("smiht", customers)
+    assert page["fuzzy"] is True
+    assert set(names(page)) == {"Jonathan Smith", "Joanna Smithers", "Ana Goldsmith"}
+    assert names(crud.search_customers("jonahtan", customers)) == ["Jonathan Smith"]
+    # Exact matches never fall back
+    assert crud.search_customers("smith", customers)["fuzzy"] is False
+
+
+def test_pages_cover_every_match_once(customers):
+    seen, offset = [], 0
+    while offset is not None:
+        page = crud.search_customers("example.com", customers, limit=5, offset=offset)
+        seen += [customer["id"] for customer in page["results"]]
+        offset = page["next_offset"]
+    assert len(seen) == len(set(seen)) == 12
+
+    short_pages = [crud.search_customers("first1 la", customers, limit=2, offset=offset) for offset in (0, 2)]
+    assert [names(page) for page in short_pages] == [["First1 Last1", "First10 Last10"], ["First11 Last11"]]
+    assert short_pages[0]["next_offset"] == 2 and short_pages[1]["next_offset"] is None
+
+
+def test_every_match_is_filtered_and_ranked(customers):
+    customers.add_all([models.Customer(first_name="Bo", last_name="Goldsmith") for _ in range(1100)])
+    customers.add(models.Customer(first_name="Jo", last_name="Smith"))
+    customers.commit()
+
+    # Short terms filter every match before paging, and a whole "Smith" outranks the lower ids
+    assert names(crud.search_customers("jo smith", customers)) == ["Jo Smith", "Jonathan Smith", "Joanna Smithers"]
+    assert names(crud.search_customers("smith", customers, limit=1)) == ["Jo Smith"]
+    last = crud.search_customers("smith", customers, offset=1100)
+    assert len(last["results"]) == 4 and last["next_offset"] is None and last["fuzzy"] is False
+    past_the_end = crud.search_customers("smith", customers, offset=1104)
+    assert past_the_end == {"results": [], "next_offset": None, "fuzzy": False, "truncated": False}
+
+
+def test_ranking_covers_a_bounded_candidate_set(customers, monkeypatch):
+    customers.add_all([models.Customer(first_name="Bo", last_name="Goldsmith") for _ in range(10)])
+    customers.add(models.Customer(first_name="Jo", last_name="Smith"))
+    customers.commit()
+    monkeypatch.setattr(search, "MAX_CANDIDATES", 5)
+
+    page = crud.search_customers("smith", customers, limit=10)
+    assert len(page["results"]) == 5 and page["next_offset"] is None and page["truncated"] is True
+    assert set(names(page)) == {"Jonathan Smith", "Joanna Smithers", "Ana Goldsmith", "Bo Goldsmith"}
+    # Short terms still filter before the cap
+    page = crud.search_customers("jo smith", customers)
+    assert names(page) == ["Jo Smith", "Jonathan Smith", "Joanna Smithers"] and page["truncated"] is False
+
+
+def test_rejects_queries_without_a_long_enough_term(customers):
+    for query in ("", "jo", "a b", "12"):
+        with pytest.raises(ValueError, match="at least 3"):
+            crud.search_customers(query, customers)
+
+
+def test_triggers_keep_the_index_in_sync(customers):
+    jonathan = customers.query(models.Customer).filter_by(first_name="Jonathan").one()
+    jonathan.last_name = "Smythe"
+    customers.delete(customers.query(models.Customer).filter_by(first_name="Joanna").one())
+    customers.commit()
+    crud.ingest_orders([(0, schemas.BulkOrder.model_validate({
+        "customer": {"email": "new.smith@example.com"}, "timestamp": "2024-01-01T10:00:00", "in_store": True,
+        "billing_address": {"type": "billing", "street": "1 Main St", "city": "Austin", "state": "TX",
+                            "zip_code": "73301"},
+        "items": [],
+    }))], customers)
+
+    # Jonathan is still found through his email
+    assert set(names(crud.search_customers("smith", customers))) == {"Jonathan Smythe", "Ana Goldsmith", "None None"}
+    assert names(crud.search_customers("smythe", customers)) == ["Jonathan Smythe"]
+    assert_index_in_sync(customers)
+
+
+def test_identifier_merges_keep_the_index_in_sync(customers):
+    customers.connection().exec_driver_sql(
+        "INSERT INTO customers (first_name, email) VALUES ('Duplicate', 'Jon.Smith@shop.com ')"
+    )
+    identifiers.compact(customers.connection())
+    customers.commit()
+
+    assert names(crud.search_customers("jon.smith", customers)) == ["Jonathan Smith"]
+    assert_index_in_sync(customers)
+
+
+def test_search_endpoint(customers):
+    app.dependency_overrides[database.get_read_session] = lambda: customers
+    try:
+        client = TestClient(app)
+        page = client.get("/customers/search", params={"q": "smith", "limit": 2})
+        last = client.get("/customers/search", params={"q": "smith", "limit": 2, "offset": 2})
+        too_short = client.get("/customers/search", params={"q": "jo"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert page.status_code == 200
+    assert names(page.json()) == ["Jonathan Smith", "Joanna Smithers"] and page.json()["next_offset"] == 2
+    assert names(last.json()) == ["Ana Goldsmith"] and last.json()["next_offset"] is None
+    assert too_short.status_code == 422
@@ -0,0 +1,184 @@
+import random
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+pytest.importorskip("numpy")
+
+from app import crud, database, models, schemas, sketches
+from app.main import app
+
+
+def ingest(db, orders):
+    """Ingest (email, "YYYY-MM-DD", billing zip, [(item name, shipping zip), ...]) orders."""
+    records = [(index, schemas.BulkOrder.model_validate({
+        "customer": {"email": email}, "timestamp": f"{day}T12:00:00", "in_store": False,
+        "billing_address": address(billing_zip, "billing"),
+        "items": [{"item_name": name, "shipping_address": address(zip_code)} for name, zip_code in items],
+    })) for index, (email, day, billing_zip, items) in enumerate(orders)]
+    result = crud.ingest_orders(records, db)
+    assert not result["errors"]
+
+
+def address(zip_code, type="shipping"):
+    return {"street": "1 Pier Way", "city": "Oakland", "state": "CA", "zip_code": zip_code, "type": type}
+
+
+@pytest.fixture
+def approximate(monkeypatch):
+    """Answer from the sketches however little data there is."""
+    monkeypatch.setattr(sketches, "EXACT_MAX_ROWS", -1)
+
+
+def test_count_min_sketch_never_undercounts():
+    rng = random.Random(1)
+    cms, true = sketches.CountMinSketch(), Counter()
+    for _ in range(20000):
+        key = f"item{int(rng.paretovariate(1.2))}"
+        cms.add(key)
+        true[key] += 1
+
+    assert cms.total == 20000
+    assert all(true[key] <= cms.estimate(key) <= true[key] + cms.error_bound() for key in true)
+    round_trip, _ = sketches.load(sketches.ITEMS, sketches.ALL_ZIPS, sketches._dump(
+        sketches.ITEMS, sketches.ALL_ZIPS, (sketches.HeavyHitters(), cms)
+    ))
+    assert round_trip.counts == {}
+
+
+def test_heavy_hitters_keep_frequent_keys_within_their_error(monkeypatch):
+    # "hot" is a third of the keys and "warm" 13%, both over 1/(8 + 1)
+    monkeypatch.setattr(sketches, "HEAVY_HITTERS", 8)
+    first, second, true = sketches.HeavyHitters(), sketches.HeavyHitters(), Counter()
+    for i in range(1000):
+        key = "hot" if i % 3 == 0 else "warm" if i % 5 == 0 else f"cold{i}"
+        (first if i % 2 else second).add(key)
+        true[key] += 1
+    first.merge(second)
+
+    assert len(first.counts) <= 8
+    assert [key for key, _ in first.top(2)] == ["hot", "warm"]
+    assert 0 < first.error <= 1000 / 9
+    assert all(true[key] - first.error <= count <= true[key] for key, count in first.counts.items())
+
+
+def test_hyperloglog_estimates_and_merges():
+    first, second, both = sketches.HyperLogLog(), sketches.HyperLogLog(), sketches.HyperLogLog()
+    first.add(range(0, 60000))
+    second.add(range(40000, 100000))
+    both.add(range(0, 100000))
+    first.merge(second)
+
+    # Merging equals counting the union, and stays within 4 standard errors
+    assert (first.registers == both.registers).all()
+    assert abs(first.estimate() - 100000) < 4 * sketches.HyperLogLog.STANDARD_ERROR * 100000
+    small = sketches.HyperLogLog()
+    small.add([7, 7, 8, 9])
+    assert small.estimate() == 3
+    assert sketches.HyperLogLog().estimate() == 0
+
+
+@pytest.mark.parametrize("fold_batch", [1, sketches.FOLD_BATCH])
+def test_ingestion_keeps_sketches_current(db, approximate, monkeypatch, fold_batch):
+    monkeypatch.setattr(sketches, "FOLD_BATCH", fold_batch)
+    ingest(db, [
+        ("a@example.com", "2023-01-05", "94110", [("Chair", "10001"), ("Lamp", "10001")]),
+        ("b@example.com", "2023-01-20", "94110", [("Chair", "60614")]),
+        ("a@example.com", "2023-02-01", "10001", [("Chair", "10001"), ("Sofa", "10001")]),
+        ("c@example.com", "2024-07-04", "94110", [("Lamp", "60614")]),
+    ])
+
+    # Fewer orders than a fold batch stay queued, and reads merge them in
+    assert db.query(models.SketchPending).count() == (0 if fold_batch == 1 else 4)
+    assert crud.get_top_items(db) == {
+        "items": [{"item_name": "Chair", "count": 3}, {"item_name": "Lamp", "count": 2},
+                  {"item_name": "Sofa", "count": 1}],
+        "approximate": True, "max_error": 1,
+    }
+    assert crud.get_top_items(db, zip_code="10001", k=1) == {
+        "items": [{"item_name": "Chair", "count": 2}], "approximate": True, "max_error": 0,
+    }
+    assert crud.get_top_items(db, zip_code="99999") == {"items": [], "approximate": True, "max_error": 0}
+    assert crud.get_top_items(db, start_month="02-2023", end_month="12-2024")["items"] == [
+        {"item_name": "Chair", "count": 1}, {"item_name": "Lamp", "count": 1}, {"item_name": "Sofa", "count": 1},
+    ]
+    assert crud.get_distinct_customers_by_billing_zip(db) == {
+        "zip_codes": [{"zip_code": "94110", "distinct_customers": 3}, {"zip_code": "10001", "distinct_customers": 1}],
+        "approximate": True, "standard_error": 0.0163,
+    }
+    assert crud.get_distinct_customers_by_billing_zip(db, end_month="01-2023", order="asc")["zip_codes"] == [
+        {"zip_code": "94110", "distinct_customers": 2},
+    ]
+
+
+def test_sketch_answers_match_exact_ones(seeded_db, monkeypatch):
+    # Orders written outside ingestion stay queued until the next fold
+    assert seeded_db.query(models.SketchPending).count() == seeded_db.query(models.Order).count()
+    assert sketches.fold(seeded_db.connection(), minimum=seeded_db.query(models.Order).count() + 1) == 0
+    sketches.fold(seeded_db.connection())
+    seeded_db.commit()
+
+    ranges = [{}, {"start_month": "03-2016"}, {"end_month": "06-2019"}]
+    for params in ranges + [{"start_month": "02-2017", "end_month": "11-2017"}]:
+        queries = [
+            ("get_top_items", dict(params, k=3)),
+            ("get_top_items", dict(params, zip_code="10001")),
+            ("get_distinct_customers_by_billing_zip", params),
+        ]
+        for name, query in queries:
+            exact = getattr(crud, name)(seeded_db, **query)
+            monkeypatch.setattr(sketches, "EXACT_MAX_ROWS", -1)
+            estimated = getattr(crud, name)(seeded_db, **query)
+            monkeypatch.undo()
+            assert not exact["approximate"] and estimated["approximate"]
+            # Five item names and a few customers per zip code: no collisions, so the estimates are exact
+            assert next(iter(exact.values())) == next(iter(estimated.values())), (name, query)
+
+
+def test_rebuild_matches_incremental_folds(seeded_db, approximate):
+    sketches.fold(seeded_db.connection())
+    seeded_db.commit()
+    folded = (crud.get_top_items(seeded_db), crud.get_distinct_customers_by_billing_zip(seeded_db))
+
+    sketches.rebuild(seeded_db.connection())
+    seeded_db.commit()
+    assert (crud.get_top_items(seeded_db), crud.get_distinct_customers_by_billing_zip(seeded_db)) == folded
+
+
+def test_ranges_merge_whole_years_and_remaining_months(seeded_db):
+    sketches.fold(seeded_db.connection())
+    conn = seeded_db.connection()
+
+    assert sketches.buckets(conn, sketches.ITEMS) == [str(year) for year in range(2015, 2025)]
+    assert sketches.buckets(conn, sketches.ITEMS, "2016-11", "2018-02") == [
+        "2016-11", "2016-12", "2017", "2018-01", "2018-02",
+    ]
+    assert sketches.counted(conn, sketches.ITEMS) == seeded_db.query(models.OrderItem).count()
+    assert sketches.counted(conn, sketches.CUSTOMERS, "2016-11", "2018-02") == seeded_db.query(models.Order).filter(
+        models.Order.timestamp >= datetime(2016, 11, 1), models.Order.timestamp < datetime(2018, 3, 1)
+    ).count()
+
+
+def test_rejects_bad_parameters(db):
+    for params in ({"start_month": "2024-01"}, {"start_month": "05-2024", "end_month": "04-2024"}, {"k": 65}):
+        with pytest.raises(ValueError):
+            crud.get_top_items(db, **params)
+
+
+def test_sketch_endpoints(seeded_db):
+    app.dependency_overrides[database.get_read_session] = lambda: seeded_db
+    try:
+        client = TestClient(app)
+        items = client.get("/analytics/top_items", params={"k": 2, "zip_code": "94110"})
+        customers = client.get("/analytics/distinct_customers_by_zip", params={"start_month": "01-2020"})
+        invalid = client.get("/analytics/top_items", params={"end_month": "13-2020"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert items.status_code == 200
+    assert items.json() == crud.get_top_items(seeded_db, k=2, zip_code="94110")
+    assert len(items.json()["items"]) == 2 and not items.json()["approximate"]
+    assert customers.json() == crud.get_distinct_customers_by_billing_zip(seeded_db, start_month="01-2020")
+    assert invalid.status_code == 422
@@ -0,0 +1,86 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import load_sample_data
+from app import migrations
+from app.database import create_sqlite_engine
+from app.config import Settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, db_path, **env):
+    completed = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT,
+        env={**os.environ, "PIER2_DATABASE_URL": f"sqlite:///{db_path}", **env},
+    )
+    return completed.stdout.strip().splitlines()[-1]
+
+
+START_APP = """
+import asyncio, json, os, sys
+from app.main import app
+state = {"faker": "faker" in sys.modules, "exists_after_import": os.path.exists(sys.argv[-1])}
+async def ready():
+    async with app.router.lifespan_context(app):
+        pass
+asyncio.run(ready())
+print(json.dumps(state))
+"""
+
+
+def count_customers(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_import_is_side_effect_free_and_lifespan_sets_up_once(tmp_path):
+    db_path = tmp_path / "fresh.db"
+    code = START_APP.replace("sys.argv[-1]", repr(str(db_path)))
+
+    state = json.loads(run_python(code, db_path))
+
+    assert state == {"faker": False, "exists_after_import": False}
+    customers = count_customers(db_path)
+    assert customers == 100
+
+    # A second start finds the database current and populated and changes nothing
+    json.loads(run_python(code, db_path))
+    assert count_customers(db_path) == customers
+
+
+def test_auto_setup_can_be_disabled(tmp_path):
+    db_path = tmp_path / "fresh.db"
+    run_python(START_APP.replace("sys.argv[-1]", repr(str(db_path))), db_path, PIER2_AUTO_SETUP="0")
+    assert not db_path.exists() or os.path.getsize(db_path) == 0
+
+
+def test_migrations_cli_and_pending(tmp_path):
+    db_path = tmp_path / "migrated.db"
+    engine = create_sqlite_engine(Settings(database_url=f"sqlite:///{db_path}"))
+    assert migrations.pending(engine) == len(migrations.MIGRATIONS)
+    engine.dispose()
+
+    output = run_python("import runpy; runpy.run_module('app.migrations', run_name='__main__')", db_path)
+
+    assert output == f"Applied {len(migrations.MIGRATIONS)} migration(s); schema version {len(migrations.MIGRATIONS)}."
+    engine = create_sqlite_engine(Settings(database_url=f"sqlite:///{db_path}"))
+    assert migrations.pending(engine) == 0
+    engine.dispose()
+
+
+def test_load_data_leaves_sys_argv_alone(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sys, "argv", ["uvicorn", "app.main:app"])
+    monkeypatch.setattr(load_sample_data, "main", lambda argv=None: calls.append(argv))
+
+    load_sample_data.load_data()
+
+    assert calls == [["--auto"]]
+    assert sys.argv == ["uvicorn", "app.main:app"]
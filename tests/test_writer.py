@@ -0,0 +1,161 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, database, migrations, models, schemas, writer
+from app.config import Settings
+from app.main import app
+
+
+def order(i, in_store=True):
+    address = {"type": "billing", "street": f"{i} Main St", "city": "Austin", "state": "TX", "zip_code": "73301"}
+    return schemas.BulkOrder.model_validate({
+        "customer": {"email": f"buyer{i % 7}@example.com"},
+        "timestamp": "2024-03-01T10:00:00",
+        "in_store": in_store,
+        "billing_address": address,
+        "items": [{"item_name": "Lamp", "shipping_address": {**address, "type": "shipping"}}],
+    })
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    """Sessions on a migrated database file, which the writer thread and the test can both use."""
+    engine = database.create_sqlite_engine(Settings(database_url=f"sqlite:///{tmp_path / 'pier2.db'}"))
+    migrations.upgrade(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+class CountingSessions:
+    """Session factory counting the sessions (one per batch) the writer opens, optionally holding them."""
+
+    def __init__(self, sessions, gate=None):
+        self.sessions = sessions
+        self.gate = gate
+        self.opened = 0
+
+    def __call__(self):
+        self.opened += 1
+        if self.gate is not None:
+            self.gate.wait()
+        return self.sessions()
+
+
+def test_concurrent_orders_share_transactions(sessions):
+    factory = CountingSessions(sessions)
+    group_writer = writer.GroupCommitWriter(factory, max_batch=100, max_delay_ms=200)
+    batches_before = writer.BATCH_RECORDS.value()[0]
+
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        futures = list(pool.map(group_writer.submit, [order(i) for i in range(20)]))
+    order_ids = [future.result(timeout=10) for future in futures]
+    group_writer.close()
+
+    assert len(set(order_ids)) == 20
+    assert factory.opened < 5
+    assert writer.BATCH_RECORDS.value()[0] - batches_before == factory.opened
+    with sessions() as db:
+        assert db.query(models.Order).count() == 20
+        assert db.query(models.Customer).count() == 7
+        assert db.query(models.OrderItem).filter(models.OrderItem.order_id.in_(order_ids)).count() == 20
+
+
+def test_batches_respect_max_records(sessions):
+    gate = threading.Event()
+    factory = CountingSessions(sessions, gate)
+    group_writer = writer.GroupCommitWriter(factory, max_batch=3, max_delay_ms=0)
+
+    futures = [group_writer.submit(order(i)) for i in range(7)]
+    gate.set()
+    assert len({future.result(timeout=10) for future in futures}) == 7
+    group_writer.close()
+
+    # However the first batch forms, the orders queued behind it are written three at a time
+    assert factory.opened == 3
+
+
+def test_rejected_order_does_not_fail_its_batch(sessions):
+    with sessions() as db:
+        db.connection().exec_driver_sql("""
+            CREATE TRIGGER reject_online BEFORE INSERT ON orders WHEN NOT NEW.in_store
+            BEGIN SELECT RAISE(ABORT, 'online orders are closed'); END""")
+        db.commit()
+    gate = threading.Event()
+    group_writer = writer.GroupCommitWriter(CountingSessions(sessions, gate), max_delay_ms=0)
+
+    futures = [group_writer.submit(order(i, in_store=i != 2)) for i in range(4)]
+    gate.set()
+
+    with pytest.raises(SQLAlchemyError, match="online orders are closed"):
+        futures[2].result(timeout=10)
+    assert all(isinstance(futures[i].result(timeout=10), int) for i in (0, 1, 3))
+    group_writer.close()
+
+
+def test_full_queue_rejects_new_orders(sessions):
+    gate = threading.Event()
+    factory = CountingSessions(sessions, gate)
+    group_writer = writer.GroupCommitWriter(factory, max_delay_ms=0, max_pending=2)
+    rejected_before = writer.REJECTED.value()
+
+    first = group_writer.submit(order(0))
+    # Wait until the writer has taken the first order and is blocked on its session
+    while not factory.opened:
+        time.sleep(0.001)
+    queued = [group_writer.submit(order(i)) for i in (1, 2)]
+    assert group_writer.depth == 2
+    with pytest.raises(writer.Overloaded):
+        group_writer.submit(order(3))
+    assert writer.REJECTED.value() == rejected_before + 1
+
+    gate.set()
+    assert [future.result(timeout=10) for future in (first, *queued)]
+    group_writer.close()
+
+
+def test_close_writes_admitted_orders_then_rejects(sessions):
+    group_writer = writer.GroupCommitWriter(sessions, max_delay_ms=50)
+    futures = [group_writer.submit(order(i)) for i in range(5)]
+    group_writer.close()
+
+    assert all(future.done() and future.exception() is None for future in futures)
+    with pytest.raises(writer.Overloaded):
+        group_writer.submit(order(5))
+
+
+@pytest.fixture
+def app_writer(sessions, monkeypatch):
+    group_writer = writer.GroupCommitWriter(sessions, max_delay_ms=0)
+    monkeypatch.setattr(writer, "_writer", group_writer)
+    yield group_writer
+    group_writer.close()
+
+
+def test_create_order_endpoint(app_writer, sessions):
+    client = TestClient(app)
+    response = client.post("/orders", json=order(1).model_dump(mode="json"))
+
+    assert response.status_code == 201
+    with sessions() as db:
+        history = crud.get_order_history("buyer1@example.com", db)
+    assert [entry["order_id"] for entry in history] == [response.json()["order_id"]]
+    assert "pier2_write_queue_depth 0" in client.get("/metrics").text
+
+    assert client.post("/orders", json={"in_store": True}).status_code == 422
+
+
+def test_create_order_endpoint_overloaded(app_writer, monkeypatch):
+    def overloaded(record):
+        raise writer.Overloaded("10000 orders are already waiting to be written")
+
+    monkeypatch.setattr(app_writer, "submit", overloaded)
+    response = TestClient(app).post("/orders", json=order(1).model_dump(mode="json"))
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"